@@ -0,0 +1,247 @@
+"""
+Write-behind recorder cho thống kê truy cập (nick.last_active, user_access,
+user_ip_log).
+
+- record() được gọi từ middleware trên event loop: chỉ dedupe (mỗi user tối
+  đa một sự kiện / ACCESS_DEDUPE_SECONDS) rồi đẩy vào hàng đợi in-memory.
+- flush() gom các sự kiện theo user / (user, ngày) / (user, IP) và ghi trong
+  MỘT transaction: bulk UPDATE nick, upsert user_access
+  (INSERT ... ON CONFLICT (user_id, access_date) DO UPDATE), bulk UPDATE /
+  INSERT user_ip_log.
+- Map dedupe và hàng đợi đều có giới hạn; vượt quá thì bỏ sự kiện cũ nhất.
+- Flush lỗi (DB chập chờn): lô được đưa lại đầu hàng đợi (trong giới hạn
+  ACCESS_QUEUE_MAX) để lần sau ghi lại; lỗi liên tiếp ACCESS_FLUSH_MAX_RETRIES
+  lần thì bỏ lô. Sự kiện bị bỏ được đếm ở access_events_total{result="dropped"}.
+- start() đăng ký flush() định kỳ trên background queue "access".
+"""
+
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict, deque
+from datetime import date, datetime
+from typing import Optional
+
+from sqlalchemy import bindparam, insert, select, tuple_, update
+
+import background
+import database
+import metrics
+import models
+from utils_geo import get_ip_location
+
+logger = logging.getLogger(__name__)
+
+_FLUSH_SECONDS = float(os.getenv("ACCESS_FLUSH_SECONDS", "5"))
+_DEDUPE_SECONDS = float(os.getenv("ACCESS_DEDUPE_SECONDS", "60"))
+_DEDUPE_MAX_USERS = int(os.getenv("ACCESS_DEDUPE_MAX_USERS", "10000"))
+_QUEUE_MAX = int(os.getenv("ACCESS_QUEUE_MAX", "10000"))
+_FLUSH_MAX_RETRIES = int(os.getenv("ACCESS_FLUSH_MAX_RETRIES", "5"))
+
+# (username, ip, user_agent, datetime, date)
+_queue: deque = deque()
+_last_seen: OrderedDict[str, float] = OrderedDict()
+_lock = threading.Lock()
+_flush_lock = threading.Lock()
+_failed_flushes = 0  # số lần flush lỗi liên tiếp
+
+_m_events = metrics.counter("access_events_total", "Access events seen by the recorder", ("result",))
+_m_flush = metrics.histogram("access_flush_seconds", "Duration of one access-stats flush")
+_m_queue = metrics.gauge("access_queue_depth", "Access events waiting to be flushed")
+_m_queue.set_function(lambda: {(): len(_queue)})
+
+
+def record(username: str, ip_address: str = "", user_agent: str = "") -> None:
+    """Ghi nhận một lượt truy cập (không chạm DB)."""
+    now = time.monotonic()
+    with _lock:
+        last = _last_seen.get(username)
+        if last is not None and now - last < _DEDUPE_SECONDS:
+            _m_events.inc(result="deduped")
+            return
+        _last_seen[username] = now
+        _last_seen.move_to_end(username)
+        while len(_last_seen) > _DEDUPE_MAX_USERS:
+            _last_seen.popitem(last=False)
+        if len(_queue) >= _QUEUE_MAX:
+            _queue.popleft()
+            _m_events.inc(result="dropped")
+        current = datetime.now()
+        _queue.append((username, (ip_address or "").strip(), user_agent or "", current, current.date()))
+    _m_events.inc(result="queued")
+
+
+def _drain() -> list[tuple]:
+    with _lock:
+        events = list(_queue)
+        _queue.clear()
+    return events
+
+
+def _requeue(events: list[tuple]) -> int:
+    """Đưa lô ghi lỗi về đầu hàng đợi (giữ phần mới nhất vừa chỗ trống); trả về số bị bỏ."""
+    with _lock:
+        room = max(0, _QUEUE_MAX - len(_queue))
+        kept = events[len(events) - room:] if room < len(events) else events
+        _queue.extendleft(reversed(kept))
+    return len(events) - len(kept)
+
+
+def flush() -> int:
+    """Ghi toàn bộ sự kiện đang chờ xuống DB. Trả về số sự kiện đã ghi."""
+    global _failed_flushes
+    with _flush_lock:
+        events = _drain()
+        if not events:
+            return 0
+        started = time.perf_counter()
+        db = database.SessionLocal()
+        try:
+            _write(db, events)
+            db.commit()
+        except Exception as e:
+            db.rollback()
+            _failed_flushes += 1
+            if _failed_flushes > _FLUSH_MAX_RETRIES:
+                dropped = len(events)
+                _failed_flushes = 0
+            else:
+                dropped = _requeue(events)
+            if dropped:
+                _m_events.inc(dropped, result="dropped")
+            logger.error(f"Access stats flush failed ({len(events)} events, {dropped} dropped): {e}")
+            return 0
+        finally:
+            db.close()
+            _m_flush.observe(time.perf_counter() - started)
+        _failed_flushes = 0
+        return len(events)
+
+
+def _write(db, events: list[tuple]) -> None:
+    usernames = {e[0] for e in events}
+    user_ids = dict(db.execute(
+        select(models.Nick.username, models.Nick.id).where(models.Nick.username.in_(usernames))
+    ).all())
+
+    latest: dict[int, tuple] = {}              # user_id -> (seen_at, ip)
+    daily: dict[tuple[int, date], int] = {}    # (user_id, day) -> hits
+    ips: dict[tuple[int, str], list] = {}      # (user_id, ip) -> [hits, seen_at, user_agent]
+    for username, ip, ua, seen_at, day in events:
+        user_id = user_ids.get(username)
+        if user_id is None:
+            continue
+        latest[user_id] = (seen_at, ip or latest.get(user_id, (None, ""))[1])
+        daily[(user_id, day)] = daily.get((user_id, day), 0) + 1
+        if ip and ip != "unknown":
+            slot = ips.setdefault((user_id, ip), [0, seen_at, ua])
+            slot[0] += 1
+            slot[1] = seen_at
+            slot[2] = ua or slot[2]
+    if not latest:
+        return
+
+    conn = db.connection()
+    locations = _write_ip_logs(conn, ips)
+
+    nick = models.Nick.__table__
+    conn.execute(
+        update(nick)
+        .where(nick.c.id == bindparam("b_id"))
+        .values(last_active=bindparam("b_seen")),
+        [{"b_id": uid, "b_seen": seen_at} for uid, (seen_at, _) in latest.items()],
+    )
+    with_ip = [
+        {"b_id": uid, "b_ip": ip, "b_location": locations.get((uid, ip))}
+        for uid, (_, ip) in latest.items() if ip and ip != "unknown"
+    ]
+    if with_ip:
+        conn.execute(
+            update(nick)
+            .where(nick.c.id == bindparam("b_id"))
+            .values(last_ip=bindparam("b_ip"), last_location=bindparam("b_location")),
+            with_ip,
+        )
+
+    _upsert_daily(conn, daily)
+
+
+def _upsert_daily(conn, daily: dict[tuple[int, date], int]) -> None:
+    table = models.UserAccess.__table__
+    if conn.dialect.name == "postgresql":
+        from sqlalchemy.dialects.postgresql import insert as dialect_insert
+    else:
+        from sqlalchemy.dialects.sqlite import insert as dialect_insert
+    stmt = dialect_insert(table)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[table.c.user_id, table.c.access_date],
+        set_={"count": table.c.count + stmt.excluded.count, "last_update": stmt.excluded.last_update},
+    )
+    now = datetime.now()
+    conn.execute(stmt, [
+        {"user_id": uid, "access_date": day, "count": hits, "last_update": now}
+        for (uid, day), hits in daily.items()
+    ])
+
+
+def _write_ip_logs(conn, ips: dict[tuple[int, str], list]) -> dict[tuple[int, str], Optional[str]]:
+    """Cập nhật / tạo user_ip_log; trả về location theo (user_id, ip)."""
+    if not ips:
+        return {}
+    table = models.UserIpLog.__table__
+    existing = {
+        (row.user_id, row.ip_address): (row.id, row.location, row.user_agent)
+        for row in conn.execute(
+            select(table.c.id, table.c.user_id, table.c.ip_address, table.c.location, table.c.user_agent)
+            .where(tuple_(table.c.user_id, table.c.ip_address).in_(list(ips)))
+        )
+    }
+
+    locations: dict[tuple[int, str], Optional[str]] = {}
+    updates, inserts = [], []
+    for (uid, ip), (hits, seen_at, ua) in ips.items():
+        row = existing.get((uid, ip))
+        if row is not None:
+            row_id, location, old_ua = row
+            locations[(uid, ip)] = location
+            updates.append({"b_id": row_id, "b_hits": hits, "b_seen": seen_at, "b_ua": ua or old_ua})
+            continue
+        # IP mới — geo lookup (đang ở thread nền, không chặn event loop)
+        geo = get_ip_location(ip)
+        location = geo.get("location", "Unknown")
+        locations[(uid, ip)] = location
+        inserts.append({
+            "user_id": uid, "ip_address": ip, "location": location,
+            "first_seen": seen_at, "last_seen": seen_at, "hit_count": hits,
+            "city": geo.get("city"), "region": geo.get("region"),
+            "country_code": geo.get("country_code"), "district": geo.get("district"),
+            "lat": geo.get("lat"), "lon": geo.get("lon"),
+            "isp": geo.get("isp"), "org": geo.get("org"),
+            "is_mobile": geo.get("is_mobile", False), "is_proxy": geo.get("is_proxy", False),
+            "is_hosting": geo.get("is_hosting", False), "user_agent": ua or None,
+        })
+
+    if updates:
+        conn.execute(
+            update(table)
+            .where(table.c.id == bindparam("b_id"))
+            .values(
+                hit_count=table.c.hit_count + bindparam("b_hits"),
+                last_seen=bindparam("b_seen"),
+                user_agent=bindparam("b_ua"),
+            ),
+            updates,
+        )
+    if inserts:
+        conn.execute(insert(table), inserts)
+    return locations
+
+
+def start() -> None:
+    background.every("access-flush", _FLUSH_SECONDS, flush, queue_name="access")
+
+
+def stop() -> None:
+    """Ghi nốt các sự kiện còn lại (gọi lúc shutdown, sau background.shutdown())."""
+    flush()
@@ -0,0 +1,212 @@
+"""
+Background job subsystem: named bounded queues, each with its own worker threads.
+
+- queue(name, workers, max_size, policy) khai báo một queue; submit() đẩy job.
+  Queue đầy: policy "drop_new" bỏ job mới, "drop_oldest" bỏ job cũ nhất đang chờ.
+- key=...: job cùng key đang chờ trong queue thì job mới được gộp (coalesce).
+- every(name, interval, fn) chạy fn định kỳ qua queue "periodic" (key = name,
+  nên một lần chạy chậm không làm job dồn lại).
+- shutdown() dừng scheduler, chờ các queue chạy hết job đang chờ (có timeout).
+- Metrics: độ sâu queue, lag (thời gian chờ trong queue), thời gian chạy,
+  số job ok / error / dropped / coalesced theo queue.
+
+Job là hàm sync (DB, geo lookup, bcrypt...) nên worker là thread; không dùng
+chung default executor của event loop với request handler.
+"""
+
+import logging
+import threading
+import time
+from collections import deque
+from typing import Any, Callable, Optional
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+_m_jobs = metrics.counter("background_jobs_total", "Background jobs by outcome", ("queue", "result"))
+_m_lag = metrics.histogram("background_job_lag_seconds", "Time a job waited in its queue", ("queue",))
+_m_duration = metrics.histogram("background_job_seconds", "Background job run time", ("queue",))
+_m_depth = metrics.gauge("background_queue_depth", "Jobs waiting per background queue", ("queue",))
+
+
+class _Job:
+    __slots__ = ("fn", "args", "key", "enqueued_at")
+
+    def __init__(self, fn: Callable[..., Any], args: tuple, key: Optional[str]):
+        self.fn = fn
+        self.args = args
+        self.key = key
+        self.enqueued_at = time.monotonic()
+
+
+class JobQueue:
+    def __init__(self, name: str, workers: int = 1, max_size: int = 100, policy: str = "drop_new"):
+        self.name = name
+        self.max_size = max_size
+        self.policy = policy
+        self._jobs: deque[_Job] = deque()
+        self._pending_keys: dict[str, _Job] = {}
+        self._cond = threading.Condition()
+        self._running = 0
+        self._closed = False
+        self._threads = [
+            threading.Thread(target=self._work, name=f"bg-{name}-{i}", daemon=True) for i in range(max(1, workers))
+        ]
+        for thread in self._threads:
+            thread.start()
+
+    def submit(self, fn: Callable[..., Any], *args, key: Optional[str] = None) -> bool:
+        """Đẩy job vào queue. False nếu job bị bỏ (queue đầy / đã đóng) hoặc bị gộp."""
+        with self._cond:
+            if self._closed:
+                _m_jobs.inc(queue=self.name, result="dropped")
+                return False
+            if key is not None and key in self._pending_keys:
+                _m_jobs.inc(queue=self.name, result="coalesced")
+                return False
+            if len(self._jobs) >= self.max_size:
+                if self.policy != "drop_oldest":
+                    _m_jobs.inc(queue=self.name, result="dropped")
+                    return False
+                dropped = self._jobs.popleft()
+                if dropped.key is not None:
+                    self._pending_keys.pop(dropped.key, None)
+                _m_jobs.inc(queue=self.name, result="dropped")
+            job = _Job(fn, args, key)
+            self._jobs.append(job)
+            if key is not None:
+                self._pending_keys[key] = job
+            self._cond.notify()
+        return True
+
+    def _work(self) -> None:
+        while True:
+            with self._cond:
+                while not self._jobs and not self._closed:
+                    self._cond.wait()
+                if not self._jobs:
+                    return
+                job = self._jobs.popleft()
+                if job.key is not None:
+                    self._pending_keys.pop(job.key, None)
+                self._running += 1
+            started = time.monotonic()
+            _m_lag.observe(started - job.enqueued_at, queue=self.name)
+            try:
+                job.fn(*job.args)
+                _m_jobs.inc(queue=self.name, result="ok")
+            except Exception as e:
+                _m_jobs.inc(queue=self.name, result="error")
+                logger.error(f"[BG] Job {getattr(job.fn, '__name__', job.fn)} failed on queue '{self.name}': {e}")
+            finally:
+                _m_duration.observe(time.monotonic() - started, queue=self.name)
+                with self._cond:
+                    self._running -= 1
+                    self._cond.notify_all()
+
+    def depth(self) -> int:
+        return len(self._jobs)
+
+    def drain(self, timeout: float) -> bool:
+        """Chờ queue rỗng và không còn job đang chạy. True nếu xong trước timeout."""
+        deadline = time.monotonic() + timeout
+        with self._cond:
+            while self._jobs or self._running:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return False
+                self._cond.wait(remaining)
+        return True
+
+    def close(self, timeout: float) -> bool:
+        """Không nhận job mới, chạy nốt job đang chờ rồi dừng worker."""
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+        deadline = time.monotonic() + timeout
+        for thread in self._threads:
+            thread.join(max(0.0, deadline - time.monotonic()))
+        return not any(t.is_alive() for t in self._threads)
+
+    def stats(self) -> dict:
+        return {"depth": len(self._jobs), "running": self._running, "max_size": self.max_size, "policy": self.policy}
+
+
+_queues: dict[str, JobQueue] = {}
+_queues_lock = threading.Lock()
+_periodic: dict[str, tuple[float, Callable[[], Any], str]] = {}  # name -> (interval, fn, queue)
+_next_run: dict[str, float] = {}
+_scheduler: Optional[threading.Thread] = None
+_stop = threading.Event()
+
+_m_depth.set_function(lambda: {(name,): q.depth() for name, q in list(_queues.items())})
+
+
+def queue(name: str, workers: int = 1, max_size: int = 100, policy: str = "drop_new") -> JobQueue:
+    """Lấy (hoặc tạo) queue theo tên; tham số chỉ có tác dụng ở lần tạo đầu tiên."""
+    with _queues_lock:
+        q = _queues.get(name)
+        if q is None or q._closed:
+            q = JobQueue(name, workers, max_size, policy)
+            _queues[name] = q
+        return q
+
+
+def submit(queue_name: str, fn: Callable[..., Any], *args, key: Optional[str] = None) -> bool:
+    return queue(queue_name).submit(fn, *args, key=key)
+
+
+def every(name: str, interval: float, fn: Callable[[], Any], queue_name: str = "periodic",
+          initial_delay: Optional[float] = None) -> None:
+    """Đăng ký job định kỳ (chạy lần đầu sau initial_delay, mặc định = interval)."""
+    if interval <= 0:
+        return
+    _periodic[name] = (interval, fn, queue_name)
+    _next_run[name] = time.monotonic() + (interval if initial_delay is None else initial_delay)
+    start()
+
+
+def _schedule_loop() -> None:
+    while not _stop.is_set():
+        now = time.monotonic()
+        for name, (interval, fn, queue_name) in list(_periodic.items()):
+            if now >= _next_run.get(name, 0):
+                _next_run[name] = now + interval
+                submit(queue_name, fn, key=name)
+        _stop.wait(0.5)
+
+
+def sleep(seconds: float) -> bool:
+    """Chờ trong một job nền (retry/backoff); True nếu đang shutdown → job nên dừng."""
+    return _stop.wait(seconds)
+
+
+def start() -> None:
+    global _scheduler
+    if _scheduler is not None and _scheduler.is_alive():
+        return
+    _stop.clear()
+    _scheduler = threading.Thread(target=_schedule_loop, name="bg-scheduler", daemon=True)
+    _scheduler.start()
+
+
+def shutdown(timeout: float = 10.0) -> None:
+    """Dừng scheduler, chạy nốt job còn trong các queue (tổng thời gian <= timeout)."""
+    global _scheduler
+    _stop.set()
+    if _scheduler is not None:
+        _scheduler.join(timeout=1.0)
+        _scheduler = None
+    _periodic.clear()
+    deadline = time.monotonic() + timeout
+    with _queues_lock:
+        queues = list(_queues.values())
+    for q in queues:
+        if not q.close(max(0.0, deadline - time.monotonic())):
+            logger.warning(f"[BG] Queue '{q.name}' did not drain before shutdown ({q.depth()} jobs left).")
+
+
+def stats() -> dict:
+    with _queues_lock:
+        return {name: q.stats() for name, q in _queues.items()}
@@ -2,76 +2,190 @@
 Unified TTL cache.
 
 - Preferred backend: Redis (if REDIS_URL is configured and reachable).
-- Fallback backend: in-memory store.
+- Fallback backend: in-memory store. A circuit breaker re-probes Redis with
+  backoff and promotes back to it once it is healthy again (local writes under
+  _REPLAY_PREFIXES, e.g. token revocations, are copied into Redis first). The memory store
+  is partitioned per key namespace (own quota / eviction policy / default TTL)
+  so rate-limit bookkeeping cannot evict rendered class/student payloads.
+- Optional disk tier (cache_disk, CACHE_DISK_PATH) below memory: rendered
+  payloads survive restarts and are shared by workers on the same host.
 
 Public API is intentionally unchanged so existing callers keep working.
+Coroutines (WebSocket loop, async routes) must use the async twins
+(aget/aset/adelete/apop/adelete_prefix) so a slow Redis never blocks the loop.
 """
 
+import asyncio
 import logging
 import os
-import pickle
+import sys
 import threading
 import time
+from collections import OrderedDict
 from typing import Any, Optional
 
+import background
+import cache_codec
+import cache_disk
+import metrics
+
 try:
     import redis
+    import redis.asyncio as redis_async
 except Exception:  # pragma: no cover - dependency may be missing in local env
     redis = None
+    redis_async = None
 
 logger = logging.getLogger(__name__)
 
 # -------------------------------------------------------------------------
-# Redis backend (preferred)
+# Redis backend (preferred) + circuit breaker
+#
+# Trạng thái breaker:
+#   disabled  — Redis không được cấu hình (ENABLE_REDIS/REDIS_URL/package): dùng memory.
+#   closed    — Redis đang được dùng.
+#   open      — Redis lỗi: dùng memory, chờ tới _next_probe_at rồi thử lại.
+#   half_open — đang probe (ping) để xem Redis đã sống lại chưa.
+# Backoff giữa các lần probe tăng gấp đôi (có jitter) tới REDIS_RETRY_MAX_SECONDS.
 # -------------------------------------------------------------------------
+_REDIS_RETRY_BASE_SECONDS = float(os.getenv("REDIS_RETRY_BASE_SECONDS", "1"))
+_REDIS_RETRY_MAX_SECONDS = float(os.getenv("REDIS_RETRY_MAX_SECONDS", "60"))
+_REDIS_FAILURE_THRESHOLD = int(os.getenv("REDIS_FAILURE_THRESHOLD", "3"))
+
+_BREAKER_DISABLED = "disabled"
+_BREAKER_CLOSED = "closed"
+_BREAKER_OPEN = "open"
+_BREAKER_HALF_OPEN = "half_open"
+_BREAKER_STATE_CODES = {_BREAKER_DISABLED: -1, _BREAKER_CLOSED: 0, _BREAKER_OPEN: 1, _BREAKER_HALF_OPEN: 2}
+
+# Key ghi vào local tier trong lúc Redis sập mà Redis PHẢI biết khi sống lại
+# (token bị revoke lúc outage không được "hồi sinh"): chép lại lên Redis trước
+# khi promote client.
+_REPLAY_PREFIXES = ("revoked_token:",)
+
 _redis_client: Any = None
 _redis_url_in_use = ""
-_last_redis_check_time: float = 0.0
-_redis_disabled_permanently: bool = False
+_redis_configured: Optional[bool] = None
+_breaker_state = _BREAKER_DISABLED
+_breaker_failures = 0          # lỗi liên tiếp của các lệnh Redis (closed)
+_breaker_probe_failures = 0    # số lần probe thất bại liên tiếp (open)
+_breaker_opened_at = 0.0
+_next_probe_at = 0.0
+_breaker_last_error = ""
+_probe_lock = threading.Lock()
+
+_m_breaker_state = metrics.gauge("cache_redis_breaker_state", "Redis circuit breaker state (-1 disabled, 0 closed, 1 open, 2 half_open)")
+_m_breaker_trips = metrics.counter("cache_redis_breaker_trips_total", "Times the Redis circuit breaker opened")
+_m_breaker_state.set_function(lambda: {(): _BREAKER_STATE_CODES[_breaker_state]})
 
-def _init_redis() -> None:
-    global _redis_client, _redis_url_in_use, _last_redis_check_time, _redis_disabled_permanently
-    if _redis_disabled_permanently:
-        return
 
+def _redis_url() -> str:
+    return os.getenv("REDIS_URL", "").strip()
+
+
+def _check_redis_configured() -> bool:
+    global _redis_configured
+    if _redis_configured is not None:
+        return _redis_configured
     # Require explicit ENABLE_REDIS=true flag to use Redis (default to fast in-memory)
-    if os.getenv("ENABLE_REDIS", "").lower() not in ("true", "1", "yes"):
-        _redis_disabled_permanently = True
-        return
+    if os.getenv("ENABLE_REDIS", "").lower() not in ("true", "1", "yes") or not _redis_url():
+        _redis_configured = False
+    elif redis is None:
+        logger.warning("[CACHE] ENABLE_REDIS is set but redis package is not installed; using in-memory cache.")
+        _redis_configured = False
+    else:
+        _redis_configured = True
+    return _redis_configured
+
+
+def _backoff_seconds(attempt: int) -> float:
+    delay = min(_REDIS_RETRY_MAX_SECONDS, _REDIS_RETRY_BASE_SECONDS * (2 ** max(0, attempt - 1)))
+    # Jitter ±20% để các worker không cùng probe một lúc
+    return delay * (0.8 + 0.4 * (time.time() % 1))
+
+
+def _open_breaker(reason: str) -> None:
+    """Chuyển sang memory và hẹn lần probe tiếp theo (gọi khi Redis lỗi)."""
+    global _redis_client, _breaker_state, _breaker_opened_at, _next_probe_at, _breaker_last_error, _breaker_probe_failures
+    # Trip = lần lỗi đầu tiên kể từ khi khoẻ: từ CLOSED, hoặc probe half-open đầu
+    # tiên (DISABLED lúc khởi động) thất bại. Probe lại khi đang OPEN không tính.
+    tripped = _breaker_probe_failures == 0
+    _redis_client = None
+    _breaker_probe_failures += 1
+    _breaker_opened_at = time.time() if tripped or not _breaker_opened_at else _breaker_opened_at
+    delay = _backoff_seconds(_breaker_probe_failures)
+    _next_probe_at = time.time() + delay
+    _breaker_state = _BREAKER_OPEN
+    _breaker_last_error = reason
+    if tripped:
+        _m_breaker_trips.inc()
+        logger.warning(f"[CACHE] Redis circuit opened ({reason}); using in-memory cache, next probe in {delay:.1f}s.")
+    else:
+        logger.info(f"[CACHE] Redis still unavailable ({reason}); next probe in {delay:.1f}s.")
 
-    now = time.time()
-    if _redis_client is None and (now - _last_redis_check_time < _REDIS_RETRY_COOLDOWN):
-        return
-    _last_redis_check_time = now
 
-    redis_url = os.getenv("REDIS_URL", "").strip()
-    if not redis_url:
-        _redis_disabled_permanently = True
+def _init_redis() -> None:
+    """Probe Redis (ping) và promote lên Redis nếu khoẻ; nếu không thì mở breaker."""
+    global _redis_client, _redis_url_in_use, _breaker_state, _breaker_failures, _breaker_probe_failures, _breaker_opened_at
+    if not _check_redis_configured():
+        _breaker_state = _BREAKER_DISABLED
         return
-    if _redis_client is not None and _redis_url_in_use == redis_url:
+    if _redis_client is not None or time.time() < _next_probe_at:
         return
-    if redis is None:
-        logger.warning("[CACHE] ENABLE_REDIS is set but redis package is not installed; using in-memory cache.")
-        _redis_disabled_permanently = True
+    # Chỉ một thread probe; các thread khác dùng memory thay vì chờ.
+    if not _probe_lock.acquire(blocking=False):
         return
-
     try:
-        client = redis.Redis.from_url(
-            redis_url,
-            decode_responses=False,
-            socket_connect_timeout=0.5,
-            socket_timeout=0.5,
-            health_check_interval=30,
-        )
-        client.ping()
+        if _redis_client is not None or time.time() < _next_probe_at:
+            return
+        _breaker_state = _BREAKER_HALF_OPEN
+        redis_url = _redis_url()
+        try:
+            client = redis.Redis.from_url(
+                redis_url,
+                decode_responses=False,
+                socket_connect_timeout=0.5,
+                socket_timeout=0.5,
+                health_check_interval=30,
+            )
+            client.ping()
+            replayed = _replay_local_writes(client)
+        except Exception as exc:
+            _open_breaker(str(exc))
+            return
+        if replayed:
+            logger.info(f"[CACHE] Replayed {replayed} locally written keys into Redis.")
+        recovered = _breaker_probe_failures > 0
         _redis_client = client
         _redis_url_in_use = redis_url
-        logger.info("[CACHE] Redis connected successfully.")
-    except Exception as exc:
-        _redis_client = None
-        _redis_url_in_use = ""
-        _redis_disabled_permanently = True  # Permanently use fast in-memory cache to avoid hanging
-        logger.warning(f"[CACHE] Redis unavailable ({exc}); permanently switching to in-memory cache.")
+        _breaker_state = _BREAKER_CLOSED
+        _breaker_failures = 0
+        _breaker_probe_failures = 0
+        _breaker_opened_at = 0.0
+        if recovered:
+            logger.info("[CACHE] Redis healthy again; promoted back from in-memory cache.")
+        else:
+            logger.info("[CACHE] Redis connected successfully.")
+    finally:
+        _probe_lock.release()
+
+
+def _replay_local_writes(client) -> int:
+    """Chép các key _REPLAY_PREFIXES trong memory/disk lên Redis (giữ TTL còn lại)."""
+    now = time.time()
+    entries: dict[str, tuple[Any, float]] = {}
+    for prefix in _REPLAY_PREFIXES:
+        if cache_disk.enabled():
+            for key in cache_disk.keys_with_prefix(prefix):
+                entry = cache_disk.get(key)
+                if entry is not None:
+                    entries[key] = entry
+        entries.update(_mem_entries_with_prefix(prefix))
+    for key, (value, expire_at) in entries.items():
+        remaining = int(expire_at - now)
+        if remaining > 0:
+            client.setex(key, remaining, _serialize(value))
+    return len(entries)
 
 
 def _ensure_redis_client() -> None:
@@ -79,107 +193,574 @@ def _ensure_redis_client() -> None:
         _init_redis()
 
 
+def _is_connection_error(exc: Exception) -> bool:
+    if redis is not None and isinstance(exc, (redis.exceptions.ConnectionError, redis.exceptions.TimeoutError)):
+        return True
+    return isinstance(exc, (OSError, asyncio.TimeoutError))
+
+
+def _on_redis_error(exc: Exception) -> None:
+    """Đếm lỗi kết nối liên tiếp; vượt ngưỡng thì mở breaker (chuyển hẳn sang memory)."""
+    global _breaker_failures, _breaker_last_error
+    if not _is_connection_error(exc):
+        return  # lỗi dữ liệu (decode...) không phản ánh sức khoẻ Redis
+    _breaker_failures += 1
+    _breaker_last_error = str(exc)
+    if _breaker_failures >= _REDIS_FAILURE_THRESHOLD and _redis_client is not None:
+        _open_breaker(str(exc))
+
+
+def _on_redis_success() -> None:
+    global _breaker_failures
+    if _breaker_failures:
+        _breaker_failures = 0
+
+
+def breaker_stats() -> dict:
+    """Trạng thái circuit breaker của Redis (hiển thị trong stats())."""
+    now = time.time()
+    return {
+        "state": _breaker_state,
+        "consecutive_failures": _breaker_failures,
+        "failed_probes": _breaker_probe_failures,
+        "open_for_seconds": round(now - _breaker_opened_at, 1) if _breaker_state in (_BREAKER_OPEN, _BREAKER_HALF_OPEN) and _breaker_opened_at else 0,
+        "next_probe_in_seconds": round(max(0.0, _next_probe_at - now), 1) if _breaker_state == _BREAKER_OPEN else 0,
+        "trips": int(_m_breaker_trips.value()),
+        "last_error": _breaker_last_error or None,
+    }
+
+
+# -------------------------------------------------------------------------
+# Async Redis client (dùng cho coroutine: WebSocket loop, async routes)
+# -------------------------------------------------------------------------
+_async_redis_client: Any = None
+_async_redis_loop: Optional[asyncio.AbstractEventLoop] = None
+
+
+def _get_async_redis() -> Any:
+    """
+    Trả về client redis.asyncio gắn với event loop hiện tại.
+
+    Không bao giờ ping/kết nối đồng bộ ở đây: trạng thái Redis được quyết định bởi
+    sync client (_init_redis), async client chỉ đi theo để không chặn event loop.
+    """
+    global _async_redis_client, _async_redis_loop
+    loop = asyncio.get_running_loop()
+    if _redis_client is None:
+        # Breaker đang open: probe (ping đồng bộ) trên background queue, không chặn event loop.
+        if _breaker_state == _BREAKER_OPEN and time.time() >= _next_probe_at:
+            background.submit("maintenance", _ensure_redis_client, key="redis-probe")
+        return None
+    if redis_async is None:
+        return None
+    if _async_redis_client is None or _async_redis_loop is not loop:
+        _async_redis_client = redis_async.Redis.from_url(
+            _redis_url_in_use,
+            decode_responses=False,
+            socket_connect_timeout=0.5,
+            socket_timeout=0.5,
+            health_check_interval=30,
+        )
+        _async_redis_loop = loop
+    return _async_redis_client
+
+
+def redis_client() -> Any:
+    """Sync Redis client đang dùng, hoặc None (memory mode / breaker open)."""
+    _ensure_redis_client()
+    return _redis_client
+
+
+def async_redis_client() -> Any:
+    """Async Redis client của event loop hiện tại, hoặc None."""
+    return _get_async_redis()
+
+
+def report_redis_result(exc: Optional[Exception] = None) -> None:
+    """Module khác dùng Redis trực tiếp (ratelimit) báo kết quả cho circuit breaker."""
+    if exc is None:
+        _on_redis_success()
+    else:
+        _on_redis_error(exc)
+
 
 def _serialize(value: Any) -> bytes:
-    return pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+    return cache_codec.encode(value)
 
 
 def _deserialize(raw: bytes) -> Any:
-    return pickle.loads(raw)
+    return cache_codec.decode(raw)
 
 # -------------------------------------------------------------------------
-# Internal store: { key: (value, expire_at) }
+# Metrics theo namespace (phần trước dấu ":" đầu tiên của key: student, class, rl...)
+# -------------------------------------------------------------------------
+_m_hits = metrics.counter("cache_hits_total", "Cache lookups that returned a value", ("namespace",))
+_m_misses = metrics.counter("cache_misses_total", "Cache lookups that returned nothing", ("namespace",))
+_m_sets = metrics.counter("cache_sets_total", "Cache writes", ("namespace",))
+_m_set_bytes = metrics.counter("cache_set_bytes_total", "Bytes written to the cache (serialized size on Redis)", ("namespace",))
+_m_disk_hits = metrics.counter(
+    "cache_disk_hits_total", "Memory misses served by the disk tier", ("namespace",)
+)
+_m_evictions = metrics.counter("cache_evictions_total", "In-memory entries removed before being read", ("namespace", "reason"))
+_m_latency = metrics.histogram("cache_op_seconds", "Cache operation latency in seconds", ("op", "namespace"))
+
+
+def _namespace(key: str) -> str:
+    head, sep, _ = key.partition(":")
+    return head if sep else "other"
+
+
+def _approx_size(value: Any) -> int:
+    if isinstance(value, (str, bytes, bytearray)):
+        return len(value)
+    if isinstance(value, (list, tuple)) and value and all(
+        v is None or isinstance(v, (str, bytes, bytearray)) for v in value
+    ):
+        # Entry response_cache [body, gzip, br]: tính các biến thể, không phải vỏ list
+        return sum(len(v) for v in value if v is not None)
+    return sys.getsizeof(value)
+
+
+def _record_lookup(op: str, key: str, value: Any, started: float) -> None:
+    ns = _namespace(key)
+    _m_latency.observe(time.perf_counter() - started, op=op, namespace=ns)
+    if value is None:
+        _m_misses.inc(namespace=ns)
+    else:
+        _m_hits.inc(namespace=ns)
+
+
+def _record_set(key: str, size: int, started: float) -> None:
+    ns = _namespace(key)
+    _m_latency.observe(time.perf_counter() - started, op="set", namespace=ns)
+    _m_sets.inc(namespace=ns)
+    _m_set_bytes.inc(size, namespace=ns)
+
+# -------------------------------------------------------------------------
+# Internal store: phân vùng theo namespace, mỗi vùng có quota + policy + TTL riêng
+# để bookkeeping rẻ (rl:*, fail_cnt:*...) không bao giờ đẩy dữ liệu đắt
+# (class:*, student:*) ra khỏi bộ nhớ.
+#   partition.entries: OrderedDict { key: (value, expire_at) }
+#   policy "lru":  get() đưa key về cuối, evict từ đầu (ít dùng gần đây nhất)
+#   policy "fifo": evict key được ghi sớm nhất (≈ sắp hết hạn nhất khi TTL đồng đều)
 # -------------------------------------------------------------------------
-_store: dict[str, tuple[Any, float]] = {}
 _lock = threading.Lock()
 
-# Số lượng keys tối đa để tránh memory leak
+# Quota mặc định cho namespace không có trong bảng dưới
 _MAX_KEYS = 2000
 
+_NAMESPACE_POLICIES: dict[str, tuple[int, str, int]] = {
+    # namespace       (max_keys, policy, default_ttl)
+    "student":        (1000, "lru", 3600),
+    "class":          (200, "lru", 1800),
+    "classes":        (4, "lru", 3600),
+    "search":         (500, "lru", 300),
+    "student_count":  (100, "lru", 3600),
+    "chat":           (4, "lru", 30),
+    "user":           (2000, "lru", 300),
+    "warm":           (4, "lru", 7 * 24 * 3600),
+    # Security bookkeeping: nhiều key rẻ (một key / IP) — tách riêng để không evict dữ liệu đắt
+    "rl":             (5000, "fifo", 60),
+    "fail_cnt":       (2000, "fifo", 900),
+    "fail_ips":       (2000, "fifo", 900),
+    "lockout":        (1000, "fifo", 900),
+    "ip_ban":         (1000, "fifo", 900),
+    "ws_ticket":      (2000, "fifo", 60),
+    "revoked_token":  (5000, "fifo", 7 * 24 * 3600),
+}
+_DEFAULT_POLICY = (_MAX_KEYS, "lru", 300)
+_SWEEP_INTERVAL = 1.0  # giây giữa hai lần quét key hết hạn của một partition
+
+
+def _parse_quota_overrides() -> None:
+    """CACHE_NS_QUOTAS="student=2000,class=400" ghi đè quota theo namespace."""
+    raw = os.getenv("CACHE_NS_QUOTAS", "").strip()
+    for item in raw.split(","):
+        name, sep, value = item.partition("=")
+        name = name.strip()
+        if not sep or not name:
+            continue
+        try:
+            quota = max(1, int(value))
+        except ValueError:
+            logger.warning(f"[CACHE] Ignoring invalid quota override '{item}'.")
+            continue
+        _, policy, ttl = _NAMESPACE_POLICIES.get(name, _DEFAULT_POLICY)
+        _NAMESPACE_POLICIES[name] = (quota, policy, ttl)
+
+
+_parse_quota_overrides()
+
+
+class _Partition:
+    __slots__ = ("name", "max_keys", "policy", "default_ttl", "entries", "last_sweep")
 
-def _evict_expired():
-    """Xóa các key đã hết hạn (gọi nội bộ, không lock lại)."""
+    def __init__(self, name: str):
+        self.name = name
+        self.max_keys, self.policy, self.default_ttl = _NAMESPACE_POLICIES.get(name, _DEFAULT_POLICY)
+        self.entries: OrderedDict[str, tuple[Any, float]] = OrderedDict()
+        self.last_sweep = 0.0
+
+
+_partitions: dict[str, _Partition] = {}
+
+
+def _partition(key: str) -> _Partition:
+    """Partition chứa key (gọi khi đang giữ _lock)."""
+    ns = _namespace(key)
+    part = _partitions.get(ns)
+    if part is None:
+        part = _Partition(ns)
+        _partitions[ns] = part
+    return part
+
+
+def default_ttl(key: str) -> int:
+    """TTL mặc định của namespace chứa key."""
+    return _NAMESPACE_POLICIES.get(_namespace(key), _DEFAULT_POLICY)[2]
+
+
+def _evict_expired(part: _Partition):
+    """Xóa các key đã hết hạn của một partition (gọi nội bộ, không lock lại)."""
     now = time.time()
-    expired = [k for k, (_, exp) in _store.items() if exp <= now]
+    part.last_sweep = now
+    expired = [k for k, (_, exp) in part.entries.items() if exp <= now]
     for k in expired:
-        del _store[k]
+        del part.entries[k]
+        _m_evictions.inc(namespace=part.name, reason="expired")
 
 
 def _mem_get(key: str) -> Optional[Any]:
     with _lock:
-        entry = _store.get(key)
+        part = _partitions.get(_namespace(key))
+        if part is None:
+            return None
+        entry = part.entries.get(key)
         if entry is None:
             return None
         value, expire_at = entry
         if time.time() > expire_at:
-            del _store[key]
+            del part.entries[key]
+            _m_evictions.inc(namespace=part.name, reason="expired")
             return None
+        if part.policy == "lru":
+            part.entries.move_to_end(key)
         return value
 
 
 def _mem_set(key: str, value: Any, ttl: int = 300) -> None:
     with _lock:
-        if len(_store) >= _MAX_KEYS:
-            _evict_expired()
-            if len(_store) >= _MAX_KEYS:
-                oldest = min(_store, key=lambda k: _store[k][1])
-                del _store[oldest]
-        _store[key] = (value, time.time() + ttl)
+        part = _partition(key)
+        entries = part.entries
+        if key in entries:
+            del entries[key]
+        elif len(entries) >= part.max_keys:
+            if time.time() - part.last_sweep >= _SWEEP_INTERVAL:
+                _evict_expired(part)
+            while len(entries) >= part.max_keys:
+                entries.popitem(last=False)
+                _m_evictions.inc(namespace=part.name, reason="capacity")
+        entries[key] = (value, time.time() + ttl)
 
 
 def _mem_delete(key: str) -> None:
     with _lock:
-        _store.pop(key, None)
+        part = _partitions.get(_namespace(key))
+        if part is not None:
+            part.entries.pop(key, None)
+
+
+def _mem_pop(key: str) -> Optional[Any]:
+    with _lock:
+        part = _partitions.get(_namespace(key))
+        if part is None:
+            return None
+        entry = part.entries.pop(key, None)
+        if entry is None:
+            return None
+        value, expire_at = entry
+        if time.time() > expire_at:
+            return None
+        return value
 
 
 def _mem_delete_prefix(prefix: str) -> int:
     with _lock:
-        to_delete = [k for k in _store if k.startswith(prefix)]
-        for k in to_delete:
-            del _store[k]
-        return len(to_delete)
+        ns, sep, _ = prefix.partition(":")
+        if sep:
+            parts = [_partitions[ns]] if ns in _partitions else []
+        else:
+            parts = list(_partitions.values())
+        deleted = 0
+        for part in parts:
+            to_delete = [k for k in part.entries if k.startswith(prefix)]
+            for k in to_delete:
+                del part.entries[k]
+            deleted += len(to_delete)
+        return deleted
+
+
+def _mem_keys_with_prefix(prefix: str) -> list[str]:
+    with _lock:
+        part = _partitions.get(prefix.partition(":")[0])
+        if part is None:
+            return []
+        now = time.time()
+        return [k for k, (_, exp) in part.entries.items() if exp > now and k.startswith(prefix)]
+
+
+def _mem_entries_with_prefix(prefix: str) -> dict[str, tuple[Any, float]]:
+    with _lock:
+        part = _partitions.get(prefix.partition(":")[0])
+        if part is None:
+            return {}
+        now = time.time()
+        return {k: entry for k, entry in part.entries.items() if entry[1] > now and k.startswith(prefix)}
 
 
 def _mem_clear_all() -> None:
     with _lock:
-        _store.clear()
+        _partitions.clear()
 
 
 def _mem_stats() -> dict:
     with _lock:
         now = time.time()
-        alive = sum(1 for _, (_, exp) in _store.items() if exp > now)
-        return {"mode": "memory", "total_keys": len(_store), "alive_keys": alive}
+        total = alive = 0
+        partitions = {}
+        for name, part in _partitions.items():
+            part_alive = sum(1 for _, (_, exp) in part.entries.items() if exp > now)
+            total += len(part.entries)
+            alive += part_alive
+            partitions[name] = {
+                "keys": len(part.entries),
+                "alive_keys": part_alive,
+                "max_keys": part.max_keys,
+                "policy": part.policy,
+                "default_ttl": part.default_ttl,
+            }
+        return {"mode": "memory", "total_keys": total, "alive_keys": alive, "partitions": partitions}
 
 
-def get(key: str) -> Optional[Any]:
-    """Lấy giá trị từ cache. Trả về None nếu không có hoặc đã hết TTL."""
+def _mem_namespace_usage() -> dict[str, dict]:
+    """{namespace: {keys, bytes}} cho các entry còn sống trong bộ nhớ."""
+    usage: dict[str, dict] = {}
+    with _lock:
+        now = time.time()
+        for name, part in _partitions.items():
+            slot = {"keys": 0, "bytes": 0}
+            for value, exp in part.entries.values():
+                if exp <= now:
+                    continue
+                slot["keys"] += 1
+                slot["bytes"] += _approx_size(value)
+            if slot["keys"]:
+                usage[name] = slot
+    return usage
+
+
+# -------------------------------------------------------------------------
+# Local tier = memory + disk (cache_disk, SQLite) khi không có Redis.
+# Chỉ các namespace trong _DISK_NAMESPACES được ghi xuống disk; hit từ disk
+# được nạp lại vào memory với TTL còn lại.
+# -------------------------------------------------------------------------
+_DISK_NAMESPACES = frozenset({
+    "student", "class", "classes", "student_count", "search", "revoked_token", "warm",
+})
+
+
+def _on_disk(key: str) -> bool:
+    return cache_disk.enabled() and _namespace(key) in _DISK_NAMESPACES
+
+
+def _local_get(key: str) -> Optional[Any]:
+    value = _mem_get(key)
+    if value is not None or not _on_disk(key):
+        return value
+    entry = cache_disk.get(key)
+    if entry is None:
+        return None
+    value, expire_at = entry
+    remaining = int(expire_at - time.time())
+    if remaining > 0:
+        _mem_set(key, value, remaining)
+    _m_disk_hits.inc(namespace=_namespace(key))
+    return value
+
+
+def _local_set(key: str, value: Any, ttl: int) -> None:
+    _mem_set(key, value, ttl)
+    if _on_disk(key):
+        cache_disk.set(key, value, ttl)
+
+
+def _local_delete(key: str) -> None:
+    _mem_delete(key)
+    if _on_disk(key):
+        cache_disk.delete(key)
+
+
+def _local_pop(key: str) -> Optional[Any]:
+    value = _mem_pop(key)
+    if _on_disk(key):
+        if value is None:
+            entry = cache_disk.get(key)
+            value = entry[0] if entry is not None else None
+        cache_disk.delete(key)
+    return value
+
+
+def _local_delete_prefix(prefix: str) -> int:
+    deleted = _mem_delete_prefix(prefix)
+    if cache_disk.enabled():
+        deleted += cache_disk.delete_prefix(prefix)
+    return deleted
+
+
+# Bản async cho coroutine: memory gọi trực tiếp, disk (SQLite, busy_timeout) chạy
+# qua asyncio.to_thread để không chặn event loop.
+async def _alocal_get(key: str) -> Optional[Any]:
+    value = _mem_get(key)
+    if value is not None or not _on_disk(key):
+        return value
+    return await asyncio.to_thread(_local_get, key)
+
+
+async def _alocal_set(key: str, value: Any, ttl: int) -> None:
+    _mem_set(key, value, ttl)
+    if _on_disk(key):
+        await asyncio.to_thread(cache_disk.set, key, value, ttl)
+
+
+async def _alocal_delete(key: str) -> None:
+    _mem_delete(key)
+    if _on_disk(key):
+        await asyncio.to_thread(cache_disk.delete, key)
+
+
+async def _alocal_pop(key: str) -> Optional[Any]:
+    if not _on_disk(key):
+        return _mem_pop(key)
+    return await asyncio.to_thread(_local_pop, key)
+
+
+async def _alocal_delete_prefix(prefix: str) -> int:
+    deleted = _mem_delete_prefix(prefix)
+    if cache_disk.enabled():
+        deleted += await asyncio.to_thread(cache_disk.delete_prefix, prefix)
+    return deleted
+
+
+def _local_clear_all() -> None:
+    _mem_clear_all()
+    if cache_disk.enabled():
+        cache_disk.clear_all()
+
+
+def _memory_gauge(field: str):
+    def collect() -> dict:
+        return {(ns,): u[field] for ns, u in _mem_namespace_usage().items()}
+    return collect
+
+
+metrics.gauge("cache_memory_keys", "Live in-memory cache entries", ("namespace",)).set_function(_memory_gauge("keys"))
+metrics.gauge("cache_memory_bytes", "Approximate size of live in-memory cache entries", ("namespace",)).set_function(_memory_gauge("bytes"))
+
+
+def namespace_stats() -> dict[str, dict]:
+    """Thống kê theo namespace: hit ratio, sets, bytes, evictions, latency (ms)."""
+    hits = {k[0]: v for k, v in _m_hits.samples().items()}
+    misses = {k[0]: v for k, v in _m_misses.samples().items()}
+    sets = {k[0]: v for k, v in _m_sets.samples().items()}
+    set_bytes = {k[0]: v for k, v in _m_set_bytes.samples().items()}
+    evictions: dict[str, dict] = {}
+    for (ns, reason), v in _m_evictions.samples().items():
+        evictions.setdefault(ns, {})[reason] = int(v)
+    latency = _m_latency.snapshots()
+    usage = _mem_namespace_usage()
+
+    # Lưu ý: module này định nghĩa hàm set() riêng, nên không dùng builtin set() ở đây.
+    names = {*hits, *misses, *sets, *evictions, *usage}
+    result: dict[str, dict] = {}
+    for ns in sorted(names):
+        h, m = int(hits.get(ns, 0)), int(misses.get(ns, 0))
+        entry = {
+            "hits": h,
+            "misses": m,
+            "hit_ratio": round(h / (h + m), 4) if (h + m) else None,
+            "sets": int(sets.get(ns, 0)),
+            "set_bytes": int(set_bytes.get(ns, 0)),
+            "evictions": evictions.get(ns, {}),
+            "memory_keys": usage.get(ns, {}).get("keys", 0),
+            "memory_bytes": usage.get(ns, {}).get("bytes", 0),
+        }
+        for op in ("get", "set"):
+            snap = latency.get((op, ns))
+            if snap and snap["count"]:
+                entry[f"{op}_latency_ms"] = {
+                    q: round(snap[q] * 1000, 3) for q in ("avg", "p50", "p95", "p99")
+                }
+        result[ns] = entry
+    return result
+
+
+def _get(key: str) -> Optional[Any]:
     _ensure_redis_client()
     if _redis_client is not None:
         try:
             raw = _redis_client.get(key)
+            _on_redis_success()
             if raw is None:
                 return None
             return _deserialize(raw)
         except Exception as exc:
             logger.warning(f"[CACHE] Redis GET failed for key '{key}': {exc}. Falling back to memory.")
-    return _mem_get(key)
+            _on_redis_error(exc)
+    return _local_get(key)
 
 
-def set(key: str, value: Any, ttl: int = 300):
+def get(key: str) -> Optional[Any]:
+    """Lấy giá trị từ cache. Trả về None nếu không có hoặc đã hết TTL."""
+    started = time.perf_counter()
+    value = _get(key)
+    _record_lookup("get", key, value, started)
+    return value
+
+
+def set(key: str, value: Any, ttl: Optional[int] = None):
     """
     Lưu giá trị vào cache.
-    ttl: time-to-live tính bằng giây (mặc định 5 phút).
+    ttl: time-to-live tính bằng giây (mặc định theo namespace, xem _NAMESPACE_POLICIES).
     """
-    ttl = max(1, int(ttl))
+    started = time.perf_counter()
+    ttl = max(1, int(default_ttl(key) if ttl is None else ttl))
     _ensure_redis_client()
     if _redis_client is not None:
         try:
-            _redis_client.setex(key, ttl, _serialize(value))
+            raw = _serialize(value)
+            _redis_client.setex(key, ttl, raw)
+            _on_redis_success()
+            _record_set(key, len(raw), started)
             return
         except Exception as exc:
             logger.warning(f"[CACHE] Redis SET failed for key '{key}': {exc}. Falling back to memory.")
-    _mem_set(key, value, ttl)
+            _on_redis_error(exc)
+    _local_set(key, value, ttl)
+    _record_set(key, _approx_size(value), started)
+
+
+def exists(key: str) -> bool:
+    """Key còn sống trong cache hay không (không tính vào hit/miss metrics)."""
+    _ensure_redis_client()
+    if _redis_client is not None:
+        try:
+            found = bool(_redis_client.exists(key))
+            _on_redis_success()
+            return found
+        except Exception as exc:
+            logger.warning(f"[CACHE] Redis EXISTS failed for key '{key}': {exc}. Falling back to memory.")
+            _on_redis_error(exc)
+    return _local_get(key) is not None
 
 
 def delete(key: str):
@@ -188,34 +769,36 @@ def delete(key: str):
     if _redis_client is not None:
         try:
             _redis_client.delete(key)
+            _on_redis_success()
             return
         except Exception as exc:
             logger.warning(f"[CACHE] Redis DELETE failed for key '{key}': {exc}. Falling back to memory.")
-    _mem_delete(key)
+            _on_redis_error(exc)
+    _local_delete(key)
 
 
-def pop(key: str) -> Optional[Any]:
-    """Atomically remove a key and return its value, or None if absent."""
+def _pop(key: str) -> Optional[Any]:
     _ensure_redis_client()
     if _redis_client is not None:
         try:
             raw = _redis_client.getdel(key)
+            _on_redis_success()
             if raw is None:
                 return None
             return _deserialize(raw)
         except Exception as exc:
             logger.warning(f"[CACHE] Redis GETDEL failed for key '{key}': {exc}. Falling back to memory.")
-    with _lock:
-        entry = _store.get(key)
-        if entry is None:
-            return None
-        value, expire_at = entry
-        del _store[key]
-        if time.time() > expire_at:
-            return None
-        return value
+            _on_redis_error(exc)
+    return _local_pop(key)
 
 
+def pop(key: str) -> Optional[Any]:
+    """Atomically remove a key and return its value, or None if absent."""
+    started = time.perf_counter()
+    value = _pop(key)
+    _record_lookup("pop", key, value, started)
+    return value
+
 
 def delete_prefix(prefix: str):
     """Xóa tất cả keys bắt đầu bằng prefix (tương đương Redis SCAN + DEL)."""
@@ -229,8 +812,9 @@ def delete_prefix(prefix: str):
             return
         except Exception as exc:
             logger.warning(f"[CACHE] Redis delete_prefix failed for '{prefix}': {exc}. Falling back to memory.")
+            _on_redis_error(exc)
 
-    deleted = _mem_delete_prefix(prefix)
+    deleted = _local_delete_prefix(prefix)
     if deleted:
         logger.debug(f"[CACHE] Invalidated {deleted} keys with prefix '{prefix}' (memory)")
 
@@ -244,24 +828,158 @@ def clear_all():
             return
         except Exception as exc:
             logger.warning(f"[CACHE] Redis FLUSHDB failed: {exc}. Falling back to memory.")
-    _mem_clear_all()
+            _on_redis_error(exc)
+    _local_clear_all()
+
+
+def keys_with_prefix(prefix: str) -> list[str]:
+    """Tất cả key còn sống bắt đầu bằng prefix (Redis SCAN / memory + disk)."""
+    _ensure_redis_client()
+    if _redis_client is not None:
+        try:
+            found = [k.decode() if isinstance(k, bytes) else k
+                     for k in _redis_client.scan_iter(match=f"{prefix}*", count=500)]
+            _on_redis_success()
+            return found
+        except Exception as exc:
+            logger.warning(f"[CACHE] Redis SCAN failed for '{prefix}': {exc}. Falling back to memory.")
+            _on_redis_error(exc)
+    found = _mem_keys_with_prefix(prefix)
+    if cache_disk.enabled():
+        found = list({*found, *cache_disk.keys_with_prefix(prefix)})
+    return found
 
 
 def stats() -> dict:
-    """Trả về thống kê cache (dùng để debug)."""
+    """Trả về thống kê cache (dùng để debug), kèm số liệu theo namespace."""
     _ensure_redis_client()
     if _redis_client is not None:
         try:
             info = _redis_client.info("memory")
+            info_stats = _redis_client.info("stats")
             return {
                 "mode": "redis",
                 "total_keys": int(_redis_client.dbsize()),
                 "used_memory": int(info.get("used_memory", 0)),
                 "used_memory_human": info.get("used_memory_human", "0B"),
+                "maxmemory": int(info.get("maxmemory", 0)),
+                "evicted_keys": int(info_stats.get("evicted_keys", 0)),
+                "expired_keys": int(info_stats.get("expired_keys", 0)),
+                "breaker": breaker_stats(),
+                "namespaces": namespace_stats(),
             }
         except Exception as exc:
             logger.warning(f"[CACHE] Redis STATS failed: {exc}. Falling back to memory.")
-    return _mem_stats()
+            _on_redis_error(exc)
+    result = _mem_stats()
+    result["disk"] = cache_disk.stats()
+    result["breaker"] = breaker_stats()
+    result["namespaces"] = namespace_stats()
+    return result
+
+
+# -------------------------------------------------------------------------
+# Async API — cùng ngữ nghĩa với API sync, dành cho code chạy trên event loop.
+# Bộ nhớ in-memory chỉ giữ lock trong vài micro-giây nên gọi trực tiếp được;
+# disk tier đi qua _alocal_* (asyncio.to_thread).
+# -------------------------------------------------------------------------
+
+async def _aget(key: str) -> Optional[Any]:
+    client = _get_async_redis()
+    if client is not None:
+        try:
+            raw = await client.get(key)
+            _on_redis_success()
+            if raw is None:
+                return None
+            return _deserialize(raw)
+        except Exception as exc:
+            logger.warning(f"[CACHE] Redis async GET failed for key '{key}': {exc}. Falling back to memory.")
+            _on_redis_error(exc)
+    return await _alocal_get(key)
+
+
+async def aget(key: str) -> Optional[Any]:
+    """Phiên bản async của get()."""
+    started = time.perf_counter()
+    value = await _aget(key)
+    _record_lookup("get", key, value, started)
+    return value
+
+
+async def aset(key: str, value: Any, ttl: Optional[int] = None):
+    """Phiên bản async của set()."""
+    started = time.perf_counter()
+    ttl = max(1, int(default_ttl(key) if ttl is None else ttl))
+    client = _get_async_redis()
+    if client is not None:
+        try:
+            raw = _serialize(value)
+            await client.setex(key, ttl, raw)
+            _on_redis_success()
+            _record_set(key, len(raw), started)
+            return
+        except Exception as exc:
+            logger.warning(f"[CACHE] Redis async SET failed for key '{key}': {exc}. Falling back to memory.")
+            _on_redis_error(exc)
+    await _alocal_set(key, value, ttl)
+    _record_set(key, _approx_size(value), started)
+
+
+async def adelete(key: str):
+    """Phiên bản async của delete()."""
+    client = _get_async_redis()
+    if client is not None:
+        try:
+            await client.delete(key)
+            _on_redis_success()
+            return
+        except Exception as exc:
+            logger.warning(f"[CACHE] Redis async DELETE failed for key '{key}': {exc}. Falling back to memory.")
+            _on_redis_error(exc)
+    await _alocal_delete(key)
+
+
+async def _apop(key: str) -> Optional[Any]:
+    client = _get_async_redis()
+    if client is not None:
+        try:
+            raw = await client.getdel(key)
+            _on_redis_success()
+            if raw is None:
+                return None
+            return _deserialize(raw)
+        except Exception as exc:
+            logger.warning(f"[CACHE] Redis async GETDEL failed for key '{key}': {exc}. Falling back to memory.")
+            _on_redis_error(exc)
+    return await _alocal_pop(key)
+
+
+async def apop(key: str) -> Optional[Any]:
+    """Phiên bản async của pop()."""
+    started = time.perf_counter()
+    value = await _apop(key)
+    _record_lookup("pop", key, value, started)
+    return value
+
+
+async def adelete_prefix(prefix: str):
+    """Phiên bản async của delete_prefix()."""
+    client = _get_async_redis()
+    if client is not None:
+        try:
+            keys = [k async for k in client.scan_iter(match=f"{prefix}*", count=500)]
+            if keys:
+                await client.delete(*keys)
+                logger.debug(f"[CACHE] Invalidated {len(keys)} keys with prefix '{prefix}' (redis)")
+            return
+        except Exception as exc:
+            logger.warning(f"[CACHE] Redis async delete_prefix failed for '{prefix}': {exc}. Falling back to memory.")
+            _on_redis_error(exc)
+
+    deleted = await _alocal_delete_prefix(prefix)
+    if deleted:
+        logger.debug(f"[CACHE] Invalidated {deleted} keys with prefix '{prefix}' (memory)")
 
 
 _init_redis()
@@ -0,0 +1,166 @@
+"""
+Cache value codec (dùng cho Redis và các tier lưu bytes).
+
+Wire format: 1 header byte + body.
+  header = (compression << 4) | codec
+  codec:       1 = msgpack, 2 = json (orjson nếu có, stdlib nếu không), 3 = pickle
+  compression: 0 = none,    1 = zlib, 2 = zstd
+
+- Plain data (str/bytes/int/float/bool/None/list/dict) đi qua msgpack/json.
+- Pickle chỉ còn là đường lui cho object không phải plain data và có thể tắt hẳn
+  bằng CACHE_ALLOW_PICKLE=false (an toàn khi Redis dùng chung).
+- Body lớn hơn CACHE_COMPRESS_MIN_BYTES được nén (zstd nếu có, zlib nếu không).
+- Entry cũ (raw pickle, byte đầu 0x80) vẫn đọc được.
+"""
+
+import json
+import logging
+import os
+import pickle
+import zlib
+from typing import Any
+
+try:
+    import msgpack
+except Exception:  # pragma: no cover - optional dependency
+    msgpack = None
+
+try:
+    import orjson
+except Exception:  # pragma: no cover - optional dependency
+    orjson = None
+
+try:
+    import zstandard
+except Exception:  # pragma: no cover - optional dependency
+    zstandard = None
+
+logger = logging.getLogger(__name__)
+
+CODEC_MSGPACK = 1
+CODEC_JSON = 2
+CODEC_PICKLE = 3
+
+COMPRESS_NONE = 0
+COMPRESS_ZLIB = 1
+COMPRESS_ZSTD = 2
+
+_LEGACY_PICKLE_MARKER = 0x80
+
+_ALLOW_PICKLE = os.getenv("CACHE_ALLOW_PICKLE", "true").lower() in ("true", "1", "yes")
+_COMPRESS_MIN_BYTES = int(os.getenv("CACHE_COMPRESS_MIN_BYTES", "1024"))
+_ZLIB_LEVEL = 6
+_ZSTD_LEVEL = 3
+
+
+def _preferred_codec() -> int:
+    wanted = os.getenv("CACHE_CODEC", "msgpack").strip().lower()
+    if wanted == "json":
+        return CODEC_JSON
+    if wanted == "msgpack" and msgpack is not None:
+        return CODEC_MSGPACK
+    return CODEC_JSON
+
+
+_CODEC = _preferred_codec()
+_COMPRESSION = COMPRESS_ZSTD if zstandard is not None else COMPRESS_ZLIB
+
+if zstandard is not None:
+    _zstd_compressor = zstandard.ZstdCompressor(level=_ZSTD_LEVEL)
+    _zstd_decompressor = zstandard.ZstdDecompressor()
+
+
+# -------------------------------------------------------------------------
+# Codecs
+# -------------------------------------------------------------------------
+
+def _dump_json(value: Any) -> bytes:
+    if orjson is not None:
+        return orjson.dumps(value)
+    return json.dumps(value, separators=(",", ":"), ensure_ascii=False, allow_nan=False).encode("utf-8")
+
+
+def _load_json(raw: bytes) -> Any:
+    if orjson is not None:
+        return orjson.loads(raw)
+    return json.loads(raw)
+
+
+def _dump_plain(value: Any, codec: int) -> bytes:
+    if codec == CODEC_MSGPACK:
+        return msgpack.packb(value, use_bin_type=True)
+    return _dump_json(value)
+
+
+def _load(codec: int, body: bytes) -> Any:
+    if codec == CODEC_MSGPACK:
+        if msgpack is None:
+            raise ValueError("msgpack entry found but msgpack is not installed")
+        return msgpack.unpackb(body, raw=False, strict_map_key=False)
+    if codec == CODEC_JSON:
+        return _load_json(body)
+    if codec == CODEC_PICKLE:
+        if not _ALLOW_PICKLE:
+            raise ValueError("pickle entries are disabled (CACHE_ALLOW_PICKLE=false)")
+        return pickle.loads(body)
+    raise ValueError(f"unknown cache codec {codec}")
+
+
+# -------------------------------------------------------------------------
+# Compression
+# -------------------------------------------------------------------------
+
+def _compress(body: bytes) -> tuple[int, bytes]:
+    if len(body) < _COMPRESS_MIN_BYTES:
+        return COMPRESS_NONE, body
+    if _COMPRESSION == COMPRESS_ZSTD:
+        packed = _zstd_compressor.compress(body)
+    else:
+        packed = zlib.compress(body, _ZLIB_LEVEL)
+    # Ciphertext (payload đã mã hoá) gần như không nén được — giữ bản gốc nếu không lợi.
+    if len(packed) >= len(body):
+        return COMPRESS_NONE, body
+    return _COMPRESSION, packed
+
+
+def _decompress(compression: int, body: bytes) -> bytes:
+    if compression == COMPRESS_NONE:
+        return body
+    if compression == COMPRESS_ZLIB:
+        return zlib.decompress(body)
+    if compression == COMPRESS_ZSTD:
+        if zstandard is None:
+            raise ValueError("zstd entry found but zstandard is not installed")
+        return _zstd_decompressor.decompress(body)
+    raise ValueError(f"unknown cache compression {compression}")
+
+
+# -------------------------------------------------------------------------
+# Public API
+# -------------------------------------------------------------------------
+
+def encode(value: Any) -> bytes:
+    """Serialize một giá trị cache thành bytes có header."""
+    codec = _CODEC
+    try:
+        body = _dump_plain(value, codec)
+    except (TypeError, ValueError, OverflowError):
+        if not _ALLOW_PICKLE:
+            raise TypeError(f"value of type {type(value).__name__} is not plain data and pickle is disabled")
+        codec = CODEC_PICKLE
+        body = pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+
+    compression, body = _compress(body)
+    return bytes(((compression << 4) | codec,)) + body
+
+
+def decode(raw: bytes) -> Any:
+    """Giải mã bytes do encode() tạo ra (hoặc raw pickle kiểu cũ)."""
+    if not raw:
+        raise ValueError("empty cache entry")
+    header = raw[0]
+    if header == _LEGACY_PICKLE_MARKER:
+        return _load(CODEC_PICKLE, raw)
+    codec = header & 0x0F
+    compression = header >> 4
+    return _load(codec, _decompress(compression, raw[1:]))
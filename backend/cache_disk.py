@@ -0,0 +1,199 @@
+"""
+Disk cache tier (SQLite, WAL) nằm dưới memory tier khi không có Redis.
+
+- Bật bằng CACHE_DISK_PATH (ví dụ /app/cache/cache.sqlite3); để trống = tắt.
+- Chỉ lưu các namespace đắt / cần sống qua restart (payload đã render,
+  revoked_token, snapshot warm:top) — xem cache._DISK_NAMESPACES.
+- Giá trị được mã hoá bằng cache_codec, kèm expire_at tuyệt đối nên TTL
+  vẫn đúng sau restart.
+- WAL cho phép nhiều worker trên cùng host đọc/ghi chung một file; mỗi thread
+  giữ một connection riêng.
+- Lỗi SQLite không bao giờ lan ra ngoài: get() trả None, set()/delete() bỏ qua.
+"""
+
+import logging
+import os
+import sqlite3
+import threading
+import time
+from typing import Any, Optional
+
+import background
+import cache_codec
+
+logger = logging.getLogger(__name__)
+
+_PATH = os.getenv("CACHE_DISK_PATH", "").strip()
+_MAX_ENTRIES = int(os.getenv("CACHE_DISK_MAX_ENTRIES", "20000"))
+_PURGE_INTERVAL = 60.0
+_BUSY_TIMEOUT_MS = 200
+
+_SCHEMA = (
+    "CREATE TABLE IF NOT EXISTS cache_entries ("
+    " key TEXT PRIMARY KEY,"
+    " value BLOB NOT NULL,"
+    " expire_at REAL NOT NULL)",
+    "CREATE INDEX IF NOT EXISTS ix_cache_entries_expire_at ON cache_entries (expire_at)",
+)
+
+_local = threading.local()
+_announced = False
+_last_purge = 0.0
+
+
+def enabled() -> bool:
+    return bool(_PATH)
+
+
+def _connect() -> Optional[sqlite3.Connection]:
+    """Connection của thread hiện tại (tạo schema nếu chưa có)."""
+    global _announced
+    if not _PATH or getattr(_local, "failed_path", None) == _PATH:
+        return None
+    conn = getattr(_local, "conn", None)
+    if conn is not None and getattr(_local, "path", None) == _PATH:
+        return conn
+    try:
+        directory = os.path.dirname(_PATH)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        conn = sqlite3.connect(_PATH, timeout=_BUSY_TIMEOUT_MS / 1000, isolation_level=None)
+        conn.execute(f"PRAGMA busy_timeout={_BUSY_TIMEOUT_MS}")
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        for ddl in _SCHEMA:
+            conn.execute(ddl)
+    except (sqlite3.Error, OSError) as e:
+        logger.warning(f"[CACHE] Disk tier unavailable ({_PATH}): {e}")
+        _local.failed_path = _PATH
+        return None
+    if not _announced:
+        _announced = True
+        logger.info(f"[CACHE] Disk tier enabled at {_PATH}")
+    _local.conn = conn
+    _local.path = _PATH
+    return conn
+
+
+def get(key: str) -> Optional[tuple[Any, float]]:
+    """Trả về (value, expire_at) nếu còn hạn, ngược lại None."""
+    conn = _connect()
+    if conn is None:
+        return None
+    try:
+        row = conn.execute(
+            "SELECT value, expire_at FROM cache_entries WHERE key = ? AND expire_at > ?",
+            (key, time.time()),
+        ).fetchone()
+        if row is None:
+            return None
+        return cache_codec.decode(row[0]), row[1]
+    except Exception as e:
+        logger.debug(f"[CACHE] Disk GET failed for key '{key}': {e}")
+        return None
+
+
+def set(key: str, value: Any, ttl: int) -> None:
+    conn = _connect()
+    if conn is None:
+        return
+    try:
+        raw = cache_codec.encode(value)
+        conn.execute(
+            "INSERT OR REPLACE INTO cache_entries (key, value, expire_at) VALUES (?, ?, ?)",
+            (key, raw, time.time() + ttl),
+        )
+    except Exception as e:
+        logger.debug(f"[CACHE] Disk SET failed for key '{key}': {e}")
+        return
+    if time.time() - _last_purge > _PURGE_INTERVAL:
+        background.submit("maintenance", purge, key="cache-disk-purge")
+
+
+def delete(key: str) -> None:
+    conn = _connect()
+    if conn is None:
+        return
+    try:
+        conn.execute("DELETE FROM cache_entries WHERE key = ?", (key,))
+    except sqlite3.Error as e:
+        logger.debug(f"[CACHE] Disk DELETE failed for key '{key}': {e}")
+
+
+def _like_prefix(prefix: str) -> str:
+    """Escape wildcard của LIKE để prefix được so khớp nguyên văn."""
+    return prefix.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_") + "%"
+
+
+def delete_prefix(prefix: str) -> int:
+    conn = _connect()
+    if conn is None:
+        return 0
+    pattern = _like_prefix(prefix)
+    try:
+        return conn.execute("DELETE FROM cache_entries WHERE key LIKE ? ESCAPE '\\'", (pattern,)).rowcount
+    except sqlite3.Error as e:
+        logger.debug(f"[CACHE] Disk delete_prefix failed for '{prefix}': {e}")
+        return 0
+
+
+def keys_with_prefix(prefix: str) -> list[str]:
+    conn = _connect()
+    if conn is None:
+        return []
+    pattern = _like_prefix(prefix)
+    try:
+        rows = conn.execute(
+            "SELECT key FROM cache_entries WHERE key LIKE ? ESCAPE '\\' AND expire_at > ?",
+            (pattern, time.time()),
+        ).fetchall()
+        return [row[0] for row in rows]
+    except sqlite3.Error as e:
+        logger.debug(f"[CACHE] Disk key scan failed for '{prefix}': {e}")
+        return []
+
+
+def clear_all() -> None:
+    conn = _connect()
+    if conn is None:
+        return
+    try:
+        conn.execute("DELETE FROM cache_entries")
+    except sqlite3.Error as e:
+        logger.debug(f"[CACHE] Disk CLEAR failed: {e}")
+
+
+def purge() -> int:
+    """Xóa entry hết hạn; nếu vẫn vượt CACHE_DISK_MAX_ENTRIES thì xóa entry sắp hết hạn nhất."""
+    global _last_purge
+    _last_purge = time.time()
+    conn = _connect()
+    if conn is None:
+        return 0
+    try:
+        removed = conn.execute("DELETE FROM cache_entries WHERE expire_at <= ?", (time.time(),)).rowcount
+        total = conn.execute("SELECT COUNT(*) FROM cache_entries").fetchone()[0]
+        if total > _MAX_ENTRIES:
+            removed += conn.execute(
+                "DELETE FROM cache_entries WHERE key IN ("
+                " SELECT key FROM cache_entries ORDER BY expire_at LIMIT ?)",
+                (total - _MAX_ENTRIES,),
+            ).rowcount
+        return removed
+    except sqlite3.Error as e:
+        logger.debug(f"[CACHE] Disk purge failed: {e}")
+        return 0
+
+
+def stats() -> dict:
+    conn = _connect()
+    if conn is None:
+        return {"enabled": enabled(), "available": False}
+    try:
+        total = conn.execute("SELECT COUNT(*) FROM cache_entries").fetchone()[0]
+        alive = conn.execute("SELECT COUNT(*) FROM cache_entries WHERE expire_at > ?", (time.time(),)).fetchone()[0]
+        size = os.path.getsize(_PATH) if os.path.exists(_PATH) else 0
+        return {"enabled": True, "available": True, "path": _PATH, "total_keys": total,
+                "alive_keys": alive, "max_entries": _MAX_ENTRIES, "file_bytes": size}
+    except (sqlite3.Error, OSError) as e:
+        return {"enabled": True, "available": False, "error": str(e)}
@@ -0,0 +1,146 @@
+"""
+Cache warming theo tần suất truy cập.
+
+- Các route gọi record(kind, *args) cho mỗi request (hit hoặc miss); một
+  HeavyHitters (Count-Min Sketch + top-K) giữ các entry phổ biến nhất. Entry
+  được ghi kèm security.plain_payloads() của request (kênh nội bộ BFF dùng key
+  ":plain"), và warm() bật lại đúng chế độ đó khi gọi loader.
+- Mỗi kind đăng ký một loader(db, *args) tính lại payload và ghi vào cache.
+- warm() tính lại top-N entry còn thiếu trong cache, có giới hạn số lượng và
+  thời gian; schedule_warm() chạy warm() trên background queue "warm"
+  (một worker, các yêu cầu dồn dập được gộp lại). start_periodic() đăng ký
+  warm định kỳ (CACHE_WARM_INTERVAL_SECONDS).
+- Snapshot top-K được lưu vào cache (key "warm:top") trên background queue
+  "maintenance" để lần khởi động sau (Redis / disk tier) vẫn biết trang nào đang hot.
+"""
+
+import logging
+import os
+import time
+from typing import Callable, Optional
+
+import background
+import cache as _cache
+import database
+import security
+from sketches import HeavyHitters
+
+logger = logging.getLogger(__name__)
+
+_TOP_N = int(os.getenv("CACHE_WARM_TOP_N", "50"))
+_BUDGET_SECONDS = float(os.getenv("CACHE_WARM_BUDGET_SECONDS", "20"))
+_DEBOUNCE_SECONDS = float(os.getenv("CACHE_WARM_DEBOUNCE_SECONDS", "2"))
+_INTERVAL_SECONDS = float(os.getenv("CACHE_WARM_INTERVAL_SECONDS", "900"))
+_PAUSE_SECONDS = 0.01  # nhường DB giữa các entry
+_SNAPSHOT_KEY = "warm:top:v2"  # item = (kind, plain, *args)
+_SNAPSHOT_TTL = 7 * 24 * 3600
+_SNAPSHOT_INTERVAL = 300
+
+# kind -> (cache_key_fn(*args), loader(db, *args))
+_loaders: dict[str, tuple[Callable[..., str], Callable[..., None]]] = {}
+_popularity = HeavyHitters(capacity=max(64, _TOP_N * 4))
+_last_snapshot = 0.0
+_seeded = False
+
+
+def register(kind: str, cache_key: Callable[..., str], loader: Callable[..., None]) -> None:
+    """Đăng ký loader cho một loại entry (class, student, classes...)."""
+    _loaders[kind] = (cache_key, loader)
+
+
+def record(kind: str, *args) -> None:
+    """Ghi nhận một lượt truy cập (gọi trên hot path — chỉ cập nhật sketch)."""
+    global _last_snapshot
+    _popularity.add((kind, security.plain_payloads(), *args))
+    now = time.time()
+    if now - _last_snapshot > _SNAPSHOT_INTERVAL:
+        _last_snapshot = now
+        # _cache.set có thể là một round trip Redis: không chạy trên hot path / event loop
+        background.submit("maintenance", _save_snapshot, key="warm-snapshot")
+
+
+def top(n: int = _TOP_N) -> list[dict]:
+    return [
+        {"kind": item[0], "plain": item[1], "args": list(item[2:]), "hits": count}
+        for item, count in _popularity.top(n)
+    ]
+
+
+def _save_snapshot() -> None:
+    try:
+        _cache.set(_SNAPSHOT_KEY, [[list(item), count] for item, count in _popularity.top(_TOP_N * 2)], ttl=_SNAPSHOT_TTL)
+    except Exception as e:
+        logger.debug(f"[WARM] Snapshot save failed: {e}")
+
+
+def _load_snapshot() -> None:
+    global _seeded
+    if _seeded:
+        return
+    _seeded = True
+    try:
+        snapshot = _cache.get(_SNAPSHOT_KEY) or []
+        _popularity.seed([(tuple(item), count) for item, count in snapshot])
+        if snapshot:
+            logger.info(f"[WARM] Seeded popularity from snapshot ({len(snapshot)} entries).")
+    except Exception as e:
+        logger.debug(f"[WARM] Snapshot load failed: {e}")
+
+
+def warm(reason: str = "manual", limit: int = _TOP_N) -> int:
+    """Tính lại top-N entry chưa có trong cache. Trả về số entry đã nạp."""
+    _load_snapshot()
+    started = time.monotonic()
+    candidates = [item for item, _ in _popularity.top(limit)]
+    # Catalog luôn được warm (1 query, mọi trang đều cần) kể cả khi chưa có số liệu
+    if "classes" in _loaders and ("classes", False) not in candidates:
+        candidates.insert(0, ("classes", False))
+
+    warmed = 0
+    db = database.SessionLocal()
+    try:
+        for item in candidates:
+            if time.monotonic() - started > _BUDGET_SECONDS:
+                logger.info(f"[WARM] Budget exhausted after {warmed} entries ({reason}).")
+                break
+            kind, plain, args = item[0], bool(item[1]), item[2:]
+            entry = _loaders.get(kind)
+            if entry is None:
+                continue
+            cache_key, loader = entry
+            # Key / payload theo đúng kênh của request đã ghi nhận (thread nền mặc định là Fernet)
+            token = security.set_plain_payloads(plain)
+            try:
+                if _cache.exists(cache_key(*args)):
+                    continue
+                loader(db, *args)
+                warmed += 1
+            except Exception as e:
+                db.rollback()
+                logger.debug(f"[WARM] {kind}{args} (plain={plain}) failed: {e}")
+            finally:
+                security.reset_plain_payloads(token)
+            time.sleep(_PAUSE_SECONDS)
+    finally:
+        db.close()
+
+    _save_snapshot()
+    logger.info(f"[WARM] Warmed {warmed} cache entries in {time.monotonic() - started:.2f}s ({reason}).")
+    return warmed
+
+
+def _run_scheduled(reason: str, delay: float) -> None:
+    time.sleep(delay)
+    warm(reason)
+
+
+def schedule_warm(reason: str, delay: Optional[float] = None) -> None:
+    """Chạy warm() nền; gọi dồn dập (nhiều invalidation) chỉ chạy một lần."""
+    background.queue("warm", workers=1, max_size=4).submit(
+        _run_scheduled, reason, _DEBOUNCE_SECONDS if delay is None else delay, key="warm"
+    )
+
+
+def start_periodic() -> None:
+    """Warm định kỳ để các entry hot hết TTL được tính lại trước khi có request."""
+    background.every("cache-warm", _INTERVAL_SECONDS, lambda: warm("periodic"), queue_name="warm")
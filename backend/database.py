@@ -1,7 +1,9 @@
 import os
 
+import db_stats
 from dotenv import load_dotenv
-from sqlalchemy import create_engine, inspect, text
+from sqlalchemy import create_engine
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
 
@@ -43,18 +45,94 @@ elif not SQLALCHEMY_DATABASE_URL.startswith("sqlite"):
     print(f"[INFO] DB_CONNECTION: Using manually constructed URL")
 
 pg_options = "-c statement_timeout=10000 -c lock_timeout=5000"
-engine = create_engine(
-    SQLALCHEMY_DATABASE_URL,
-    pool_size=10,
-    max_overflow=20,
-    pool_pre_ping=True,
-    pool_recycle=1800,
-    connect_args={"connect_timeout": 5, "options": pg_options} if "postgresql" in SQLALCHEMY_DATABASE_URL else {},
-)
+
+# 🔌 Ngân sách kết nối cho MỖI worker, MỖI database (primary và từng replica):
+# DB_POOL_SIZE + DB_MAX_OVERFLOW được chia giữa engine sync và async,
+# DB_ASYNC_POOL_SIZE là phần của engine async (overflow chia theo cùng tỉ lệ).
+# Tổng kết nối lên một database ≤ số worker × (DB_POOL_SIZE + DB_MAX_OVERFLOW);
+# mặc định 10 + 20 = 30 như trước khi có engine async (sync 5+10, async 5+10).
+_POOL_BUDGET = max(2, int(os.getenv("DB_POOL_SIZE", "10")))
+_OVERFLOW_BUDGET = max(0, int(os.getenv("DB_MAX_OVERFLOW", "20")))
+_ASYNC_POOL_SIZE = min(max(1, int(os.getenv("DB_ASYNC_POOL_SIZE", str(_POOL_BUDGET // 2)))), _POOL_BUDGET - 1)
+_ASYNC_MAX_OVERFLOW = _OVERFLOW_BUDGET * _ASYNC_POOL_SIZE // _POOL_BUDGET
+
+# (pool_size, max_overflow); pool_size luôn ≥ 1 vì 0 nghĩa là không giới hạn
+SYNC_POOL = (_POOL_BUDGET - _ASYNC_POOL_SIZE, _OVERFLOW_BUDGET - _ASYNC_MAX_OVERFLOW)
+ASYNC_POOL = (_ASYNC_POOL_SIZE, _ASYNC_MAX_OVERFLOW)
+
+
+def make_engine(url: str, name: str = "primary"):
+    """Engine sync với cấu hình pool dùng chung (primary và read replica), có gắn db_stats."""
+    db_engine = create_engine(
+        url,
+        poolclass=db_stats.pool_class(name),
+        pool_size=SYNC_POOL[0],
+        max_overflow=SYNC_POOL[1],
+        pool_pre_ping=True,
+        pool_recycle=1800,
+        connect_args={"connect_timeout": 5, "options": pg_options} if "postgresql" in url else {},
+    )
+    db_stats.instrument(db_engine, name)
+    return db_engine
+
+
+engine = make_engine(SQLALCHEMY_DATABASE_URL)
 
 # Create a SessionLocal class
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
+
+# ⚡ Async engine cho các đường đọc nóng (student, search, chat history, WebSocket):
+# asyncpg trên Postgres, aiosqlite khi dev. Số truy vấn đồng thời bị giới hạn bởi
+# pool (không phải threadpool), và query chậm không chặn event loop.
+def _async_url(url: str) -> str:
+    scheme, sep, rest = url.partition("://")
+    base = scheme.split("+", 1)[0]
+    if base == "postgresql":
+        return f"postgresql+asyncpg{sep}{rest}"
+    if base == "sqlite":
+        return f"sqlite+aiosqlite{sep}{rest}"
+    return url
+
+
+# asyncpg: timeout như connect_timeout của psycopg2. Đặt ASYNCPG_STATEMENT_CACHE_SIZE=0
+# khi đi qua pgbouncer / Supabase pooler ở transaction mode.
+def _async_connect_args(async_url: str) -> dict:
+    if not async_url.startswith("postgresql+asyncpg"):
+        return {}
+    return {
+        "timeout": 5,
+        "statement_cache_size": int(os.getenv("ASYNCPG_STATEMENT_CACHE_SIZE", "100")),
+        "server_settings": {"statement_timeout": "10000", "lock_timeout": "5000"},
+    }
+
+
+def make_async_engine(url: str, name: str = "primary-async"):
+    """AsyncEngine tương ứng với URL sync (raise nếu driver async chưa được cài)."""
+    async_url = _async_url(url)
+    db_engine = create_async_engine(
+        async_url,
+        poolclass=db_stats.pool_class(name, use_async=True),
+        pool_size=ASYNC_POOL[0],
+        max_overflow=ASYNC_POOL[1],
+        pool_pre_ping=True,
+        pool_recycle=1800,
+        connect_args=_async_connect_args(async_url),
+    )
+    db_stats.instrument(db_engine.sync_engine, name)
+    return db_engine
+
+
+ASYNC_DATABASE_URL = _async_url(SQLALCHEMY_DATABASE_URL)
+
+try:
+    async_engine = make_async_engine(SQLALCHEMY_DATABASE_URL)
+    AsyncSessionLocal = async_sessionmaker(async_engine, expire_on_commit=False, autoflush=False)
+except Exception as e:  # driver async chưa được cài
+    print(f"[WARNING] Async DB engine unavailable ({e}); async routes will fail until asyncpg/aiosqlite is installed.")
+    async_engine = None
+    AsyncSessionLocal = None
+
 # Base class for models
 Base = declarative_base()
 
@@ -66,76 +144,11 @@ def get_db():
     finally:
         db.close()
 
+async def get_async_db():
+    if AsyncSessionLocal is None:
+        raise RuntimeError("Async database engine is not configured (install asyncpg / aiosqlite)")
+    async with AsyncSessionLocal() as db:
+        yield db
+
 def create_tables():
     Base.metadata.create_all(bind=engine)
-
-def sync_schema():
-    """Tự động đồng bộ hóa cấu trúc bảng cho môi trường Production (Postgres/SQLite)"""
-    # 🕵️ RESCUE: Bỏ qua nếu chưa cấu hình URL để tránh treo Server
-    if not SQLALCHEMY_DATABASE_URL or "missing_url_placeholder" in SQLALCHEMY_DATABASE_URL:
-        print("[SKIP] Sync: Skipping schema sync because DATABASE_URL is not configured.")
-        return
-
-    try:
-        print("[INFO] Sync: Starting schema synchronization...")
-        inspector = inspect(engine)
-        table_names = inspector.get_table_names()
-        
-        with engine.connect() as conn:
-            # 1. Đồng bộ bảng chat_messages
-            if 'chat_messages' in table_names:
-                chat_cols = {c['name'] for c in inspector.get_columns('chat_messages')}
-                if 'ip_address' not in chat_cols:
-                    conn.execute(text("ALTER TABLE chat_messages ADD COLUMN ip_address TEXT"))
-                if 'device_fingerprint' not in chat_cols:
-                    conn.execute(text("ALTER TABLE chat_messages ADD COLUMN device_fingerprint TEXT"))
-                if 'parent_id' not in chat_cols:
-                    conn.execute(text("ALTER TABLE chat_messages ADD COLUMN parent_id BIGINT"))
-
-            # 2. Đồng bộ bảng nick (chỉ ALTER TABLE khi cột thực sự chưa có)
-            if 'nick' in table_names:
-                nick_cols = {c['name'] for c in inspector.get_columns('nick')}
-                new_nick_cols = [
-                    ("class_change_limit", "INTEGER DEFAULT 5"),
-                    ("full_name", "TEXT"),
-                    ("last_active", "TIMESTAMP"),
-                    ("reset_limit_at", "TIMESTAMP"),
-                    ("last_ip", "TEXT"),
-                    ("last_location", "TEXT"),
-                ]
-                for col_name, col_def in new_nick_cols:
-                    if col_name not in nick_cols:
-                        conn.execute(text(f"ALTER TABLE nick ADD COLUMN {col_name} {col_def}"))
-
-            # 3. Thêm index cho bang_diem.msv (Tối ưu tốc độ)
-            if 'bang_diem' in table_names:
-                conn.execute(text("CREATE INDEX IF NOT EXISTS idx_bang_diem_msv ON bang_diem (msv)"))
-
-            # 4. Thêm index cho user_access.user_id (Tối ưu tốc độ)
-            if 'user_access' in table_names:
-                conn.execute(text("CREATE INDEX IF NOT EXISTS idx_user_access_user_id ON user_access (user_id)"))
-
-            # 5. Thêm index cho sinh_vien.ma_lop (Tối ưu tốc độ)
-            if 'sinh_vien' in table_names:
-                conn.execute(text("CREATE INDEX IF NOT EXISTS idx_sinh_vien_ma_lop ON sinh_vien (ma_lop)"))
-
-            conn.commit()
-        
-        # create_tables() sẽ tự động tạo bảng mới nếu chưa có
-        print("[INFO] Sync: Ensuring all tables exist...")
-        create_tables()
-        print("[INFO] Sync: Schema synchronization complete.")
-    except Exception as e:
-        error_msg = str(e)
-        if "Circuit breaker open" in error_msg:
-            print("\n" + "!"*60)
-            print("[CRITICAL] DATABASE CONNECTION BLOCKED BY SUPABASE")
-            print("The 'Circuit breaker open' error means too many authentication failures.")
-            print("1. Check if your password in .env is correct.")
-            print("2. STOP all connection attempts for 5-10 minutes.")
-            print("3. Restart the backend once the cooldown is over.")
-            print("!"*60 + "\n")
-        else:
-            print(f"[CRITICAL] Sync: Schema synchronization failed: {e}")
-        # We don't re-raise to allows the server to start (even in limited mode)
-        # so diagnostic endpoints (/health) remain accessible.
@@ -0,0 +1,307 @@
+"""
+Instrumentation cho engine / pool SQLAlchemy (gắn trong database.make_engine /
+make_async_engine, kể cả engine của read replica).
+
+- Pool: thời gian chờ checkout (TimedQueuePool đo quanh _do_get), số lần
+  checkout / timeout, số connection đang dùng / rảnh / overflow theo engine.
+- Query: thời lượng từng statement (before/after_cursor_execute gắn ở cấp class
+  Engine) theo engine và loại câu lệnh; lỗi được phân loại statement_timeout /
+  lock_timeout / disconnect.
+- Query chậm hơn SLOW_QUERY_MS được log với SQL đã chuẩn hoá (literal → ?,
+  danh sách IN gộp lại) và tham số bị ẩn (chỉ ghi số lượng), đồng thời giữ
+  SLOW_QUERY_LOG_SIZE query gần nhất cho /api/admin/db/stats.
+- Query budget theo request: track() mở một QueryTracker (ContextVar) đếm số
+  statement và tổng thời gian trong phạm vi đó (RequestGuardMiddleware bọc mỗi
+  request HTTP, WebSocket bọc mỗi tin chat). check_budget() log cảnh báo khi vượt
+  REQUEST_QUERY_WARN kèm các câu lặp lại (nghi N+1), và log trace đầy đủ cho
+  một phần REQUEST_QUERY_TRACE_SAMPLE các request vượt. Test dùng fixture
+  query_budget (tests/conftest.py) để fail khi endpoint vượt budget.
+- Toàn bộ số liệu có trên /metrics (db_pool_*, db_query_*, db_request_*).
+"""
+
+import logging
+import os
+import random
+import re
+import threading
+import time
+import weakref
+from collections import Counter, deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+from datetime import datetime
+from typing import Iterator, Optional
+
+from sqlalchemy import event, exc
+from sqlalchemy.engine import Engine
+from sqlalchemy.pool import AsyncAdaptedQueuePool, QueuePool
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+SLOW_QUERY_MS = float(os.getenv("SLOW_QUERY_MS", "500"))
+_SLOW_LOG_SIZE = int(os.getenv("SLOW_QUERY_LOG_SIZE", "50"))
+_SQL_MAX_CHARS = 1000
+REQUEST_QUERY_WARN = int(os.getenv("REQUEST_QUERY_WARN", "25"))
+_TRACE_SAMPLE = float(os.getenv("REQUEST_QUERY_TRACE_SAMPLE", "0.1"))
+_REPEAT_THRESHOLD = int(os.getenv("REQUEST_QUERY_REPEAT_THRESHOLD", "3"))
+_TRACE_MAX_STATEMENTS = 200
+
+_m_wait = metrics.histogram("db_pool_checkout_wait_seconds", "Time spent waiting for a pooled connection", ("engine",))
+_m_checkouts = metrics.counter("db_pool_checkouts_total", "Connections checked out of the pool", ("engine",))
+_m_timeouts = metrics.counter("db_pool_timeouts_total", "Checkouts that hit the pool timeout", ("engine",))
+_m_conns = metrics.gauge("db_pool_connections", "Pooled connections by state", ("engine", "state"))
+_m_query = metrics.histogram("db_query_seconds", "Statement execution time", ("engine", "op"))
+_m_slow = metrics.counter("db_slow_queries_total", "Statements slower than SLOW_QUERY_MS", ("engine",))
+_m_errors = metrics.counter("db_query_errors_total", "Failed statements by cause", ("engine", "kind"))
+_m_request_queries = metrics.histogram(
+    "db_request_queries", "Statements executed per tracked request", buckets=(1, 2, 5, 10, 25, 50, 100, 250),
+)
+_m_over_budget = metrics.counter("db_request_over_budget_total", "Requests that ran more than REQUEST_QUERY_WARN statements")
+
+_engines: dict[str, Engine] = {}   # name -> Engine (sync)
+_names: "weakref.WeakKeyDictionary[Engine, str]" = weakref.WeakKeyDictionary()
+_slow: deque = deque(maxlen=_SLOW_LOG_SIZE)
+_slow_lock = threading.Lock()
+
+_START_KEY = "db_stats_start"
+
+
+class _TimedPoolMixin:
+    stats_name = "unknown"
+
+    def _do_get(self):
+        started = time.perf_counter()
+        try:
+            conn = super()._do_get()
+        except exc.TimeoutError:
+            _m_timeouts.inc(engine=self.stats_name)
+            raise
+        finally:
+            _m_wait.observe(time.perf_counter() - started, engine=self.stats_name)
+        _m_checkouts.inc(engine=self.stats_name)
+        return conn
+
+
+class TimedQueuePool(_TimedPoolMixin, QueuePool):
+    pass
+
+
+class TimedAsyncQueuePool(_TimedPoolMixin, AsyncAdaptedQueuePool):
+    pass
+
+
+def pool_class(name: str, use_async: bool = False):
+    """Pool class đo thời gian chờ checkout, mang theo tên engine cho label."""
+    base = TimedAsyncQueuePool if use_async else TimedQueuePool
+    return type(base.__name__, (base,), {"stats_name": name})
+
+
+# --- Chuẩn hoá SQL cho slow log ---------------------------------------------
+_RE_STRING = re.compile(r"'(?:[^']|'')*'")
+_RE_NUMBER = re.compile(r"(?<![\w$])-?\d+(?:\.\d+)?\b")
+_RE_IN_LIST = re.compile(r"\(\s*\?(?:\s*,\s*\?)+\s*\)")
+_RE_PLACEHOLDER = re.compile(r"%\(\w+\)s|%s|(?<!:):\w+|\$\d+")
+_RE_SPACE = re.compile(r"\s+")
+
+
+def normalize_sql(statement: str) -> str:
+    sql = _RE_STRING.sub("?", statement)
+    sql = _RE_PLACEHOLDER.sub("?", sql)
+    sql = _RE_NUMBER.sub("?", sql)
+    sql = _RE_IN_LIST.sub("(...)", sql)
+    sql = _RE_SPACE.sub(" ", sql).strip()
+    return sql if len(sql) <= _SQL_MAX_CHARS else sql[:_SQL_MAX_CHARS] + "…"
+
+
+def _op(statement: str) -> str:
+    head = statement.lstrip()[:6].lower()
+    for op in ("select", "insert", "update", "delete"):
+        if head.startswith(op):
+            return op
+    return "other"
+
+
+def _param_count(parameters, executemany: bool) -> str:
+    if executemany:
+        return f"{len(parameters)} rows"
+    return str(len(parameters) if isinstance(parameters, (dict, list, tuple)) else 0)
+
+
+def _error_kind(context) -> str:
+    message = str(context.original_exception).lower()
+    if "statement timeout" in message:
+        return "statement_timeout"
+    if "lock timeout" in message:
+        return "lock_timeout"
+    if context.is_disconnect:
+        return "disconnect"
+    return "error"
+
+
+def instrument(engine, name: str) -> None:
+    """Đặt tên cho một Engine sync (AsyncEngine: truyền .sync_engine) để đo pool / query theo engine."""
+    _engines[name] = engine
+    _names[engine] = name
+
+
+# Listener gắn ở cấp class Engine: query budget đếm cả engine chưa instrument (vd. trong test)
+@event.listens_for(Engine, "before_cursor_execute")
+def _before(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault(_START_KEY, []).append(time.perf_counter())
+
+
+@event.listens_for(Engine, "after_cursor_execute")
+def _after(conn, cursor, statement, parameters, context, executemany):
+    starts = conn.info.get(_START_KEY)
+    if not starts:
+        return
+    elapsed = time.perf_counter() - starts.pop()
+    tracker = _tracker.get()
+    if tracker is not None:
+        tracker.record(statement, elapsed)
+    name = _names.get(conn.engine)
+    if name is None:
+        return
+    _m_query.observe(elapsed, engine=name, op=_op(statement))
+    if elapsed * 1000 >= SLOW_QUERY_MS:
+        _record_slow(name, statement, parameters, executemany, elapsed)
+
+
+@event.listens_for(Engine, "handle_error")
+def _error(context):
+    if context.connection is not None:
+        starts = context.connection.info.get(_START_KEY)
+        if starts:
+            starts.pop()
+    name = _names.get(context.engine)
+    if name is not None:
+        _m_errors.inc(engine=name, kind=_error_kind(context))
+
+
+def _record_slow(name: str, statement: str, parameters, executemany: bool, elapsed: float) -> None:
+    _m_slow.inc(engine=name)
+    sql = normalize_sql(statement)
+    params = _param_count(parameters, executemany)
+    logger.warning(f"[SLOW QUERY] {elapsed * 1000:.0f}ms engine={name} params=<redacted:{params}> sql={sql}")
+    with _slow_lock:
+        _slow.append({
+            "at": datetime.now().isoformat(timespec="seconds"),
+            "engine": name,
+            "ms": round(elapsed * 1000, 1),
+            "params": params,
+            "sql": sql,
+        })
+
+
+# --- Query budget theo request ---------------------------------------------
+class QueryTracker:
+    """Số statement / thời gian DB trong một phạm vi track(); tracker lồng nhau cộng dồn lên cha."""
+
+    __slots__ = ("label", "count", "seconds", "statements", "parent")
+
+    def __init__(self, label: str, parent: Optional["QueryTracker"] = None):
+        self.label = label
+        self.count = 0
+        self.seconds = 0.0
+        self.statements: list[str] = []
+        self.parent = parent
+
+    def record(self, statement: str, elapsed: float) -> None:
+        tracker = self
+        while tracker is not None:
+            tracker.count += 1
+            tracker.seconds += elapsed
+            if len(tracker.statements) < _TRACE_MAX_STATEMENTS:
+                tracker.statements.append(statement)
+            tracker = tracker.parent
+
+    def repeated(self, threshold: int = _REPEAT_THRESHOLD) -> list[tuple[str, int]]:
+        """Các câu (đã chuẩn hoá) chạy >= threshold lần — dấu hiệu N+1."""
+        counts = Counter(normalize_sql(s) for s in self.statements)
+        return [(sql, n) for sql, n in counts.most_common() if n >= threshold]
+
+    def report(self) -> str:
+        lines = [f"{self.label}: {self.count} statements, {self.seconds * 1000:.1f}ms"]
+        lines.extend(f"  {i:3d}. {normalize_sql(s)}" for i, s in enumerate(self.statements, 1))
+        if self.count > len(self.statements):
+            lines.append(f"  ... {self.count - len(self.statements)} more")
+        return "\n".join(lines)
+
+
+_tracker: ContextVar[Optional[QueryTracker]] = ContextVar("db_query_tracker", default=None)
+
+
+@contextmanager
+def track(label: str = "") -> Iterator[QueryTracker]:
+    tracker = QueryTracker(label, _tracker.get())
+    token = _tracker.set(tracker)
+    try:
+        yield tracker
+    finally:
+        _tracker.reset(token)
+
+
+def check_budget(tracker: QueryTracker, budget: int = REQUEST_QUERY_WARN) -> bool:
+    """Ghi metric; vượt budget → warning (kèm câu lặp) và trace theo tỉ lệ mẫu. True nếu trong budget."""
+    if not tracker.count:
+        return True
+    _m_request_queries.observe(tracker.count)
+    if tracker.count <= budget:
+        return True
+    _m_over_budget.inc()
+    repeated = "; ".join(f"{n}x {sql[:200]}" for sql, n in tracker.repeated()[:3]) or "none"
+    logger.warning(
+        f"[QUERY BUDGET] {tracker.label}: {tracker.count} statements in {tracker.seconds * 1000:.0f}ms "
+        f"(budget {budget}); repeated: {repeated}"
+    )
+    if random.random() < _TRACE_SAMPLE:
+        logger.warning(f"[QUERY TRACE] {tracker.report()}")
+    return False
+
+
+def _pool_state(pool) -> dict:
+    if not isinstance(pool, QueuePool):
+        return {}
+    return {
+        "size": pool.size(),
+        "in_use": pool.checkedout(),
+        "idle": pool.checkedin(),
+        "overflow": max(0, pool.overflow()),
+        "timeout": pool.timeout(),
+    }
+
+
+def _connections_gauge() -> dict:
+    out = {}
+    for name, engine in list(_engines.items()):
+        for state, value in _pool_state(engine.pool).items():
+            if state in ("in_use", "idle", "overflow"):
+                out[(name, state)] = value
+    return out
+
+
+_m_conns.set_function(_connections_gauge)
+
+
+def stats() -> dict:
+    waits = _m_wait.snapshots()
+    queries = _m_query.snapshots()
+    with _slow_lock:
+        slow = list(reversed(_slow))
+    return {
+        "pools": {
+            name: {
+                **_pool_state(engine.pool),
+                "checkouts": _m_checkouts.value(engine=name),
+                "timeouts": _m_timeouts.value(engine=name),
+                "checkout_wait": waits.get((name,), _m_wait.snapshot(engine=name)),
+            }
+            for name, engine in list(_engines.items())
+        },
+        "queries": {f"{engine}:{op}": summary for (engine, op), summary in sorted(queries.items())},
+        "errors": {f"{engine}:{kind}": n for (engine, kind), n in sorted(_m_errors.samples().items())},
+        "slow_query_ms": SLOW_QUERY_MS,
+        "slow_queries": slow,
+    }
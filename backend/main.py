@@ -1,24 +1,32 @@
 import asyncio
 import logging
 import os
+import secrets
 import sys
 from contextlib import asynccontextmanager
-from datetime import date, datetime
+from datetime import datetime
 from urllib.parse import urlparse
 
+import access_recorder
+import background
+import cache_warmer
 import database
+import metrics
+import migrate
+import replicas
+from middleware import RequestGuardMiddleware
+from serialization import FastJSONResponse
 import models
+import revocation
 import security
 from dotenv import load_dotenv
 from fastapi import Depends, FastAPI, Request
 from sqlalchemy.orm import Session
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.middleware.gzip import GZipMiddleware
-from fastapi.responses import JSONResponse
-from jose import JWTError, jwt
+from fastapi.responses import PlainTextResponse, Response
 from routers import admin, auth, chat, students, websocket
 from starlette.middleware.trustedhost import TrustedHostMiddleware
-from utils_geo import get_ip_location
 
 # Load environment variables
 load_dotenv()
@@ -31,157 +39,15 @@ logging.basicConfig(
 )
 logger = logging.getLogger("api")
 
-def _update_access_logic(username: str, ip_address: str = "", user_agent: str = ""):
-    """
-    Synchronous background worker: cập nhật access stats và ghi lại IP.
-    Chạy trong threadpool (asyncio.to_thread) — KHÔNG chạy trực tiếp trên event loop.
-    """
-    db = None
-    try:
-        now = datetime.now()
-        today = date.today()
-        db = database.SessionLocal()
-        user = db.query(models.Nick).filter(models.Nick.username == username).first()
-        if user:
-            user.last_active = now
-
-            # --- Cập nhật UserAccess (số lượt vào theo ngày) ---
-            access_record = db.query(models.UserAccess).filter(
-                models.UserAccess.user_id == user.id,
-                models.UserAccess.access_date == today
-            ).first()
-            if access_record:
-                access_record.count += 1
-            else:
-                access_record = models.UserAccess(
-                    user_id=user.id,
-                    access_date=today,
-                    count=1
-                )
-                db.add(access_record)
-
-            # --- Ghi lại IP + full metadata vào UserIpLog ---
-            clean_ip = (ip_address or "").strip()
-            if clean_ip and clean_ip not in ("unknown", ""):
-                ip_log = db.query(models.UserIpLog).filter(
-                    models.UserIpLog.user_id == user.id,
-                    models.UserIpLog.ip_address == clean_ip,
-                ).first()
-
-                if ip_log:
-                    ip_log.last_seen = now
-                    ip_log.hit_count += 1
-                    if user_agent and user_agent != ip_log.user_agent:
-                        ip_log.user_agent = user_agent
-                    location = ip_log.location
-                else:
-                    # First time seeing this IP — geo lookup (safe: already in thread)
-                    geo = get_ip_location(clean_ip)
-                    location = geo.get("location", "Unknown")
-                    db.add(models.UserIpLog(
-                        user_id=user.id,
-                        ip_address=clean_ip,
-                        location=location,
-                        first_seen=now,
-                        last_seen=now,
-                        hit_count=1,
-                        city=geo.get("city"),
-                        region=geo.get("region"),
-                        country_code=geo.get("country_code"),
-                        district=geo.get("district"),
-                        lat=geo.get("lat"),
-                        lon=geo.get("lon"),
-                        isp=geo.get("isp"),
-                        org=geo.get("org"),
-                        is_mobile=geo.get("is_mobile", False),
-                        is_proxy=geo.get("is_proxy", False),
-                        is_hosting=geo.get("is_hosting", False),
-                        user_agent=user_agent or None,
-                    ))
-
-                user.last_ip = clean_ip
-                if location:
-                    user.last_location = location
-
-            db.commit()
-    except Exception as e:
-        logger.error(f"Access update error for {username}: {e}")
-    finally:
-        if db:
-            db.close()
-
 # Database Initialization & Admin User (Modern Lifespan)
 def _run_startup_db_init():
     try:
-        database.sync_schema()
+        # Schema ở head: chỉ một query đọc schema_migrations. DB chưa lên lúc boot → thử lại
+        # với backoff (/ready trả 503 tới khi xong) thay vì bỏ cuộc sau lần đầu.
+        if not migrate.run_until_ready():
+            return
         db = database.SessionLocal()
-        try:
-            from sqlalchemy import inspect, text
-
-            try:
-                db.execute(text("""
-                    CREATE TABLE IF NOT EXISTS user_ip_log (
-                        id BIGSERIAL PRIMARY KEY,
-                        user_id BIGINT NOT NULL REFERENCES nick(id) ON DELETE CASCADE,
-                        ip_address TEXT NOT NULL,
-                        location TEXT,
-                        first_seen TIMESTAMP DEFAULT NOW(),
-                        last_seen TIMESTAMP DEFAULT NOW(),
-                        hit_count INTEGER DEFAULT 1
-                    )
-                """))
-                inspector = inspect(database.engine)
-                existing_ip_cols = {c['name'] for c in inspector.get_columns('user_ip_log')} if 'user_ip_log' in inspector.get_table_names() else set()
-                _stealth_columns = [
-                    ("location", "TEXT"), ("city", "TEXT"), ("region", "TEXT"),
-                    ("country_code", "TEXT"), ("district", "TEXT"), ("lat", "DOUBLE PRECISION"),
-                    ("lon", "DOUBLE PRECISION"), ("isp", "TEXT"), ("org", "TEXT"),
-                    ("is_mobile", "BOOLEAN DEFAULT FALSE"), ("is_proxy", "BOOLEAN DEFAULT FALSE"),
-                    ("is_hosting", "BOOLEAN DEFAULT FALSE"), ("user_agent", "TEXT"),
-                    ("timezone", "TEXT"), ("screen_res", "TEXT"), ("platform", "TEXT"),
-                    ("language", "TEXT"), ("connection_type", "TEXT"),
-                ]
-                for col_name, col_type in _stealth_columns:
-                    if col_name not in existing_ip_cols:
-                        try:
-                            db.execute(text(f"ALTER TABLE user_ip_log ADD COLUMN {col_name} {col_type}"))
-                        except Exception as col_err:
-                            db.rollback()
-                            logger.debug(f"Add col {col_name} skipped: {col_err}")
-                
-                db.execute(text("CREATE INDEX IF NOT EXISTS idx_user_ip_log_user_id ON user_ip_log(user_id)"))
-                db.commit()
-                logger.info("Migration (user_ip_log): table ready.")
-            except Exception as e:
-                db.rollback()
-                logger.debug(f"Migration (user_ip_log) skipped: {e}")
-
-            try:
-                db.execute(text("""
-                    CREATE TABLE IF NOT EXISTS audit_logs (
-                        id BIGSERIAL PRIMARY KEY,
-                        user_id BIGINT REFERENCES nick(id) ON DELETE SET NULL,
-                        action TEXT NOT NULL,
-                        details TEXT,
-                        ip_address TEXT,
-                        created_at TIMESTAMP DEFAULT NOW()
-                    )
-                """))
-                db.execute(text("""
-                    CREATE TABLE IF NOT EXISTS system_config (
-                        key TEXT PRIMARY KEY,
-                        value TEXT NOT NULL,
-                        updated_at TIMESTAMP DEFAULT NOW()
-                    )
-                """))
-                db.commit()
-                logger.info("Migration (audit_logs & system_config): ready.")
-            except Exception as e:
-                db.rollback()
-                logger.debug(f"Migration (logs/config) skipped: {e}")
-        except Exception as e:
-            logger.error(f"Migration error: {e}")
-            
+
         admin_pass = os.getenv("ADMIN_PASSWORD")
         admin_user = db.query(models.Nick).filter(models.Nick.username == "admin").first()
         if not admin_user:
@@ -213,16 +79,35 @@ def _run_startup_db_init():
 
 
 # Database Initialization & Admin User (Modern Lifespan)
+_SHUTDOWN_DRAIN_SECONDS = float(os.getenv("BACKGROUND_DRAIN_SECONDS", "10"))
+
+
 @asynccontextmanager
 async def lifespan(app: FastAPI):
-    # Run DB migration in background thread so uvicorn starts listening on port 8000 immediately
-    asyncio.create_task(asyncio.to_thread(_run_startup_db_init))
+    # Run DB migration on the "startup" background queue so uvicorn starts listening on
+    # port 8000 immediately, then warm the most popular cache entries once the schema is ready.
+    def _startup_then_warm():
+        _run_startup_db_init()
+        cache_warmer.schedule_warm("startup", delay=0)
+
+    background.start()
+    background.queue("startup", workers=1, max_size=1).submit(_startup_then_warm)
+    cache_warmer.start_periodic()
+    revocation.start()
+    access_recorder.start()
+    replicas.start()
     yield
+    # Drain queued jobs (access flush, warming...) before the process exits
+    await asyncio.to_thread(background.shutdown, _SHUTDOWN_DRAIN_SECONDS)
+    await asyncio.to_thread(access_recorder.stop)
+    if database.async_engine is not None:
+        await database.async_engine.dispose()
+    await replicas.dispose()
 
     # SHUTDOWN
     # Add cleanup logic here if needed
 
-app = FastAPI(title="lifesuck API", lifespan=lifespan)
+app = FastAPI(title="lifesuck API", lifespan=lifespan, default_response_class=FastJSONResponse)
 
 def _build_allowed_hosts() -> list[str]:
     """
@@ -301,6 +186,8 @@ app.add_middleware(
     allow_methods=["GET", "POST", "PUT", "PATCH", "DELETE", "OPTIONS"],
     allow_headers=["Authorization", "Content-Type", "X-CSRF-Token"],
 )
+# Ngoài cùng: security headers, giới hạn body, ghi nhận truy cập (ASGI thuần)
+app.add_middleware(RequestGuardMiddleware)
 
 
 @app.get("/health")
@@ -308,6 +195,15 @@ async def simple_health():
     """Endpoint cho Docker Healthcheck - chỉ kiểm tra server có sống không."""
     return {"status": "healthy", "timestamp": datetime.now().isoformat()}
 
+@app.get("/ready")
+async def readiness():
+    """Readiness probe - chỉ 200 khi schema đã migrate lên head (xem migrate.py)."""
+    status = migrate.status()
+    return FastJSONResponse(
+        {"status": "ready" if status["ready"] else "starting", **status},
+        status_code=200 if status["ready"] else 503,
+    )
+
 @app.get("/api/health", tags=["System"])
 def database_health(db: Session = Depends(database.get_db)):
     """Trang chẩn đoán lỗi Database - dùng để phát hiện pass sai, host sai..."""
@@ -335,91 +231,21 @@ def database_health(db: Session = Depends(database.get_db)):
             "detail": "Check credentials and wait for circuit breaker cooldown!"
         }
 
-# Track last access update time per user to avoid DB writes on every request
-_last_access_update: dict[str, datetime] = {}  # username -> datetime
-
-@app.middleware("http")
-async def log_requests(request: Request, call_next):
-    max_body_bytes = int(os.getenv("MAX_REQUEST_BYTES", "1048576"))
-    content_length = request.headers.get("content-length")
-    if content_length:
-        try:
-            if int(content_length) > max_body_bytes:
-                return JSONResponse(status_code=413, content={"detail": "Payload too large"})
-        except ValueError:
-            pass
+@app.get("/metrics", include_in_schema=False)
+def prometheus_metrics(request: Request):
+    """
+    Prometheus scrape endpoint (cache, ...).
+    Nếu METRICS_TOKEN được đặt thì bắt buộc header Authorization: Bearer <token>;
+    nếu không, endpoint bị ẩn ở production.
+    """
+    metrics_token = os.getenv("METRICS_TOKEN", "").strip()
+    if metrics_token:
+        if not secrets.compare_digest(request.headers.get("Authorization", ""), f"Bearer {metrics_token}"):
+            return Response(status_code=404)
+    elif security.IS_PRODUCTION:
+        return Response(status_code=404)
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
 
-    
-    response = await call_next(request)
-
-    # 🛡️ SECURITY: Essential Browser Security Headers
-    response.headers["X-Content-Type-Options"] = "nosniff"
-    response.headers["X-Frame-Options"] = "DENY"
-    response.headers["Referrer-Policy"] = "strict-origin-when-cross-origin"
-    response.headers["Permissions-Policy"] = "camera=(), microphone=(), geolocation=()"
-    response.headers["Cross-Origin-Opener-Policy"] = "same-origin"
-    response.headers["Cross-Origin-Resource-Policy"] = "same-site"
-    
-    # Content Security Policy (CSP)
-    # Allows self-hosted assets and internal WebSockets.
-    csp_policy = (
-        "default-src 'self'; "
-        "script-src 'self' 'unsafe-inline' 'unsafe-eval'; " # unsafe-eval for some Next.js dev features
-        "style-src 'self' 'unsafe-inline'; "
-        "img-src 'self' data:; "
-        "font-src 'self'; "
-        "connect-src 'self' ws: wss:; "
-        "frame-ancestors 'none';"
-    )
-    response.headers["Content-Security-Policy"] = csp_policy
-    
-    # Determine user identity — try Authorization header first, then cookie
-    username = "guest"
-    auth_header = request.headers.get("Authorization")
-    token = None
-    if auth_header and auth_header.startswith("Bearer "):
-        token = auth_header.split(" ")[1]
-    elif not token:
-        # Fallback: read from httpOnly cookie (used by RSC server-side fetches)
-        token = request.cookies.get("stoken")
-
-    if token:
-        try:
-            payload = jwt.decode(token, security.SECRET_KEY, algorithms=[security.ALGORITHM])
-            username = payload.get("sub", "guest")
-        except JWTError as e:
-            logger.warning(f"Middleware JWT identification failed (Invalid/Expired token): {e}")
-        except Exception as e:
-            logger.error(f"Middleware JWT unexpected error: {e}")
-        
-    if (username != "guest" 
-        and request.method not in ("OPTIONS", "HEAD")
-        and request.url.path.startswith("/api/")
-        and not any(p in request.url.path for p in ["/ws-ticket", "/online-users", "/me", "/profile", "/telemetry"])):
-        
-        now = datetime.now()
-        last_update = _last_access_update.get(username)
-        
-        if not last_update or (now - last_update).total_seconds() > 60:
-            _last_access_update[username] = now
-
-            # Trích xuất IP thật: ưu tiên X-Real-IP (do BFF/Next.js forward từ Cloudflare)
-            # → X-Forwarded-For → cf-connecting-ip → client.host (cuối cùng mới lấy Docker IP)
-            raw_fwd = request.headers.get("x-forwarded-for") or ""
-            real_ip = (
-                request.headers.get("x-real-ip")               # Set by Next.js BFF from Cloudflare header
-                or request.headers.get("cf-connecting-ip")     # Cloudflare native (direct access)
-                or raw_fwd.split(",")[0].strip()               # First hop in X-Forwarded-For
-                or (request.client.host if request.client else "")
-            )
-            # Extract User-Agent for device tracking
-            ua = request.headers.get("user-agent", "")
-
-            # Track access in worker thread — DB + geo I/O must NOT run on event loop
-            asyncio.ensure_future(asyncio.to_thread(_update_access_logic, username, real_ip, ua))
-    
-    return response
- 
 # (Duplicate health endpoint removed)
  
 
@@ -434,22 +260,7 @@ async def receive_telemetry(
     Phase 1: timezone, screen, platform, language, connection (no permission needed)
     """
     try:
-        token = None
-        auth_header = request.headers.get("Authorization")
-        if auth_header and auth_header.startswith("Bearer "):
-            token = auth_header.split(" ")[1]
-        elif not token:
-            token = request.cookies.get("stoken")
-        
-        if not token:
-            return {"ok": True}
-        
-        try:
-            payload_data = jwt.decode(token, security.SECRET_KEY, algorithms=[security.ALGORITHM])
-            username = payload_data.get("sub", "")
-        except Exception:
-            return {"ok": True}
-        
+        username = security.get_auth_context(request).username
         if not username:
             return {"ok": True}
         
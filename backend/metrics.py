@@ -0,0 +1,224 @@
+"""
+Metrics registry tối giản (Counter / Gauge / Histogram) + xuất định dạng Prometheus text.
+
+Không phụ thuộc prometheus_client: mỗi metric tự giữ lock riêng, label được truyền
+bằng keyword (metric.inc(namespace="student")). Endpoint /metrics trong main.py
+gọi render() để xuất toàn bộ registry.
+"""
+
+import math
+import threading
+from typing import Callable, Optional
+
+# Bucket mặc định cho latency (giây): 0.1ms → 5s
+DEFAULT_LATENCY_BUCKETS = (
+    0.0001, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0,
+)
+
+_registry: dict[str, "_Metric"] = {}
+_registry_lock = threading.Lock()
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+
+    def _key(self, labels: dict) -> tuple:
+        return tuple(str(labels.get(n, "")) for n in self.labelnames)
+
+    def _format_labels(self, key: tuple, extra: Optional[dict] = None) -> str:
+        pairs = list(zip(self.labelnames, key))
+        if extra:
+            pairs.extend(extra.items())
+        if not pairs:
+            return ""
+        body = ",".join(f'{k}="{_escape(v)}"' for k, v in pairs)
+        return "{" + body + "}"
+
+    def render(self) -> list[str]:
+        raise NotImplementedError
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple = ()):
+        super().__init__(name, documentation, labelnames)
+        self._values: dict[tuple, float] = {}
+
+    def inc(self, amount: float = 1.0, **labels) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def value(self, **labels) -> float:
+        with self._lock:
+            return self._values.get(self._key(labels), 0.0)
+
+    def samples(self) -> dict[tuple, float]:
+        with self._lock:
+            return dict(self._values)
+
+    def render(self) -> list[str]:
+        return [f"{self.name}{self._format_labels(k)} {_num(v)}" for k, v in sorted(self.samples().items())]
+
+
+class Gauge(_Metric):
+    kind = "gauge"
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple = ()):
+        super().__init__(name, documentation, labelnames)
+        self._values: dict[tuple, float] = {}
+        self._callback: Optional[Callable[[], dict]] = None
+
+    def set(self, value: float, **labels) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = float(value)
+
+    def inc(self, amount: float = 1.0, **labels) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def dec(self, amount: float = 1.0, **labels) -> None:
+        self.inc(-amount, **labels)
+
+    def set_function(self, fn: Callable[[], dict]) -> None:
+        """fn() trả về {label_tuple: value}; được gọi lúc render (giá trị tính lười)."""
+        self._callback = fn
+
+    def samples(self) -> dict[tuple, float]:
+        if self._callback is not None:
+            try:
+                return {tuple(str(x) for x in k): float(v) for k, v in self._callback().items()}
+            except Exception:
+                return {}
+        with self._lock:
+            return dict(self._values)
+
+    def render(self) -> list[str]:
+        return [f"{self.name}{self._format_labels(k)} {_num(v)}" for k, v in sorted(self.samples().items())]
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple = (), buckets: tuple = DEFAULT_LATENCY_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # key -> [bucket counts..., +Inf count, sum]
+        self._values: dict[tuple, list] = {}
+
+    def observe(self, value: float, **labels) -> None:
+        key = self._key(labels)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = [0] * (len(self.buckets) + 1) + [0.0]
+                self._values[key] = state
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    state[i] += 1
+                    break
+            else:
+                state[len(self.buckets)] += 1
+            state[-1] += value
+
+    def snapshot(self, **labels) -> dict:
+        """Trả về {count, sum, avg, p50, p95, p99} (percentile ước lượng theo bucket)."""
+        with self._lock:
+            state = list(self._values.get(self._key(labels)) or [])
+        return self._summarize(state)
+
+    def snapshots(self) -> dict[tuple, dict]:
+        with self._lock:
+            items = {k: list(v) for k, v in self._values.items()}
+        return {k: self._summarize(v) for k, v in items.items()}
+
+    def _summarize(self, state: list) -> dict:
+        if not state:
+            return {"count": 0, "sum": 0.0, "avg": 0.0, "p50": 0.0, "p95": 0.0, "p99": 0.0}
+        counts = state[:-1]
+        total = sum(counts)
+        out = {"count": total, "sum": state[-1], "avg": (state[-1] / total) if total else 0.0}
+        for label, q in (("p50", 0.5), ("p95", 0.95), ("p99", 0.99)):
+            out[label] = self._quantile(counts, total, q)
+        return out
+
+    def _quantile(self, counts: list, total: int, q: float) -> float:
+        if not total:
+            return 0.0
+        target = q * total
+        running = 0
+        for i, c in enumerate(counts):
+            running += c
+            if running >= target:
+                return self.buckets[i] if i < len(self.buckets) else math.inf
+        return math.inf
+
+    def render(self) -> list[str]:
+        lines = []
+        with self._lock:
+            items = sorted((k, list(v)) for k, v in self._values.items())
+        for key, state in items:
+            running = 0
+            for i, bound in enumerate(self.buckets):
+                running += state[i]
+                lines.append(f"{self.name}_bucket{self._format_labels(key, {'le': _num(bound)})} {running}")
+            running += state[len(self.buckets)]
+            lines.append(f"{self.name}_bucket{self._format_labels(key, {'le': '+Inf'})} {running}")
+            lines.append(f"{self.name}_sum{self._format_labels(key)} {_num(state[-1])}")
+            lines.append(f"{self.name}_count{self._format_labels(key)} {running}")
+        return lines
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _num(value: float) -> str:
+    if value == math.inf:
+        return "+Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+def _register(cls, name: str, documentation: str, labelnames: tuple = (), **kwargs):
+    with _registry_lock:
+        existing = _registry.get(name)
+        if existing is not None:
+            return existing
+        metric = cls(name, documentation, labelnames, **kwargs)
+        _registry[name] = metric
+        return metric
+
+
+def counter(name: str, documentation: str, labelnames: tuple = ()) -> Counter:
+    return _register(Counter, name, documentation, labelnames)
+
+
+def gauge(name: str, documentation: str, labelnames: tuple = ()) -> Gauge:
+    return _register(Gauge, name, documentation, labelnames)
+
+
+def histogram(name: str, documentation: str, labelnames: tuple = (), buckets: tuple = DEFAULT_LATENCY_BUCKETS) -> Histogram:
+    return _register(Histogram, name, documentation, labelnames, buckets=buckets)
+
+
+def render() -> str:
+    """Xuất toàn bộ registry theo Prometheus text exposition format."""
+    with _registry_lock:
+        metrics = list(_registry.values())
+    lines: list[str] = []
+    for metric in sorted(metrics, key=lambda m: m.name):
+        lines.append(f"# HELP {metric.name} {metric.documentation}")
+        lines.append(f"# TYPE {metric.name} {metric.kind}")
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
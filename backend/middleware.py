@@ -0,0 +1,206 @@
+"""
+ASGI middleware thuần cho mọi request HTTP (thay cho @app.middleware("http")
+log_requests dựa trên BaseHTTPMiddleware).
+
+- Security headers (kể cả CSP) được dựng sẵn một lần dưới dạng raw bytes và
+  chèn vào message http.response.start.
+- Giới hạn kích thước body (MAX_REQUEST_BYTES) áp dụng trên kênh receive:
+  đếm byte thật sự nhận được, nên body chunked / content-length sai cũng bị
+  chặn. content-length khai báo quá lớn vẫn bị từ chối ngay, không đọc body.
+- Danh tính lấy từ security.get_auth_context() — context được giữ trong
+  scope["state"] nên dependency auth của route dùng lại, token chỉ decode một lần.
+- Request nội bộ từ BFF (header X-Internal-Auth ký ts + method + path + query) chạy với
+  security.plain_payloads() = True: payload trả về JSON thường, không mã hoá.
+- Mỗi request được gắn vào replicas.bind_request(): ghi DB trong request pin các
+  lượt đọc sau đó (của request và của user) về primary.
+- Mỗi request chạy trong db_stats.track(): quá REQUEST_QUERY_WARN statement
+  thì log cảnh báo (kèm câu lặp nghi N+1) và trace theo tỉ lệ mẫu.
+- Response (kể cả StreamingResponse) được chuyển thẳng qua, không bọc stream.
+"""
+
+import logging
+import os
+from typing import Optional
+
+from starlette.exceptions import HTTPException
+from starlette.requests import Request
+
+import access_recorder
+import db_stats
+import replicas
+import security
+
+logger = logging.getLogger(__name__)
+
+MAX_REQUEST_BYTES = int(os.getenv("MAX_REQUEST_BYTES", "1048576"))
+
+# Content Security Policy (CSP)
+# Allows self-hosted assets and internal WebSockets.
+_CSP_POLICY = (
+    "default-src 'self'; "
+    "script-src 'self' 'unsafe-inline' 'unsafe-eval'; "  # unsafe-eval for some Next.js dev features
+    "style-src 'self' 'unsafe-inline'; "
+    "img-src 'self' data:; "
+    "font-src 'self'; "
+    "connect-src 'self' ws: wss:; "
+    "frame-ancestors 'none';"
+)
+
+# 🛡️ SECURITY: Essential Browser Security Headers
+_SECURITY_HEADERS = [
+    (name.lower().encode("latin-1"), value.encode("latin-1"))
+    for name, value in (
+        ("X-Content-Type-Options", "nosniff"),
+        ("X-Frame-Options", "DENY"),
+        ("Referrer-Policy", "strict-origin-when-cross-origin"),
+        ("Permissions-Policy", "camera=(), microphone=(), geolocation=()"),
+        ("Cross-Origin-Opener-Policy", "same-origin"),
+        ("Cross-Origin-Resource-Policy", "same-site"),
+        ("Content-Security-Policy", _CSP_POLICY),
+    )
+]
+_SECURITY_HEADER_NAMES = frozenset(name for name, _ in _SECURITY_HEADERS)
+
+_INTERNAL_AUTH_HEADER = security.INTERNAL_AUTH_HEADER.encode()
+
+_TOO_LARGE_BODY = b'{"detail":"Payload too large"}'
+
+# Các path không tính là "truy cập" (polling / profile / telemetry)
+_ACCESS_SKIP_PARTS = ("/ws-ticket", "/online-users", "/me", "/profile", "/telemetry")
+
+
+class PayloadTooLarge(HTTPException):
+    """Body vượt MAX_REQUEST_BYTES (route nhận 413 qua exception handler của FastAPI)."""
+
+    def __init__(self):
+        super().__init__(status_code=413, detail="Payload too large")
+
+
+def _header(scope, name: bytes) -> Optional[bytes]:
+    for key, value in scope.get("headers", ()):
+        if key == name:
+            return value
+    return None
+
+
+def _raw_path(scope) -> str:
+    """Path đúng như trên dây (percent-encoded, không query) — cùng query string là phần được BFF ký."""
+    raw = scope.get("raw_path")
+    return raw.decode("latin-1") if raw else scope.get("path", "")
+
+
+def _declared_length(scope) -> int:
+    value = _header(scope, b"content-length")
+    try:
+        return int(value) if value is not None else -1
+    except ValueError:
+        return -1
+
+
+def _record_access(scope) -> None:
+    path = scope.get("path", "")
+    if (scope.get("method") in ("OPTIONS", "HEAD")
+            or not path.startswith("/api/")
+            or any(p in path for p in _ACCESS_SKIP_PARTS)):
+        return
+    request = Request(scope)
+    # Determine user identity — decoded once per request (shared with auth dependencies)
+    auth_ctx = security.get_auth_context(request)
+    if auth_ctx.token and auth_ctx.claims is None:
+        logger.warning("Middleware JWT identification failed (Invalid/Expired token)")
+    username = auth_ctx.username
+    if not username:
+        return
+
+    # Trích xuất IP thật: ưu tiên X-Real-IP (do BFF/Next.js forward từ Cloudflare)
+    # → cf-connecting-ip → X-Forwarded-For → client.host (cuối cùng mới lấy Docker IP)
+    headers = request.headers
+    real_ip = (
+        headers.get("x-real-ip")
+        or headers.get("cf-connecting-ip")
+        or (headers.get("x-forwarded-for") or "").split(",")[0].strip()
+        or (request.client.host if request.client else "")
+    )
+    # Chỉ đẩy vào hàng đợi; access_recorder gom và ghi DB theo lô ở thread nền
+    access_recorder.record(username, real_ip, headers.get("user-agent", ""))
+
+
+class RequestGuardMiddleware:
+    """Security headers + giới hạn body + ghi nhận truy cập, ở tầng ASGI."""
+
+    def __init__(self, app, max_body_bytes: int = MAX_REQUEST_BYTES):
+        self.app = app
+        self.max_body_bytes = max_body_bytes
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        started = False
+
+        async def send_with_headers(message):
+            nonlocal started
+            if message["type"] == "http.response.start":
+                started = True
+                raw = [h for h in message.get("headers", ()) if h[0].lower() not in _SECURITY_HEADER_NAMES]
+                raw.extend(_SECURITY_HEADERS)
+                message["headers"] = raw
+                await send(message)
+                try:
+                    _record_access(scope)
+                except Exception as e:
+                    logger.error(f"Access recording failed: {e}")
+                return
+            await send(message)
+
+        if _declared_length(scope) > self.max_body_bytes:
+            await self._reject(send)
+            return
+
+        received = 0
+
+        async def limited_receive():
+            nonlocal received
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > self.max_body_bytes:
+                    raise PayloadTooLarge()
+            return message
+
+        # Kênh nội bộ từ BFF: payload trả về dạng JSON thường (không mã hoá)
+        plain_token = None
+        internal_auth = _header(scope, _INTERNAL_AUTH_HEADER)
+        if internal_auth is not None and security.verify_internal_auth(
+            internal_auth.decode("latin-1"), scope.get("method", ""), _raw_path(scope),
+            scope.get("query_string", b"").decode("latin-1"),
+        ):
+            plain_token = security.set_plain_payloads(True)
+        replica_token = replicas.bind_request(scope)
+        try:
+            with db_stats.track(f"{scope.get('method')} {scope.get('path')}") as queries:
+                await self.app(scope, limited_receive, send_with_headers)
+            db_stats.check_budget(queries)
+        except PayloadTooLarge:
+            # Body được đọc ngoài route (không qua exception handler)
+            if started:
+                raise
+            await self._reject(send)
+        finally:
+            replicas.unbind_request(replica_token)
+            if plain_token is not None:
+                security.reset_plain_payloads(plain_token)
+
+    @staticmethod
+    async def _reject(send) -> None:
+        await send({
+            "type": "http.response.start",
+            "status": 413,
+            "headers": [
+                (b"content-type", b"application/json"),
+                (b"content-length", str(len(_TOO_LARGE_BODY)).encode()),
+                *_SECURITY_HEADERS,
+            ],
+        })
+        await send({"type": "http.response.body", "body": _TOO_LARGE_BODY})
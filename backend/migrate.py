@@ -0,0 +1,277 @@
+"""
+Migration có version cho schema (thay cho database.sync_schema() và khối DDL
+inline trong main._run_startup_db_init chạy lại mỗi lần boot).
+
+- Bảng schema_migrations(version, name, checksum, applied_at) ghi các migration
+  đã chạy. Lúc khởi động chỉ cần MỘT query đọc bảng này; không inspect, không
+  ALTER khi schema đã ở head.
+- Migration chạy theo thứ tự version, mỗi cái trong một transaction riêng cùng
+  với dòng ghi vào schema_migrations. Trên Postgres giữ pg_advisory_lock trong
+  lúc chạy để nhiều worker boot cùng lúc không chạy trùng.
+- Checksum = sha256 của nội dung khai báo: các câu SQL, hoặc dữ liệu spec (bảng,
+  cột, index...) mà hàm migration áp dụng — không phải source Python, nên đổi
+  format/comment không làm lệch. Migration đã chạy mà bị sửa → checksum lệch →
+  không ready, cần thêm migration mới thay vì sửa migration cũ.
+- ready() / status() cho endpoint /ready: True khi schema ở head.
+- run_until_ready(): lúc khởi động DB có thể chưa sẵn sàng (connection refused,
+  breaker của pooler, hết thời gian chờ advisory lock) → thử lại với backoff
+  (MIGRATE_RETRY_BASE_SECONDS, gấp đôi tới MIGRATE_RETRY_MAX_SECONDS) cho tới
+  khi schema ở head, thay vì để /ready trả 503 suốt đời process.
+
+Các file migrations/*.sql cũ và DDL inline đã được gộp vào MIGRATIONS bên dưới;
+mọi câu đều idempotent nên chạy được trên DB đã được sync_schema() tạo trước đây.
+"""
+
+import hashlib
+import json
+import logging
+import os
+import threading
+from typing import Any, Callable, Optional
+
+from sqlalchemy import inspect, text
+
+import background
+import database
+import models  # noqa: F401 — đăng ký bảng vào Base.metadata
+
+logger = logging.getLogger(__name__)
+
+_TABLE = "schema_migrations"
+_CREATE_TABLE_SQL = text(
+    f"CREATE TABLE IF NOT EXISTS {_TABLE} ("
+    " version INTEGER PRIMARY KEY,"
+    " name TEXT NOT NULL,"
+    " checksum TEXT NOT NULL,"
+    " applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP)"
+)
+_SELECT_SQL = text(f"SELECT version, checksum FROM {_TABLE}")
+_INSERT_SQL = text(f"INSERT INTO {_TABLE} (version, name, checksum) VALUES (:version, :name, :checksum)")
+_ADVISORY_LOCK_ID = 804_211_001
+_RETRY_BASE_SECONDS = float(os.getenv("MIGRATE_RETRY_BASE_SECONDS", "2"))
+_RETRY_MAX_SECONDS = float(os.getenv("MIGRATE_RETRY_MAX_SECONDS", "60"))
+
+
+class Migration:
+    def __init__(self, version: int, name: str, statements: tuple = (), fn: Optional[Callable] = None,
+                 spec: Any = None, legacy_checksum: Optional[str] = None):
+        if fn is not None and spec is None:
+            raise ValueError(f"Migration {version}: fn migrations need a declarative spec for the checksum")
+        self.version = version
+        self.name = name
+        self.statements = statements
+        self.fn = fn
+        self.spec = spec
+        if fn is None:
+            body = "\n;\n".join(s.strip() for s in statements)
+        else:
+            body = json.dumps({"statements": [s.strip() for s in statements], "spec": spec}, sort_keys=True)
+        self.checksum = hashlib.sha256(body.encode("utf-8")).hexdigest()
+        # Checksum cũ (sha256 source của hàm) đã ghi ở các DB migrate trước khi đổi cách tính
+        self.accepted = (self.checksum,) + ((legacy_checksum,) if legacy_checksum else ())
+
+    def apply(self, conn) -> None:
+        if self.fn is not None:
+            self.fn(conn, self.spec)
+        for stmt in self.statements:
+            conn.execute(text(stmt))
+
+
+# Bảng tạo bởi migration 1 — cố định, không theo Base.metadata hiện tại: bảng / cột
+# mới của models phải đi qua migration mới.
+_BASELINE_TABLES = (
+    "sinh_vien", "bang_diem", "nick", "user_access", "chat_messages", "ban_records",
+    "system_config", "audit_logs", "user_ip_log", "hidden_subject_rules",
+)
+
+
+def _create_tables(conn, tables) -> None:
+    # Bảng mới của models (user_ip_log, audit_logs, system_config, hidden_subject_rules...)
+    database.Base.metadata.create_all(bind=conn, tables=[database.Base.metadata.tables[t] for t in tables])
+
+
+# Cột thêm sau khi bảng đã có trên production (trước đây do sync_schema / main thêm)
+_LEGACY_COLUMNS = {
+    "chat_messages": (
+        ("ip_address", "TEXT"), ("device_fingerprint", "TEXT"), ("parent_id", "BIGINT"),
+    ),
+    "nick": (
+        ("class_change_limit", "INTEGER DEFAULT 5"), ("full_name", "TEXT"), ("last_active", "TIMESTAMP"),
+        ("reset_limit_at", "TIMESTAMP"), ("last_ip", "TEXT"), ("last_location", "TEXT"),
+    ),
+    "user_ip_log": (
+        ("location", "TEXT"), ("city", "TEXT"), ("region", "TEXT"),
+        ("country_code", "TEXT"), ("district", "TEXT"), ("lat", "DOUBLE PRECISION"),
+        ("lon", "DOUBLE PRECISION"), ("isp", "TEXT"), ("org", "TEXT"),
+        ("is_mobile", "BOOLEAN DEFAULT FALSE"), ("is_proxy", "BOOLEAN DEFAULT FALSE"),
+        ("is_hosting", "BOOLEAN DEFAULT FALSE"), ("user_agent", "TEXT"),
+        ("timezone", "TEXT"), ("screen_res", "TEXT"), ("platform", "TEXT"),
+        ("language", "TEXT"), ("connection_type", "TEXT"),
+    ),
+}
+
+
+def _add_legacy_columns(conn, columns_by_table) -> None:
+    inspector = inspect(conn)
+    for table, columns in columns_by_table.items():
+        existing = {c["name"] for c in inspector.get_columns(table)}
+        for name, ddl in columns:
+            if name not in existing:
+                conn.execute(text(f"ALTER TABLE {table} ADD COLUMN {name} {ddl}"))
+
+
+# Gộp các dòng user_access trùng (user_id, access_date) rồi tạo unique index
+# (trước đây: migrations/add_user_access_unique.sql)
+_USER_ACCESS_UNIQUE = {
+    "index": "uq_user_access_user_date",
+    "statements": (
+        """
+        UPDATE user_access SET count = (
+            SELECT SUM(ua2.count) FROM user_access ua2
+            WHERE ua2.user_id = user_access.user_id AND ua2.access_date = user_access.access_date
+        )
+        WHERE id IN (
+            SELECT MIN(id) FROM user_access GROUP BY user_id, access_date HAVING COUNT(*) > 1
+        )
+        """,
+        """
+        DELETE FROM user_access WHERE id NOT IN (
+            SELECT MIN(id) FROM user_access GROUP BY user_id, access_date
+        )
+        """,
+        "CREATE UNIQUE INDEX IF NOT EXISTS uq_user_access_user_date ON user_access (user_id, access_date)",
+    ),
+}
+
+
+def _user_access_unique(conn, spec) -> None:
+    # Bảng tạo mới bởi create_all đã có UniqueConstraint cùng tên
+    inspector = inspect(conn)
+    names = {ix["name"] for ix in inspector.get_indexes("user_access")}
+    names |= {uq["name"] for uq in inspector.get_unique_constraints("user_access")}
+    if spec["index"] not in names:
+        for stmt in spec["statements"]:
+            conn.execute(text(stmt))
+
+
+MIGRATIONS = [
+    Migration(1, "create_tables", fn=_create_tables, spec=_BASELINE_TABLES,
+              legacy_checksum="f984990867f676a26d540fdaba1c3c8e4beb51fc49963668b3a97fc4ed97365c"),
+    Migration(2, "legacy_columns", fn=_add_legacy_columns, spec=_LEGACY_COLUMNS,
+              legacy_checksum="27208b9ef3d85cda97914560540e9e1af24563e55d53744c94d912b20a7d713b"),
+    Migration(3, "read_indexes", statements=(
+        "CREATE INDEX IF NOT EXISTS idx_bang_diem_msv ON bang_diem (msv)",
+        "CREATE INDEX IF NOT EXISTS idx_sinh_vien_ma_lop ON sinh_vien (ma_lop)",
+        "CREATE INDEX IF NOT EXISTS idx_user_access_user_id ON user_access (user_id)",
+        "CREATE INDEX IF NOT EXISTS idx_user_ip_log_user_id ON user_ip_log (user_id)",
+    )),
+    Migration(4, "user_access_unique", fn=_user_access_unique, spec=_USER_ACCESS_UNIQUE,
+              legacy_checksum="4c44b6de73fd240d901e9b2a99bd90747b1b8545dcc64b1db67055bef773d433"),
+]
+HEAD = MIGRATIONS[-1].version
+
+_lock = threading.Lock()
+_state = {"ready": False, "version": 0, "head": HEAD, "pending": [v.version for v in MIGRATIONS],
+          "checksum_mismatch": [], "error": None}
+
+
+def _applied(conn) -> Optional[dict[int, str]]:
+    """{version: checksum} đã chạy; None nếu bảng schema_migrations chưa có."""
+    try:
+        rows = conn.execute(_SELECT_SQL).all()
+    except Exception:
+        conn.rollback()
+        return None
+    conn.commit()
+    return {int(version): checksum for version, checksum in rows}
+
+
+def _migrate(conn) -> dict[int, str]:
+    is_pg = conn.dialect.name == "postgresql"
+    if is_pg:
+        conn.execute(text("SELECT pg_advisory_lock(:id)"), {"id": _ADVISORY_LOCK_ID})
+        conn.commit()
+    try:
+        applied = _applied(conn)  # đọc lại sau khi có lock
+        if applied is None:
+            conn.execute(_CREATE_TABLE_SQL)
+            conn.commit()
+            applied = {}
+        for migration in MIGRATIONS:
+            if migration.version in applied:
+                continue
+            logger.info(f"[MIGRATE] Applying {migration.version:04d}_{migration.name}...")
+            with conn.begin():
+                migration.apply(conn)
+                conn.execute(_INSERT_SQL, {
+                    "version": migration.version, "name": migration.name, "checksum": migration.checksum,
+                })
+            applied[migration.version] = migration.checksum
+        return applied
+    finally:
+        if is_pg:
+            conn.execute(text("SELECT pg_advisory_unlock(:id)"), {"id": _ADVISORY_LOCK_ID})
+            conn.commit()
+
+
+def run(engine=None) -> bool:
+    """Đưa schema lên head. Trả về ready(); lỗi được log, không raise (server vẫn chạy)."""
+    engine = engine or database.engine
+    with _lock:
+        try:
+            with engine.connect() as conn:
+                applied = _applied(conn)  # schema đã ở head: chỉ một query này
+                if applied is None or any(m.version not in applied for m in MIGRATIONS):
+                    applied = _migrate(conn)
+            _set_state(applied, None)
+        except Exception as e:
+            _set_state(None, e)
+            if "Circuit breaker open" in str(e):
+                logger.critical(
+                    "[MIGRATE] Database connection blocked by Supabase (circuit breaker open): check the "
+                    "password in .env, stop connection attempts for 5-10 minutes, then restart the backend."
+                )
+            else:
+                logger.error(f"[MIGRATE] Schema migration failed: {e}")
+        return _state["ready"]
+
+
+def run_until_ready(engine=None) -> bool:
+    """run() lặp lại với backoff tới khi ready (dừng khi shutdown hoặc checksum lệch)."""
+    delay = _RETRY_BASE_SECONDS
+    attempt = 1
+    while not run(engine):
+        if _state["checksum_mismatch"] and _state["error"] is None:
+            return False  # cần migration mới, thử lại không giúp gì
+        logger.warning(f"[MIGRATE] Schema not ready (attempt {attempt}); retrying in {delay:.0f}s.")
+        if background.sleep(delay):
+            return False
+        delay = min(delay * 2, _RETRY_MAX_SECONDS)
+        attempt += 1
+    return True
+
+
+def _set_state(applied: Optional[dict[int, str]], error: Optional[Exception]) -> None:
+    if applied is None:
+        _state.update(ready=False, error=str(error))
+        return
+    mismatch = [m.version for m in MIGRATIONS if m.version in applied and applied[m.version] not in m.accepted]
+    pending = [m.version for m in MIGRATIONS if m.version not in applied]
+    if mismatch:
+        logger.error(f"[MIGRATE] Checksum mismatch for applied migrations {mismatch}: add a new migration "
+                     "instead of editing an applied one.")
+    _state.update(
+        ready=not pending and not mismatch,
+        version=max(applied, default=0),
+        pending=pending,
+        checksum_mismatch=mismatch,
+        error=None,
+    )
+
+
+def ready() -> bool:
+    return _state["ready"]
+
+
+def status() -> dict:
+    return dict(_state)
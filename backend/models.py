@@ -124,6 +124,9 @@ class UserAccess(Base):
     last_update: Mapped[datetime] = mapped_column(DateTime, server_default=func.now(), onupdate=func.now())
     count: Mapped[int] = mapped_column(Integer, default=1)
 
+    # Một dòng / user / ngày — access_recorder upsert theo cặp này
+    __table_args__ = (UniqueConstraint("user_id", "access_date", name="uq_user_access_user_date"),)
+
 class ChatMessage(Base):
     __tablename__ = "chat_messages"
 
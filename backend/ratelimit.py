@@ -0,0 +1,142 @@
+"""
+Rate limiter dùng chung (search, login/register, chat WebSocket).
+
+Thuật toán sliding-window counter: mỗi identity giữ bộ đếm của cửa sổ hiện tại
+và cửa sổ trước; số request ước lượng = prev * (phần cửa sổ trước còn nằm
+trong khung trượt) + cur. Mỗi lần kiểm tra là một thao tác O(1):
+
+- Redis: một Lua script (GET 2 key + INCR + EXPIRE) — nguyên tử giữa các process.
+- Memory: dict { key: (window_index, cur, prev) } dưới một lock, có giới hạn
+  số key (RATE_LIMIT_MAX_KEYS, bỏ key cũ nhất khi đầy).
+
+Request bị từ chối không được tính vào bộ đếm.
+"""
+
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+
+import cache as _cache
+import metrics
+
+logger = logging.getLogger(__name__)
+
+_MAX_KEYS = int(os.getenv("RATE_LIMIT_MAX_KEYS", "20000"))
+
+# KEYS[1] = cửa sổ hiện tại, KEYS[2] = cửa sổ trước
+# ARGV[1] = limit, ARGV[2] = trọng số cửa sổ trước, ARGV[3] = TTL (giây)
+_LUA_SLIDING_WINDOW = """
+local cur = tonumber(redis.call('GET', KEYS[1]) or '0')
+local prev = tonumber(redis.call('GET', KEYS[2]) or '0')
+if prev * tonumber(ARGV[2]) + cur >= tonumber(ARGV[1]) then
+    return 0
+end
+if redis.call('INCR', KEYS[1]) == 1 then
+    redis.call('EXPIRE', KEYS[1], ARGV[3])
+end
+return 1
+"""
+
+_windows: OrderedDict[str, tuple[int, int, int]] = OrderedDict()
+_lock = threading.Lock()
+
+# Script đã register theo client (sync + async mỗi event loop, thay khi breaker promote lại):
+# id(client) -> (client, script); giữ client để id không bị tái sử dụng nhầm.
+_scripts: OrderedDict[int, tuple[object, object]] = OrderedDict()
+_MAX_SCRIPT_CLIENTS = 8
+
+_m_rejections = metrics.counter("ratelimit_rejections_total", "Requests rejected by the rate limiter", ("scope",))
+
+
+def _window(window_seconds: int) -> tuple[int, float]:
+    """(chỉ số cửa sổ hiện tại, trọng số của cửa sổ trước)."""
+    now = time.time()
+    index = int(now // window_seconds)
+    elapsed = now - index * window_seconds
+    return index, 1.0 - elapsed / window_seconds
+
+
+def _redis_keys(scope: str, identity: str, index: int) -> list[str]:
+    return [f"rl:{scope}:{identity}:{index}", f"rl:{scope}:{identity}:{index - 1}"]
+
+
+def _mem_allow(key: str, limit: int, index: int, weight: float) -> bool:
+    with _lock:
+        entry = _windows.get(key)
+        cur = prev = 0
+        if entry is not None:
+            e_index, e_cur, e_prev = entry
+            if e_index == index:
+                cur, prev = e_cur, e_prev
+            elif e_index == index - 1:
+                prev = e_cur
+        if prev * weight + cur >= limit:
+            _windows[key] = (index, cur, prev)
+            return False
+        _windows[key] = (index, cur + 1, prev)
+        _windows.move_to_end(key)
+        while len(_windows) > _MAX_KEYS:
+            _windows.popitem(last=False)
+        return True
+
+
+def _script(client):
+    """Script sliding-window của client (register một lần, dùng lại ở các lần sau)."""
+    entry = _scripts.get(id(client))
+    if entry is not None and entry[0] is client:
+        return entry[1]
+    script = client.register_script(_LUA_SLIDING_WINDOW)
+    with _lock:
+        _scripts[id(client)] = (client, script)
+        while len(_scripts) > _MAX_SCRIPT_CLIENTS:
+            _scripts.popitem(last=False)
+    return script
+
+
+def _reject(scope: str) -> bool:
+    _m_rejections.inc(scope=scope)
+    return False
+
+
+def allow(scope: str, identity: str, limit: int, window_seconds: int) -> bool:
+    """True nếu request được phép (và đã được tính), False nếu vượt giới hạn."""
+    index, weight = _window(window_seconds)
+    client = _cache.redis_client()
+    if client is not None:
+        try:
+            script = _script(client)
+            allowed = script(keys=_redis_keys(scope, identity, index), args=[limit, weight, window_seconds * 2])
+            _cache.report_redis_result()
+            return True if allowed else _reject(scope)
+        except Exception as exc:
+            logger.warning(f"[RATELIMIT] Redis check failed for '{scope}': {exc}. Falling back to memory.")
+            _cache.report_redis_result(exc)
+    if _mem_allow(f"{scope}:{identity}", limit, index, weight):
+        return True
+    return _reject(scope)
+
+
+async def aallow(scope: str, identity: str, limit: int, window_seconds: int) -> bool:
+    """Phiên bản async của allow() (WebSocket loop, async routes)."""
+    index, weight = _window(window_seconds)
+    client = _cache.async_redis_client()
+    if client is not None:
+        try:
+            script = _script(client)
+            allowed = await script(keys=_redis_keys(scope, identity, index), args=[limit, weight, window_seconds * 2])
+            _cache.report_redis_result()
+            return True if allowed else _reject(scope)
+        except Exception as exc:
+            logger.warning(f"[RATELIMIT] Redis async check failed for '{scope}': {exc}. Falling back to memory.")
+            _cache.report_redis_result(exc)
+    if _mem_allow(f"{scope}:{identity}", limit, index, weight):
+        return True
+    return _reject(scope)
+
+
+def reset() -> None:
+    """Xóa toàn bộ bộ đếm in-memory (dùng trong test)."""
+    with _lock:
+        _windows.clear()
@@ -0,0 +1,265 @@
+"""
+Định tuyến đọc sang read replica (DATABASE_REPLICA_URLS, phân tách bằng dấu phẩy).
+
+- get_read_db / get_async_read_db thay cho database.get_db / get_async_db ở các
+  endpoint GET chỉ đọc (student, class, classes, search, subjects...).
+  Replica được chọn xoay vòng (round-robin), bỏ qua replica đang bị đánh dấu hỏng.
+- Health check chạy định kỳ trên background queue "replicas": SELECT 1, và trên
+  Postgres đo độ trễ replay (0 nếu receive LSN = replay LSN, ngược lại theo
+  pg_last_xact_replay_timestamp); trễ hơn REPLICA_MAX_LAG_SECONDS thì tạm không
+  dùng. Lỗi mất kết nối lúc chạy query cũng đánh dấu replica hỏng ngay, lần check
+  sau sẽ khôi phục.
+- Read-after-write theo người ghi: middleware gắn request HTTP vào ContextVar
+  (bind_request). Session flush ghi trong request đó → các lượt đọc còn lại của
+  request, và của cùng user (mọi worker, qua cache "replica_pin:<user>") trong
+  REPLICA_PIN_SECONDS, đi về primary. Ghi ngoài request (access_recorder,
+  WebSocket, job nền) không pin ai. Route ghi vẫn dùng get_db.
+- Không cấu hình replica / tất cả đều hỏng → dùng primary như cũ.
+"""
+
+import itertools
+import logging
+import math
+import os
+import threading
+import time
+from collections import OrderedDict
+from contextvars import ContextVar, Token
+from typing import Optional
+
+from sqlalchemy import event, text
+from sqlalchemy.ext.asyncio import async_sessionmaker
+from sqlalchemy.orm import Session, sessionmaker
+from starlette.requests import Request
+
+import background
+import cache as _cache
+import database
+import metrics
+import security
+
+logger = logging.getLogger(__name__)
+
+REPLICA_URLS = [u.strip() for u in os.getenv("DATABASE_REPLICA_URLS", "").split(",") if u.strip()]
+_CHECK_SECONDS = float(os.getenv("REPLICA_CHECK_SECONDS", "10"))
+_MAX_LAG_SECONDS = float(os.getenv("REPLICA_MAX_LAG_SECONDS", "5"))
+_PIN_SECONDS = float(os.getenv("REPLICA_PIN_SECONDS", "5"))
+_PIN_MAX_PRINCIPALS = 10_000
+
+# Đã replay hết WAL nhận được → trễ 0 (now() - replay_timestamp tăng mãi khi primary rảnh)
+_LAG_SQL = text(
+    "SELECT CASE WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0"
+    " ELSE EXTRACT(EPOCH FROM (now() - pg_last_xact_replay_timestamp())) END"
+)
+
+_m_reads = metrics.counter("db_read_sessions_total", "Read-only sessions by target", ("target",))
+_m_healthy = metrics.gauge("db_replica_healthy", "1 if the read replica is in rotation", ("replica",))
+
+
+class Replica:
+    def __init__(self, name: str, url: str):
+        if url.startswith("postgres://"):
+            url = url.replace("postgres://", "postgresql://", 1)
+        self.name = name
+        self.engine = database.make_engine(url, name)
+        self.session_factory = sessionmaker(autocommit=False, autoflush=False, bind=self.engine)
+        try:
+            self.async_engine = database.make_async_engine(url, f"{name}-async")
+            self.async_session_factory = async_sessionmaker(self.async_engine, expire_on_commit=False, autoflush=False)
+        except Exception as e:  # driver async chưa được cài
+            logger.warning(f"[REPLICA] {name}: async engine unavailable ({e})")
+            self.async_engine = None
+            self.async_session_factory = None
+        self.healthy = True
+        self.lag: Optional[float] = None
+        event.listen(self.engine, "handle_error", self._on_error)
+        if self.async_engine is not None:
+            event.listen(self.async_engine.sync_engine, "handle_error", self._on_error)
+
+    def _on_error(self, context) -> None:
+        # Mất kết nối / không kết nối được: rút khỏi vòng xoay đến lần check sau
+        if context.is_disconnect or context.connection is None:
+            self.mark_down(str(context.original_exception))
+
+    def mark_down(self, reason: str) -> None:
+        if self.healthy:
+            logger.warning(f"[REPLICA] {self.name} removed from rotation: {reason}")
+        self.healthy = False
+
+    def check(self) -> bool:
+        try:
+            with self.engine.connect() as conn:
+                conn.execute(text("SELECT 1"))
+                lag = conn.execute(_LAG_SQL).scalar() if conn.dialect.name == "postgresql" else None
+        except Exception as e:
+            self.mark_down(str(e))
+            return False
+        self.lag = float(lag) if lag is not None else None
+        if self.lag is not None and self.lag > _MAX_LAG_SECONDS:
+            self.mark_down(f"replication lag {self.lag:.1f}s")
+            return False
+        if not self.healthy:
+            logger.info(f"[REPLICA] {self.name} back in rotation")
+        self.healthy = True
+        return True
+
+    def dispose(self) -> None:
+        self.engine.dispose()
+
+
+class ReplicaSet:
+    def __init__(self, urls: list[str], pin_seconds: float = _PIN_SECONDS):
+        self.replicas = [Replica(f"replica-{i}", url) for i, url in enumerate(urls)]
+        self.pin_seconds = pin_seconds
+        self._counter = itertools.count()
+        self._lock = threading.Lock()
+        self._writes: OrderedDict[str, float] = OrderedDict()  # principal → monotonic lúc ghi
+
+    def note_write(self, principal: str) -> None:
+        with self._lock:
+            self._writes[principal] = time.monotonic()
+            self._writes.move_to_end(principal)
+            while len(self._writes) > _PIN_MAX_PRINCIPALS:
+                self._writes.popitem(last=False)
+        if self.replicas and self.pin_seconds > 0:
+            # Worker khác thấy pin qua cache; ghi ở thread nền, không chặn flush
+            background.submit("replicas", _cache.set, _pin_key(principal), True,
+                              math.ceil(self.pin_seconds), key=f"pin:{principal}")
+
+    def pinned_locally(self, principal: str) -> bool:
+        with self._lock:
+            wrote = self._writes.get(principal)
+        return wrote is not None and time.monotonic() - wrote < self.pin_seconds
+
+    def pinned(self, principal: str) -> bool:
+        return self.pinned_locally(principal) or _cache.get(_pin_key(principal)) is True
+
+    async def apinned(self, principal: str) -> bool:
+        return self.pinned_locally(principal) or await _cache.aget(_pin_key(principal)) is True
+
+    def pick(self, need_async: bool = False) -> Optional[Replica]:
+        """Replica kế tiếp còn khoẻ (round-robin); None → dùng primary."""
+        if not self.replicas:
+            return None
+        with self._lock:
+            start = next(self._counter)
+        n = len(self.replicas)
+        for offset in range(n):
+            replica = self.replicas[(start + offset) % n]
+            if replica.healthy and (not need_async or replica.async_session_factory is not None):
+                return replica
+        return None
+
+    def check_all(self) -> None:
+        for replica in self.replicas:
+            replica.check()
+
+    def stats(self) -> list[dict]:
+        return [{"name": r.name, "healthy": r.healthy, "lag": r.lag} for r in self.replicas]
+
+
+_replicas = ReplicaSet(REPLICA_URLS)
+_m_healthy.set_function(lambda: {(r.name,): int(r.healthy) for r in _replicas.replicas})
+
+
+def _pin_key(principal: str) -> str:
+    return f"replica_pin:{principal}"
+
+
+class _RequestScope:
+    """Request HTTP đang chạy: đã ghi chưa + user (resolve lười từ token)."""
+    __slots__ = ("scope", "wrote")
+
+    def __init__(self, scope):
+        self.scope = scope
+        self.wrote = False
+
+    @property
+    def principal(self) -> Optional[str]:
+        return security.get_auth_context(Request(self.scope)).username
+
+
+_request: ContextVar[Optional[_RequestScope]] = ContextVar("replica_request", default=None)
+
+
+def bind_request(scope) -> Token:
+    """Gọi từ middleware cho mỗi request HTTP; reset bằng unbind_request(token)."""
+    return _request.set(_RequestScope(scope))
+
+
+def unbind_request(token: Token) -> None:
+    _request.reset(token)
+
+
+@event.listens_for(Session, "after_flush")
+def _after_flush(session, flush_context) -> None:
+    # Session chỉ flush khi có thay đổi → một lượt ghi lên primary.
+    # Ngoài request HTTP (access_recorder, WebSocket, job nền): không pin.
+    request = _request.get()
+    if request is None:
+        return
+    request.wrote = True
+    principal = request.principal
+    if principal:
+        _replicas.note_write(principal)
+
+
+def _pinned() -> bool:
+    request = _request.get()
+    if request is None:
+        return False
+    if request.wrote:
+        return True
+    principal = request.principal
+    return bool(principal) and _replicas.pinned(principal)
+
+
+async def _apinned() -> bool:
+    request = _request.get()
+    if request is None:
+        return False
+    if request.wrote:
+        return True
+    principal = request.principal
+    return bool(principal) and await _replicas.apinned(principal)
+
+
+def get_read_db():
+    replica = None if not _replicas.replicas or _pinned() else _replicas.pick()
+    _m_reads.inc(target="primary" if replica is None else "replica")
+    db = (database.SessionLocal if replica is None else replica.session_factory)()
+    try:
+        yield db
+    finally:
+        db.close()
+
+
+async def get_async_read_db():
+    replica = None if not _replicas.replicas or await _apinned() else _replicas.pick(need_async=True)
+    if replica is None:
+        _m_reads.inc(target="primary")
+        if database.AsyncSessionLocal is None:
+            raise RuntimeError("Async database engine is not configured (install asyncpg / aiosqlite)")
+        factory = database.AsyncSessionLocal
+    else:
+        _m_reads.inc(target="replica")
+        factory = replica.async_session_factory
+    async with factory() as db:
+        yield db
+
+
+def stats() -> list[dict]:
+    return _replicas.stats()
+
+
+def start() -> None:
+    if _replicas.replicas:
+        background.every("replica-health", _CHECK_SECONDS, _replicas.check_all, queue_name="replicas",
+                         initial_delay=0)
+
+
+async def dispose() -> None:
+    for replica in _replicas.replicas:
+        replica.dispose()
+        if replica.async_engine is not None:
+            await replica.async_engine.dispose()
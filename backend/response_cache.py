@@ -0,0 +1,68 @@
+"""
+Body response đã encode sẵn cho các endpoint có cache payload (student, class,
+classes, search, student_count, chat history).
+
+Entry lưu trong cache là list [body, gzip, br]:
+- body: bytes JSON cuối cùng (serialization.dumps của payload).
+- gzip / br: bản nén tính một lần lúc ghi cache, chỉ khi body >=
+  RESPONSE_COMPRESS_MIN_BYTES (cùng ngưỡng với GZipMiddleware); br chỉ khi có
+  package brotli. None nếu không có.
+
+Cache hit → respond() ghi thẳng bytes phù hợp với Accept-Encoding kèm
+Content-Encoding, nên không qua jsonable_encoder / JSON encode / GZipMiddleware
+(middleware bỏ qua response đã có Content-Encoding).
+Giá trị cũ trong cache (chuỗi payload trước khi có module này) vẫn trả được.
+"""
+
+import gzip
+import os
+from typing import Any, Optional
+
+from fastapi import Request, Response
+
+import serialization
+
+try:
+    import brotli
+except Exception:  # pragma: no cover - optional dependency
+    brotli = None
+
+COMPRESS_MIN_BYTES = int(os.getenv("RESPONSE_COMPRESS_MIN_BYTES", "1024"))
+_GZIP_LEVEL = int(os.getenv("RESPONSE_GZIP_LEVEL", "6"))
+_BROTLI_QUALITY = int(os.getenv("RESPONSE_BROTLI_QUALITY", "5"))
+
+_MEDIA_TYPE = "application/json"
+
+
+def encode(payload: Any) -> list:
+    """Payload → entry [body, gzip, br] để lưu cache và trả về."""
+    body = serialization.dumps(payload)
+    gz: Optional[bytes] = None
+    br: Optional[bytes] = None
+    if len(body) >= COMPRESS_MIN_BYTES:
+        gz = gzip.compress(body, compresslevel=_GZIP_LEVEL, mtime=0)
+        if brotli is not None:
+            br = brotli.compress(body, quality=_BROTLI_QUALITY)
+    return [body, gz, br]
+
+
+def _is_entry(value: Any) -> bool:
+    return isinstance(value, (list, tuple)) and len(value) == 3 and isinstance(value[0], bytes)
+
+
+def respond(request: Request, value: Any) -> Any:
+    """Response cho một entry cache (chọn biến thể theo Accept-Encoding)."""
+    if not _is_entry(value):
+        return value  # entry cũ: để FastAPI encode như trước
+    body, gz, br = value
+    if gz is None and br is None:
+        return Response(body, media_type=_MEDIA_TYPE)
+    accept = request.headers.get("accept-encoding", "")
+    headers = {"Vary": "Accept-Encoding"}
+    if br is not None and "br" in accept:
+        body = br
+        headers["Content-Encoding"] = "br"
+    elif gz is not None and "gzip" in accept:
+        body = gz
+        headers["Content-Encoding"] = "gzip"
+    return Response(body, media_type=_MEDIA_TYPE, headers=headers)
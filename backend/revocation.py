@@ -0,0 +1,175 @@
+"""
+Bloom filter cục bộ của các token đã bị revoke (logout).
+
+Hầu như không token nào bị revoke, nên mỗi request chỉ cần hỏi filter trong
+process; chỉ khi filter báo "có thể" mới tra cache (nguồn chính thức
+revoked_token:<hash>). Filter không bao giờ false negative với những gì nó đã
+biết, vì vậy phải đồng bộ với các worker khác:
+
+- Redis: logout publish hash lên kênh REVOCATION_CHANNEL; thread nền subscribe
+  và thêm vào filter. Filter chỉ được tin khi subscriber đang kết nối.
+- Định kỳ (REVOCATION_RESYNC_SECONDS, job nền "revocation-resync") dựng lại
+  filter từ danh sách key revoked_token:* trong cache (bắt kịp message bị lỡ,
+  bỏ token đã hết hạn).
+  Không có Redis mà có disk tier: các worker cùng host thấy nhau qua resync.
+- Revoke trong lúc Redis sập chỉ nằm ở memory/disk; cache chép các key
+  revoked_token:* đó lên Redis khi breaker đóng lại, trước khi resync /
+  _is_hash_revoked đọc lại từ Redis.
+
+Trước lần resync đầu tiên (hoặc khi Redis đang dùng mà subscriber mất kết nối)
+might_be_revoked() luôn trả True → mọi request tra cache như trước.
+"""
+
+import logging
+import os
+import threading
+import time
+
+import background
+import cache as _cache
+import metrics
+from sketches import BloomFilter
+
+logger = logging.getLogger(__name__)
+
+REVOCATION_CHANNEL = "revoked_token"
+_KEY_PREFIX = "revoked_token:"
+_RESYNC_SECONDS = float(os.getenv("REVOCATION_RESYNC_SECONDS", "30"))
+_CAPACITY = int(os.getenv("REVOCATION_FILTER_CAPACITY", "100000"))
+_ERROR_RATE = 0.001
+
+_filter = BloomFilter(_CAPACITY, _ERROR_RATE)
+_lock = threading.Lock()
+_recent: list[str] = []      # hash thêm vào trong lúc resync đang chạy
+_ready = False               # đã resync ít nhất một lần
+_subscribed = False          # subscriber Redis đang kết nối
+_last_resync = 0.0
+_started = False
+
+_m_checks = metrics.counter(
+    "revocation_filter_checks_total", "Revoked-token filter lookups", ("result",)
+)
+
+
+def _trusted() -> bool:
+    if not _ready:
+        return False
+    # Đang dùng Redis: chỉ tin filter khi nhận được broadcast của worker khác
+    return _subscribed or _cache.redis_client() is None
+
+
+def might_be_revoked(token_hash: str) -> bool:
+    """False = chắc chắn chưa bị revoke (không cần tra cache)."""
+    if not _trusted():
+        _m_checks.inc(result="unsynced")
+        return True
+    if token_hash in _filter:
+        _m_checks.inc(result="positive")
+        return True
+    _m_checks.inc(result="negative")
+    return False
+
+
+def _add_local(token_hash: str) -> None:
+    with _lock:
+        _filter.add(token_hash)
+        _recent.append(token_hash)
+
+
+def add(token_hash: str) -> None:
+    """Ghi nhận token vừa bị revoke ở worker này và broadcast cho worker khác."""
+    _add_local(token_hash)
+    client = _cache.redis_client()
+    if client is not None:
+        try:
+            client.publish(REVOCATION_CHANNEL, token_hash)
+        except Exception as exc:
+            logger.warning(f"[REVOKE] Broadcast failed: {exc}")
+            _cache.report_redis_result(exc)
+
+
+async def aadd(token_hash: str) -> None:
+    """Phiên bản async của add()."""
+    _add_local(token_hash)
+    client = _cache.async_redis_client()
+    if client is not None:
+        try:
+            await client.publish(REVOCATION_CHANNEL, token_hash)
+        except Exception as exc:
+            logger.warning(f"[REVOKE] Broadcast failed: {exc}")
+            _cache.report_redis_result(exc)
+
+
+def resync() -> int:
+    """Dựng lại filter từ các key revoked_token:* còn sống. Trả về số token."""
+    global _filter, _ready, _last_resync
+    with _lock:
+        _recent.clear()
+    hashes = [k[len(_KEY_PREFIX):] for k in _cache.keys_with_prefix(_KEY_PREFIX)]
+    fresh = BloomFilter(max(_CAPACITY, len(hashes) * 2), _ERROR_RATE)
+    for token_hash in hashes:
+        fresh.add(token_hash)
+    with _lock:
+        for token_hash in _recent:
+            fresh.add(token_hash)
+        _recent.clear()
+        _filter = fresh
+    _ready = True
+    _last_resync = time.time()
+    return len(hashes)
+
+
+def _listen_once(client) -> None:
+    """Subscribe rồi resync (không lỡ message giữa hai bước); trả về khi mất kết nối."""
+    global _subscribed
+    pubsub = client.pubsub(ignore_subscribe_messages=True)
+    try:
+        pubsub.subscribe(REVOCATION_CHANNEL)
+        _subscribed = True
+        resync()
+        while True:
+            message = pubsub.get_message(timeout=1.0)
+            if message and message.get("type") == "message":
+                data = message.get("data")
+                _add_local(data.decode() if isinstance(data, bytes) else str(data))
+            if _cache.redis_client() is not client:
+                return
+    finally:
+        _subscribed = False
+        try:
+            pubsub.close()
+        except Exception:
+            pass
+
+
+def _listen() -> None:
+    """Thread subscriber: giữ kết nối pub/sub mỗi khi cache đang dùng Redis."""
+    while True:
+        client = _cache.redis_client()
+        if client is not None:
+            try:
+                _listen_once(client)
+                continue
+            except Exception as exc:
+                logger.warning(f"[REVOKE] Revocation listener failed: {exc}")
+        time.sleep(1.0)
+
+
+def start() -> None:
+    """Khởi động subscriber + resync định kỳ (gọi một lần lúc startup)."""
+    global _started
+    if _started:
+        return
+    _started = True
+    background.every("revocation-resync", _RESYNC_SECONDS, resync, initial_delay=0)
+    threading.Thread(target=_listen, name="revocation-listener", daemon=True).start()
+
+
+def stats() -> dict:
+    return {
+        "ready": _ready,
+        "subscribed": _subscribed,
+        "trusted": _trusted(),
+        "entries": len(_filter),
+        "last_resync_seconds_ago": round(time.time() - _last_resync, 1) if _last_resync else None,
+    }
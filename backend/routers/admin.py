@@ -2,11 +2,18 @@ import logging
 from datetime import datetime, timedelta
 from typing import Optional
 
+import background
+import cache as _cache
+import cache_warmer
 import database
+import db_stats
 import models
+import replicas
+import revocation
 import schemas
 import security
 from fastapi import APIRouter, Depends, HTTPException, Request
+from serialization import FastJSONResponse
 from sqlalchemy.orm import Session
 
 from .websocket import manager
@@ -16,7 +23,7 @@ logger = logging.getLogger(__name__)
 
 @router.get("/stats/online-users")
 def get_online_users(
-    current_user: models.Nick = Depends(security.get_current_user),
+    current_user: security.Principal = Depends(security.get_current_user),
     db: Session = Depends(database.get_db)
 ):
     if current_user.role != 1:
@@ -28,7 +35,7 @@ def get_online_users(
 
 @router.get("/admin/online-users/list")
 def get_online_users_list(
-    current_user: models.Nick = Depends(security.get_current_user),
+    current_user: security.Principal = Depends(security.get_current_user),
     db: Session = Depends(database.get_db)
 ):
     if current_user.role != 1:
@@ -43,7 +50,7 @@ def get_online_users_list(
 
 @router.get("/admin/users")
 def get_all_users(
-    current_user: models.Nick = Depends(security.get_current_user),
+    current_user: security.Principal = Depends(security.get_current_user),
     db: Session = Depends(database.get_db)
 ):
     if current_user.role != 1:
@@ -77,13 +84,13 @@ def get_all_users(
             "reset_limit_at": u.reset_limit_at.isoformat() if u.reset_limit_at else None,
             "class_change_limit": u.class_change_limit
         })
-    return result
+    return FastJSONResponse(result)
 
 @router.post("/admin/user/{user_id}/reset-limit")
 async def reset_user_limit(
     user_id: int,
     request: Request,
-    current_user: models.Nick = Depends(security.get_current_user),
+    current_user: security.Principal = Depends(security.get_current_user),
     db: Session = Depends(database.get_db)
 ):
     if current_user.role != 1:
@@ -98,7 +105,7 @@ async def reset_user_limit(
     db.commit()
 
     # Invalidate user cache so next request picks up new data
-    security.invalidate_user_cache(user.username)
+    await security.ainvalidate_user_cache(user.username)
 
     # Notify user via WebSocket
     await manager.send_personal_message(user.username, {
@@ -121,7 +128,7 @@ async def update_user_class_change_limit(
     user_id: int,
     request: schemas.UpdateLimitRequest,
     http_request: Request,
-    current_user: models.Nick = Depends(security.get_current_user),
+    current_user: security.Principal = Depends(security.get_current_user),
     db: Session = Depends(database.get_db)
 ):
     if current_user.role != 1:
@@ -135,7 +142,7 @@ async def update_user_class_change_limit(
     db.commit()
 
     # Invalidate user cache so next request picks up new limit
-    security.invalidate_user_cache(user.username)
+    await security.ainvalidate_user_cache(user.username)
 
     # Notify user via WebSocket
     await manager.send_personal_message(user.username, {
@@ -157,7 +164,7 @@ async def update_user_class_change_limit(
 @router.post("/admin/ban")
 async def ban_user(
     payload: dict, # {username, reason}
-    current_user: models.Nick = Depends(security.get_current_user),
+    current_user: security.Principal = Depends(security.get_current_user),
     db: Session = Depends(database.get_db)
 ):
     if current_user.role != 1:
@@ -228,7 +235,7 @@ async def ban_user(
 
 @router.get("/admin/bans")
 def get_bans(
-    current_user: models.Nick = Depends(security.get_current_user),
+    current_user: security.Principal = Depends(security.get_current_user),
     db: Session = Depends(database.get_db)
 ):
     if current_user.role != 1:
@@ -250,12 +257,12 @@ def get_bans(
             "reason": b.reason,
             "created_at": b.created_at.isoformat() if b.created_at else None
         })
-    return result
+    return FastJSONResponse(result)
 
 @router.delete("/admin/ban/{ban_id}")
 def unban_user(
     ban_id: int,
-    current_user: models.Nick = Depends(security.get_current_user),
+    current_user: security.Principal = Depends(security.get_current_user),
     db: Session = Depends(database.get_db)
 ):
     if current_user.role != 1:
@@ -269,7 +276,7 @@ def unban_user(
 @router.get("/admin/user/{user_id}/details")
 def get_user_details(
     user_id: int,
-    current_user: models.Nick = Depends(security.get_current_user),
+    current_user: security.Principal = Depends(security.get_current_user),
     db: Session = Depends(database.get_db)
 ):
     """Lấy chi tiết user: IP đã vào web (từ UserIpLog) + số lượt truy cập từng ngày."""
@@ -365,7 +372,7 @@ def get_user_details(
 
     total_access = sum(r["count"] for r in access_history)
 
-    return {
+    return FastJSONResponse({
         "user_id": user.id,
         "username": user.username,
         "role": user.role,
@@ -374,7 +381,7 @@ def get_user_details(
         "ban_ips": ban_ips,
         "access_history": access_history,
         "total_access": total_access,
-    }
+    })
 
 # --- NEW: SYSTEM MANAGEMENT & AUDIT LOGS ---
 
@@ -390,7 +397,7 @@ def add_audit_log(db: Session, user_id: Optional[int], action: str, details: Opt
 
 @router.get("/admin/system/config")
 def get_system_config(
-    current_user: models.Nick = Depends(security.get_current_user),
+    current_user: security.Principal = Depends(security.get_current_user),
     db: Session = Depends(database.get_db)
 ):
     if current_user.role != 1:
@@ -403,7 +410,7 @@ def get_system_config(
 async def update_system_config(
     payload: dict,
     request: Request,
-    current_user: models.Nick = Depends(security.get_current_user),
+    current_user: security.Principal = Depends(security.get_current_user),
     db: Session = Depends(database.get_db)
 ):
     if current_user.role != 1:
@@ -434,10 +441,35 @@ async def update_system_config(
         
     return {"message": "Config updated successfully"}
 
+@router.get("/admin/cache/stats")
+def get_cache_stats(
+    current_user: security.Principal = Depends(security.get_current_user),
+):
+    """Thống kê cache theo namespace (hit ratio, evictions, latency) để tinh chỉnh TTL."""
+    if current_user.role != 1:
+        raise HTTPException(status_code=403, detail="Not authorized")
+
+    result = _cache.stats()
+    result["revocation"] = revocation.stats()
+    result["background"] = background.stats()
+    return result
+
+@router.get("/admin/db/stats")
+def get_db_stats(
+    current_user: security.Principal = Depends(security.get_current_user),
+):
+    """Pool (chờ checkout, in-use, overflow), thời gian query và slow query gần nhất theo engine."""
+    if current_user.role != 1:
+        raise HTTPException(status_code=403, detail="Not authorized")
+
+    result = db_stats.stats()
+    result["replicas"] = replicas.stats()
+    return result
+
 @router.get("/admin/audit-logs")
 def get_audit_logs(
     limit: int = 50,
-    current_user: models.Nick = Depends(security.get_current_user),
+    current_user: security.Principal = Depends(security.get_current_user),
     db: Session = Depends(database.get_db)
 ):
     if current_user.role != 1:
@@ -451,7 +483,7 @@ def get_audit_logs(
         .all()
     )
     
-    return [
+    return FastJSONResponse([
         {
             "id": l.id,
             "username": un,
@@ -461,12 +493,12 @@ def get_audit_logs(
             "created_at": l.created_at.isoformat()
         }
         for l, un in logs
-    ]
+    ])
 
 @router.get("/subjects")
 def get_subjects(
-    current_user: models.Nick = Depends(security.get_current_user),
-    db: Session = Depends(database.get_db)
+    current_user: security.Principal = Depends(security.get_current_user),
+    db: Session = Depends(replicas.get_read_db)
 ):
     """Lấy danh sách tất cả các môn học duy nhất trong hệ thống."""
     if current_user.role != 1:
@@ -481,13 +513,13 @@ def get_subjects(
         .all()
     )
     
-    return [{"code": s.ma_mon, "name": s.ten_mon} for s in subjects]
+    return FastJSONResponse([{"code": s.ma_mon, "name": s.ten_mon} for s in subjects])
 
 @router.get("/subject-scores")
 def get_subject_scores(
     subject: str, # Có thể là mã môn hoặc tên môn
-    current_user: models.Nick = Depends(security.get_current_user),
-    db: Session = Depends(database.get_db)
+    current_user: security.Principal = Depends(security.get_current_user),
+    db: Session = Depends(replicas.get_read_db)
 ):
     """Lấy danh sách người dùng và điểm cho một môn học cụ thể, phân nhóm theo lớp."""
     if current_user.role != 1:
@@ -524,7 +556,7 @@ def get_subject_scores(
             "semester": bd.hoc_ky
         })
     
-    return grouped
+    return FastJSONResponse(grouped)
 
 # Public announcement endpoint
 @router.get("/system/announcement")
@@ -540,7 +572,7 @@ def get_public_announcement(db: Session = Depends(database.get_db)):
 @router.get("/admin/hidden-subjects/{msv}")
 def get_hidden_subjects(
     msv: str,
-    current_user: models.Nick = Depends(security.get_current_user),
+    current_user: security.Principal = Depends(security.get_current_user),
     db: Session = Depends(database.get_db),
 ):
     """Liệt kê các môn đang bị ẩn của một sinh viên."""
@@ -551,7 +583,7 @@ def get_hidden_subjects(
         models.HiddenSubjectRule.msv == msv
     ).all()
 
-    return [
+    return FastJSONResponse([
         {
             "id": r.id,
             "msv": r.msv,
@@ -560,14 +592,14 @@ def get_hidden_subjects(
             "created_at": r.created_at.isoformat() if r.created_at else None,
         }
         for r in rules
-    ]
+    ])
 
 
 @router.post("/admin/hidden-subjects")
 def hide_subject(
     payload: dict,
     request: Request,
-    current_user: models.Nick = Depends(security.get_current_user),
+    current_user: security.Principal = Depends(security.get_current_user),
     db: Session = Depends(database.get_db),
 ):
     """Ẩn một môn học của một sinh viên với người dùng thường (role 0)."""
@@ -601,10 +633,10 @@ def hide_subject(
     db.commit()
 
     # Xóa cache role0 của sinh viên đó để user thường thấy ngay
-    import cache as _cache
     _cache.delete_prefix(f"student:{msv}:role0")
     _cache.delete_prefix("class:v6:")
     _cache.delete_prefix("search:")
+    cache_warmer.schedule_warm("invalidate")
 
     logger.info(
         "admin_action=hide_subject actor=%s msv=%s subject_key=%s ip=%s",
@@ -619,7 +651,7 @@ def hide_subject(
 def unhide_subject(
     payload: dict,
     request: Request,
-    current_user: models.Nick = Depends(security.get_current_user),
+    current_user: security.Principal = Depends(security.get_current_user),
     db: Session = Depends(database.get_db),
 ):
     """Bỏ ẩn một môn học của một sinh viên."""
@@ -643,10 +675,10 @@ def unhide_subject(
         raise HTTPException(status_code=404, detail="Rule not found")
 
     # Xóa cache để user thường thấy môn trở lại
-    import cache as _cache
     _cache.delete_prefix(f"student:{msv}:role0")
     _cache.delete_prefix("class:v6:")
     _cache.delete_prefix("search:")
+    cache_warmer.schedule_warm("invalidate")
 
     logger.info(
         "admin_action=unhide_subject actor=%s msv=%s subject_key=%s ip=%s",
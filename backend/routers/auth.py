@@ -1,21 +1,17 @@
-import time
-import threading
-
 import cache as _cache
 import database
 import models
+import ratelimit
 import schemas
 import security
-from jose import jwt
 from fastapi import APIRouter, Depends, HTTPException, Request, status
 from fastapi.responses import JSONResponse
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
 
 router = APIRouter(prefix="/api")
 
-_rl_lock = threading.Lock()
-
-
 def _resolve_client_ip(request: Request) -> str:
     headers = request.headers
     for header_name in ("cf-connecting-ip", "true-client-ip", "x-real-ip", "x-forwarded-for"):
@@ -28,28 +24,24 @@ def _resolve_client_ip(request: Request) -> str:
     return request.client.host if request.client else "unknown"
 
 
-def _check_rate_limit(scope: str, identity: str, limit: int, window_seconds: int) -> bool:
-    with _rl_lock:
-        now = time.time()
-        key = f"rl:{scope}:{identity}"
-        attempts = _cache.get(key) or []
-        attempts = [t for t in attempts if now - t < window_seconds]
-        if len(attempts) >= limit:
-            _cache.set(key, attempts, ttl=window_seconds)
-            return False
-        attempts.append(now)
-        _cache.set(key, attempts, ttl=window_seconds)
-        return True
+async def _check_rate_limit(scope: str, identity: str, limit: int, window_seconds: int) -> bool:
+    return await ratelimit.aallow(scope, identity, limit, window_seconds)
+
 
+async def _find_user(db: AsyncSession, username: str):
+    return (await db.scalars(select(models.Nick).where(models.Nick.username == username))).first()
 
+
+# login/register là async: bcrypt chạy trên executor riêng của security và được
+# chờ bằng asyncio, không chiếm thread của threadpool AnyIO trong lúc băm.
 @router.post("/login")
-def login(payload: schemas.LoginRequest, request: Request, db: Session = Depends(database.get_db)):
+async def login(payload: schemas.LoginRequest, request: Request, db: AsyncSession = Depends(database.get_async_db)):
     client_ip = _resolve_client_ip(request)
     normalized_username = payload.username.strip().lower()
 
-    if not _check_rate_limit("login-ip", client_ip, limit=60, window_seconds=60):
+    if not await _check_rate_limit("login-ip", client_ip, limit=60, window_seconds=60):
         raise HTTPException(status_code=429, detail="Too many login attempts")
-    if not _check_rate_limit("login-user", f"{client_ip}:{normalized_username}", limit=12, window_seconds=60):
+    if not await _check_rate_limit("login-user", f"{client_ip}:{normalized_username}", limit=12, window_seconds=60):
         raise HTTPException(status_code=429, detail="Too many login attempts")
 
     # Account Lockout Check: lock the account only when failures originate from
@@ -59,44 +51,50 @@ def login(payload: schemas.LoginRequest, request: Request, db: Session = Depends
     fail_ips_key = f"fail_ips:{normalized_username}"
     ip_ban_key = f"ip_ban:{client_ip}"
 
-    if _cache.get(ip_ban_key):
+    if await _cache.aget(ip_ban_key):
         raise HTTPException(
             status_code=429,
             detail="Quá nhiều lần thử đăng nhập thất bại từ IP này. Vui lòng thử lại sau 15 phút."
         )
 
-    if _cache.get(lockout_key):
+    if await _cache.aget(lockout_key):
         raise HTTPException(
             status_code=429,
             detail="Tài khoản tạm thời bị khóa do nhập sai mật khẩu nhiều lần. Vui lòng thử lại sau 15 phút."
         )
 
-    user = db.query(models.Nick).filter(models.Nick.username == normalized_username).first()
-    if not user or not security.verify_password(payload.password, user.password):
+    user = await _find_user(db, normalized_username)
+    verified, new_hash = await security.averify_and_rehash(payload.password, user.password) if user else (False, None)
+    if not verified:
         # Record failing source IP
-        fail_ips = _cache.get(fail_ips_key) or []
+        fail_ips = await _cache.aget(fail_ips_key) or []
         if client_ip not in fail_ips:
             fail_ips.append(client_ip)
-        _cache.set(fail_ips_key, fail_ips, ttl=900)
+        await _cache.aset(fail_ips_key, fail_ips, ttl=900)
 
         # Per-IP failure streak bans only that IP
         fail_key = f"fail_cnt:{client_ip}:{normalized_username}"
-        fails = (_cache.get(fail_key) or 0) + 1
-        _cache.set(fail_key, fails, ttl=900)
+        fails = (await _cache.aget(fail_key) or 0) + 1
+        await _cache.aset(fail_key, fails, ttl=900)
         if fails >= 5:
-            _cache.set(ip_ban_key, True, ttl=900)
+            await _cache.aset(ip_ban_key, True, ttl=900)
         if len(fail_ips) >= 3:
-            _cache.set(lockout_key, True, ttl=900)
+            await _cache.aset(lockout_key, True, ttl=900)
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Incorrect username or password",
             headers={"WWW-Authenticate": "Bearer"},
         )
 
+    # Hash cũ (cost bcrypt khác BCRYPT_ROUNDS) → lưu hash mới
+    if new_hash:
+        user.password = new_hash
+        await db.commit()
+
     # Clear failed attempts on successful login
-    _cache.delete(f"fail_cnt:{client_ip}:{normalized_username}")
-    _cache.delete(fail_ips_key)
-    _cache.delete(lockout_key)
+    await _cache.adelete(f"fail_cnt:{client_ip}:{normalized_username}")
+    await _cache.adelete(fail_ips_key)
+    await _cache.adelete(lockout_key)
 
     access_token = security.create_access_token(data={"sub": user.username})
 
@@ -124,16 +122,11 @@ def login(payload: schemas.LoginRequest, request: Request, db: Session = Depends
 async def logout(request: Request):
     from .websocket import manager
 
-    token = security.get_token(request)
-    if token:
-        security.revoke_token(token)
-        try:
-            payload = jwt.decode(token, security.SECRET_KEY, algorithms=[security.ALGORITHM])
-            username = payload.get("sub")
-            if username:
-                await manager.disconnect_user(username)
-        except Exception:
-            pass
+    auth_ctx = security.get_auth_context(request)
+    if auth_ctx.token:
+        await security.arevoke_token(auth_ctx.token)
+        if auth_ctx.username:
+            await manager.disconnect_user(auth_ctx.username)
 
     response = JSONResponse(content={"message": "Logged out successfully"})
     response.delete_cookie("stoken", path="/")
@@ -141,13 +134,13 @@ async def logout(request: Request):
 
 
 @router.post("/register")
-def register(payload: schemas.RegisterRequest, request: Request, db: Session = Depends(database.get_db)):
+async def register(payload: schemas.RegisterRequest, request: Request, db: AsyncSession = Depends(database.get_async_db)):
     client_ip = _resolve_client_ip(request)
     normalized_username = payload.username.strip().lower()
 
-    if not _check_rate_limit("register-ip", client_ip, limit=30, window_seconds=60):
+    if not await _check_rate_limit("register-ip", client_ip, limit=30, window_seconds=60):
         raise HTTPException(status_code=429, detail="Too many register attempts")
-    if not _check_rate_limit("register-user", f"{client_ip}:{normalized_username}", limit=6, window_seconds=60):
+    if not await _check_rate_limit("register-user", f"{client_ip}:{normalized_username}", limit=6, window_seconds=60):
         raise HTTPException(status_code=429, detail="Too many register attempts")
 
     # Enforce minimum password length
@@ -155,23 +148,23 @@ def register(payload: schemas.RegisterRequest, request: Request, db: Session = D
         raise HTTPException(status_code=400, detail="Mật khẩu phải có ít nhất 8 ký tự.")
 
     # Check if user exists — return standardized non-leaking message to prevent enumeration
-    user = db.query(models.Nick).filter(models.Nick.username == normalized_username).first()
+    user = await _find_user(db, normalized_username)
     if user:
         raise HTTPException(status_code=400, detail="Registration cannot be completed with the provided username.")
 
-    hashed_password = security.get_password_hash(payload.password)
+    hashed_password = await security.aget_password_hash(payload.password)
     new_user = models.Nick(
         username=payload.username,
         password=hashed_password,
         role=0
     )
     db.add(new_user)
-    db.commit()
+    await db.commit()
     return {"message": "User created successfully"}
 
 
 @router.get("/me")
-def read_users_me(current_user: models.Nick = Depends(security.get_current_user)):
+def read_users_me(current_user: security.Principal = Depends(security.get_current_user)):
     data = {
         "u": current_user.username,
         "fn": current_user.full_name,
@@ -184,7 +177,7 @@ def read_users_me(current_user: models.Nick = Depends(security.get_current_user)
 
 
 @router.get("/me-profile")
-def read_user_profile(current_user: models.Nick = Depends(security.get_current_user)):
+def read_user_profile(current_user: security.Principal = Depends(security.get_current_user)):
     data = {
         "u": current_user.username,
         "fn": current_user.full_name,
@@ -196,15 +189,12 @@ def read_user_profile(current_user: models.Nick = Depends(security.get_current_u
 @router.patch("/profile")
 def update_profile(
     payload: schemas.UpdateProfileRequest,
-    current_user: models.Nick = Depends(security.get_current_user),
+    current_user: security.Principal = Depends(security.get_current_user),
     db: Session = Depends(database.get_db)
 ):
-    user = db.query(models.Nick).filter(
-        models.Nick.id == current_user.id,
-        models.Nick.username == current_user.username
-    ).first()
+    user = security.load_user(db, current_user)
 
-    if not user:
+    if not user or user.username != current_user.username:
         raise HTTPException(status_code=404, detail="User not found")
 
     if payload.full_name is not None:
@@ -216,33 +206,43 @@ def update_profile(
 
 @router.post("/user/class-change")
 def record_class_change(
-    current_user: models.Nick = Depends(security.get_current_user),
+    current_user: security.Principal = Depends(security.get_current_user),
     db: Session = Depends(database.get_db)
 ):
     from datetime import date, datetime
     today = date.today()
 
-    if current_user.reset_limit_at and current_user.reset_limit_at.date() < today:
-        current_user.class_change_limit = 5
-        current_user.reset_limit_at = datetime.now()
-
     if current_user.class_change_limit == -1:
         return {"remaining": -1}
 
-    if current_user.class_change_limit <= 0:
+    user = security.load_user(db, current_user, for_update=True)
+    if not user:
+        raise HTTPException(status_code=404, detail="User not found")
+
+    if user.reset_limit_at and user.reset_limit_at.date() < today:
+        user.class_change_limit = 5
+        user.reset_limit_at = datetime.now()
+
+    if user.class_change_limit == -1:
+        db.rollback()
+        return {"remaining": -1}
+
+    if user.class_change_limit <= 0:
+        db.rollback()
         raise HTTPException(
             status_code=403,
             detail="Bạn đã hết 5 lượt đổi lớp trong ngày. Vui lòng quay lại vào ngày mai hoặc nâng cấp VIP."
         )
 
-    current_user.class_change_limit -= 1
-    current_user.reset_limit_at = datetime.now()
+    user.class_change_limit -= 1
+    user.reset_limit_at = datetime.now()
+    remaining = user.class_change_limit
     db.commit()
 
     security.invalidate_user_cache(current_user.username)
-    return {"remaining": current_user.class_change_limit}
+    return {"remaining": remaining}
 
 
 @router.post("/ws-ticket")
-def websocket_ticket(current_user: models.Nick = Depends(security.get_current_user)):
+def websocket_ticket(current_user: security.Principal = Depends(security.get_current_user)):
     return {"ticket": security.create_websocket_ticket(current_user.username)}
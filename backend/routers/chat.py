@@ -1,38 +1,28 @@
+import cache as _cache
+import database
 import models
+import response_cache
 import security
-from database import get_db
-from fastapi import APIRouter, Depends
-from sqlalchemy.orm import Session
+from fastapi import APIRouter, Depends, Request
+from fastapi.concurrency import run_in_threadpool
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import aliased
 
 router = APIRouter(prefix="/api")
 
-@router.get("/chat/history")
-def get_chat_history(
-    current_user: models.Nick = Depends(security.get_current_user),
-    db: Session = Depends(get_db)
-):
-    # Fetch last 50 messages with sender's full name and reply info
-    from sqlalchemy.orm import aliased
-    ParentMsg = aliased(models.ChatMessage)
-    ParentNick = aliased(models.Nick)
+_HISTORY_KEY = "chat:history"
+_TTL_HISTORY = 30  # tin mới xoá cache ngay; TTL chỉ để bắt kịp đổi full_name
 
-    messages = (
-        db.query(
-            models.ChatMessage, 
-            models.Nick.full_name, 
-            models.Nick.username,
-            ParentMsg.message.label("parent_message"),
-            ParentNick.username.label("parent_username"),
-            ParentNick.full_name.label("parent_full_name")
-        )
-        .outerjoin(models.Nick, models.ChatMessage.user_id == models.Nick.id)
-        .outerjoin(ParentMsg, models.ChatMessage.parent_id == ParentMsg.id)
-        .outerjoin(ParentNick, ParentMsg.user_id == ParentNick.id)
-        .order_by(models.ChatMessage.id.desc())
-        .limit(50)
-        .all()
-    )
-    
+
+async def ainvalidate_history():
+    """Gọi sau khi lưu tin nhắn mới (WebSocket)."""
+    for key in security.payload_cache_variants(_HISTORY_KEY):
+        await _cache.adelete(key)
+
+
+def _render_history_entry(messages: list) -> list:
+    """Dựng + mã hoá payload lịch sử chat (chạy trong threadpool)."""
     # Return in chronological order
     result = []
     for m, fn, un, pm, pun, pfn in reversed(messages):
@@ -52,4 +42,41 @@ def get_chat_history(
             }
         result.append(item)
 
-    return security.obfuscate_payload({"messages": result})
+    return response_cache.encode(security.obfuscate_payload({"messages": result}))
+
+
+@router.get("/chat/history")
+async def get_chat_history(
+    request: Request,
+    current_user: security.Principal = Depends(security.get_current_user),
+    # Primary, không dùng replica: cache xoá ngay sau tin mới, replica trễ sẽ nạp lại lịch sử cũ
+    db: AsyncSession = Depends(database.get_async_db)
+):
+    cache_key = security.payload_cache_key(_HISTORY_KEY)
+    cached = await _cache.aget(cache_key)
+    if cached is not None:
+        return response_cache.respond(request, cached)
+
+    # Fetch last 50 messages with sender's full name and reply info
+    ParentMsg = aliased(models.ChatMessage)
+    ParentNick = aliased(models.Nick)
+
+    messages = (await db.execute(
+        select(
+            models.ChatMessage,
+            models.Nick.full_name, 
+            models.Nick.username,
+            ParentMsg.message.label("parent_message"),
+            ParentNick.username.label("parent_username"),
+            ParentNick.full_name.label("parent_full_name")
+        )
+        .outerjoin(models.Nick, models.ChatMessage.user_id == models.Nick.id)
+        .outerjoin(ParentMsg, models.ChatMessage.parent_id == ParentMsg.id)
+        .outerjoin(ParentNick, ParentMsg.user_id == ParentNick.id)
+        .order_by(models.ChatMessage.id.desc())
+        .limit(50)
+    )).all()
+    
+    entry = await run_in_threadpool(_render_history_entry, messages)
+    await _cache.aset(cache_key, entry, ttl=_TTL_HISTORY)
+    return response_cache.respond(request, entry)
@@ -1,14 +1,19 @@
 import logging
 import re
-import time
 from typing import Optional
 
 import cache as _cache
-import database
+import cache_warmer
 import models
+import ratelimit
+import replicas
+import response_cache
 import security
 from fastapi import APIRouter, Depends, HTTPException, Query, Request
-from sqlalchemy.orm import Session, joinedload
+from fastapi.concurrency import run_in_threadpool
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session, joinedload, selectinload
 
 logger = logging.getLogger(__name__)
 
@@ -140,17 +145,8 @@ def _sanitize_search_query(query: str) -> str:
     return q
 
 
-def _allow_search(identity: str, limit: int = 90, window_seconds: int = 60) -> bool:
-    now = time.time()
-    key = f"rl:search:{identity}"
-    hits = _cache.get(key) or []
-    hits = [t for t in hits if now - t < window_seconds]
-    if len(hits) >= limit:
-        _cache.set(key, hits, ttl=window_seconds)
-        return False
-    hits.append(now)
-    _cache.set(key, hits, ttl=window_seconds)
-    return True
+async def _allow_search(identity: str, limit: int = 90, window_seconds: int = 60) -> bool:
+    return await ratelimit.aallow("search", identity, limit, window_seconds)
 
 def _normalize_name(name):
     n = (name or '').strip().lower()
@@ -388,16 +384,17 @@ def format_student(sv: models.SinhVien, hide_details=False, role: int = 1, hidde
 
 @router.get("/stats/student-count")
 def get_student_count(
+    request: Request,
     class_name: Optional[str] = None,
-    current_user: Optional[models.Nick] = Depends(security.get_optional_user),
-    db: Session = Depends(database.get_db)
+    current_user: Optional[security.Principal] = Depends(security.get_optional_user),
+    db: Session = Depends(replicas.get_read_db)
 ):
     normalized_class_name = _normalize_class_name(class_name) if class_name else None
-    cache_key = f"student_count:{normalized_class_name or '__all__'}"
+    cache_key = security.payload_cache_key(f"student_count:{normalized_class_name or '__all__'}")
     cached = _cache.get(cache_key)
     if cached is not None:
         logger.debug(f"[CACHE HIT] {cache_key}")
-        return cached
+        return response_cache.respond(request, cached)
 
     from sqlalchemy import func
     query = db.query(func.count(models.SinhVien.msv))
@@ -408,9 +405,9 @@ def get_student_count(
         else:
             query = query.filter(models.SinhVien.ma_lop == normalized_class_name)
     data = {"count": query.scalar()}
-    result = security.obfuscate_payload(data)
-    _cache.set(cache_key, result, ttl=_TTL_COUNT)
-    return result
+    entry = response_cache.encode(security.obfuscate_payload(data))
+    _cache.set(cache_key, entry, ttl=_TTL_COUNT)
+    return response_cache.respond(request, entry)
 
 
 def _parse_cohort(ma_lop: str) -> str:
@@ -430,19 +427,11 @@ def _parse_cohort(ma_lop: str) -> str:
     return "OTHER"
 
 
-@router.get("/classes")
-def get_classes(
-    current_user: Optional[models.Nick] = Depends(security.get_optional_user),
-    db: Session = Depends(database.get_db)
-):
-    cache_key = "classes:list"
-    # Skip cache entirely when TTL=0 (dev mode) — cache.set() clamps 0→1s
-    if _TTL_CLASSES > 0:
-        cached = _cache.get(cache_key)
-        if cached is not None:
-            logger.debug("[CACHE HIT] classes:list")
-            return cached
+def _classes_cache_key() -> str:
+    return security.payload_cache_key("classes:list")
 
+
+def _build_classes_payload(db: Session) -> list:
     classes = db.query(models.SinhVien.ma_lop).distinct().order_by(models.SinhVien.ma_lop).all()
     class_list = [c[0] for c in classes if c[0]]
     cohorts = {"K16": [], "K17": [], "OTHER": []}
@@ -453,36 +442,41 @@ def get_classes(
         "classes": class_list,
         "cohorts": cohorts
     }
-    result = security.obfuscate_payload(data)
+    entry = response_cache.encode(security.obfuscate_payload(data))
     if _TTL_CLASSES > 0:
-        _cache.set(cache_key, result, ttl=_TTL_CLASSES)
-    return result
+        _cache.set(_classes_cache_key(), entry, ttl=_TTL_CLASSES)
+    return entry
 
-@router.get("/class/{ma_lop}/students")
-def get_students_by_class(
-    ma_lop: str, 
-    current_user: Optional[models.Nick] = Depends(security.get_optional_user),
-    db: Session = Depends(database.get_db)
+
+@router.get("/classes")
+def get_classes(
+    request: Request,
+    current_user: Optional[security.Principal] = Depends(security.get_optional_user),
+    db: Session = Depends(replicas.get_read_db)
 ):
-    # Support multiple classes separated by commas
-    class_list = sorted([_normalize_class_name(c) for c in ma_lop.split(",") if _normalize_class_name(c)])
-    if not class_list:
-        raise HTTPException(status_code=400, detail="Invalid class list")
+    cache_key = _classes_cache_key()
+    cache_warmer.record("classes")
+    # Skip cache entirely when TTL=0 (dev mode) — cache.set() clamps 0→1s
+    if _TTL_CLASSES > 0:
+        cached = _cache.get(cache_key)
+        if cached is not None:
+            logger.debug(f"[CACHE HIT] {cache_key}")
+            return response_cache.respond(request, cached)
 
-    logger.info(f"Searching students for classes: {class_list} (user: {current_user.username if current_user else 'anon'})")
+    return response_cache.respond(request, _build_classes_payload(db))
 
-    role = current_user.role if current_user else 0
-    cache_key = f"class:v7:{','.join(class_list)}:role{role}"
-    cached = _cache.get(cache_key)
-    if cached is not None:
-        return cached
+def _class_cache_key(class_key: str, role: int) -> str:
+    return security.payload_cache_key(f"class:v7:{class_key}:role{role}")
 
+
+def _build_class_payload(db: Session, class_key: str, role: int) -> list:
+    """class_key: danh sách lớp đã chuẩn hoá + sắp xếp, nối bằng dấu phẩy."""
+    class_list = class_key.split(",")
     resolved_class_list = _resolve_class_names(db, class_list)
     if not resolved_class_list:
         resolved_class_list = class_list
 
     # Optimization: Use selectinload instead of joinedload to avoid massive join duplication (N+1 fix)
-    from sqlalchemy.orm import selectinload
     students = db.query(models.SinhVien).options(
         selectinload(models.SinhVien.diem)
     ).filter(models.SinhVien.ma_lop.in_(resolved_class_list)).all()
@@ -492,43 +486,57 @@ def get_students_by_class(
     if not students:
         # Return empty result instead of 404 to be more robust
         data = {"students": []}
-        result = security.obfuscate_payload(data)
-        return result
+        return response_cache.encode(security.obfuscate_payload(data))
 
     # For class lists, ALWAYS hide details (perf win) — hidden_keys not needed (d=None)
     data = {"students": [format_student(sv, hide_details=True, role=role) for sv in students]}
-    result = security.obfuscate_payload(data)
-    _cache.set(cache_key, result, ttl=_TTL_CLASS)
-    return result
+    entry = response_cache.encode(security.obfuscate_payload(data))
+    _cache.set(_class_cache_key(class_key, role), entry, ttl=_TTL_CLASS)
+    return entry
 
-@router.get("/student/{msv}")
-def get_student_detail(
-    msv: str,
-    current_user: models.Nick = Depends(security.get_current_user),
-    db: Session = Depends(database.get_db)
+
+@router.get("/class/{ma_lop}/students")
+def get_students_by_class(
+    request: Request,
+    ma_lop: str, 
+    current_user: Optional[security.Principal] = Depends(security.get_optional_user),
+    db: Session = Depends(replicas.get_read_db)
 ):
+    # Support multiple classes separated by commas
+    class_list = sorted([_normalize_class_name(c) for c in ma_lop.split(",") if _normalize_class_name(c)])
+    if not class_list:
+        raise HTTPException(status_code=400, detail="Invalid class list")
+
+    logger.info(f"Searching students for classes: {class_list} (user: {current_user.username if current_user else 'anon'})")
+
     role = current_user.role if current_user else 0
+    class_key = ','.join(class_list)
+    cache_warmer.record("class", class_key, role)
+    cached = _cache.get(_class_cache_key(class_key, role))
+    if cached is not None:
+        return response_cache.respond(request, cached)
+
+    return response_cache.respond(request, _build_class_payload(db, class_key, role))
+
+def _student_cache_key(real_msv: str, role: int) -> str:
+    return security.payload_cache_key(f"student:{real_msv}:role{role}")
+
+
+def _render_student_entry(student: models.SinhVien, role: int, hidden_keys: set) -> list:
     # All authenticated users can see grade details.
     # hide_details only masks personal info (name, DOB, hometown) for role=0;
     # the grade array 'd' is always returned for any logged-in user.
-    hide_personal_info = (role != 1)  # role 0 gets masked personal info
-    hide_details = False              # grade 'd' array: always show for authenticated users
-    try:
-        real_msv = security.deobfuscate_id(msv, force_obfuscated=(role == 0))
-    except ValueError as e:
-        raise HTTPException(status_code=403, detail=str(e))
+    data = format_student(student, hide_details=False, role=role, hidden_keys=hidden_keys)
+    return response_cache.encode(security.obfuscate_payload(data))
 
-    cache_key = f"student:{real_msv}:role{role}"
-    cached = _cache.get(cache_key)
-    if cached is not None:
-        logger.debug(f"[CACHE HIT] {cache_key}")
-        return cached
 
+def _build_student_payload(db: Session, real_msv: str, role: int) -> Optional[list]:
+    """Entry response chi tiết sinh viên (đã mã hoá) hoặc None nếu không tồn tại (dùng cho cache warmer)."""
     student = db.query(models.SinhVien).options(
         joinedload(models.SinhVien.diem)
     ).filter(models.SinhVien.msv == real_msv).first()
     if not student:
-        raise HTTPException(status_code=404, detail="Student not found")
+        return None
 
     # Load hidden subject rules for this student (only relevant for role 0)
     hidden_keys: set = set()
@@ -538,43 +546,101 @@ def get_student_detail(
         ).all()
         hidden_keys = {r.subject_key for r in rules}
 
-    data = format_student(student, hide_details=hide_details, role=role, hidden_keys=hidden_keys)
-    result = security.obfuscate_payload(data)
-    _cache.set(cache_key, result, ttl=_TTL_STUDENT)
-    return result
+    entry = _render_student_entry(student, role, hidden_keys)
+    _cache.set(_student_cache_key(real_msv, role), entry, ttl=_TTL_STUDENT)
+    return entry
+
+
+async def _abuild_student_payload(db: AsyncSession, real_msv: str, role: int) -> Optional[list]:
+    """Phiên bản async của _build_student_payload() (route /student/{msv})."""
+    student = (await db.execute(
+        select(models.SinhVien)
+        .options(selectinload(models.SinhVien.diem))
+        .where(models.SinhVien.msv == real_msv)
+    )).scalar_one_or_none()
+    if not student:
+        return None
+
+    hidden_keys: set = set()
+    if role == 0:
+        rules = await db.scalars(
+            select(models.HiddenSubjectRule.subject_key).where(models.HiddenSubjectRule.msv == real_msv)
+        )
+        hidden_keys = set(rules.all())
+
+    # format_student + encode là CPU thuần: chạy ở threadpool, không chặn event loop
+    entry = await run_in_threadpool(_render_student_entry, student, role, hidden_keys)
+    await _cache.aset(_student_cache_key(real_msv, role), entry, ttl=_TTL_STUDENT)
+    return entry
+
+
+@router.get("/student/{msv}")
+async def get_student_detail(
+    request: Request,
+    msv: str,
+    current_user: security.Principal = Depends(security.get_current_user),
+    db: AsyncSession = Depends(replicas.get_async_read_db)
+):
+    role = current_user.role if current_user else 0
+    try:
+        real_msv = security.deobfuscate_id(msv, force_obfuscated=(role == 0))
+    except ValueError as e:
+        raise HTTPException(status_code=403, detail=str(e))
+
+    cache_key = _student_cache_key(real_msv, role)
+    cached = await _cache.aget(cache_key)
+    if cached is not None:
+        cache_warmer.record("student", real_msv, role)
+        logger.debug(f"[CACHE HIT] {cache_key}")
+        return response_cache.respond(request, cached)
+
+    entry = await _abuild_student_payload(db, real_msv, role)
+    if entry is None:
+        raise HTTPException(status_code=404, detail="Student not found")
+    cache_warmer.record("student", real_msv, role)
+    return response_cache.respond(request, entry)
+
+
+def _render_search_entry(students: list, role: int) -> list:
+    data = {"results": [format_student(sv, hide_details=True, role=role) for sv in students]}
+    return response_cache.encode(security.obfuscate_payload(data))
 
 
 @router.get("/search")
-def search_students(
+async def search_students(
     request: Request,
     query: str = Query(..., min_length=3, max_length=64),
-    current_user: Optional[models.Nick] = Depends(security.get_optional_user),
-    db: Session = Depends(database.get_db)
+    current_user: Optional[security.Principal] = Depends(security.get_optional_user),
+    db: AsyncSession = Depends(replicas.get_async_read_db)
 ):
     identity = (current_user.username if current_user else (request.client.host if request.client else "anon"))
-    if not _allow_search(identity):
+    if not await _allow_search(identity):
         raise HTTPException(status_code=429, detail="Too many search requests")
 
     clean_query = _sanitize_search_query(query)
     role = current_user.role if current_user else 0
-    cache_key = f"search:v4:{clean_query.lower().strip()}:role{role}"
-    cached = _cache.get(cache_key)
+    cache_key = security.payload_cache_key(f"search:v4:{clean_query.lower().strip()}:role{role}")
+    cached = await _cache.aget(cache_key)
     if cached is not None:
         logger.debug(f"[CACHE HIT] {cache_key}")
-        return cached
+        return response_cache.respond(request, cached)
 
     # Optimization: Use selectinload for search results + hide_details=True
-    from sqlalchemy.orm import selectinload
     escaped_query = clean_query.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
     search_pattern = f"%{escaped_query}%"
-    students = db.query(models.SinhVien).options(
-        selectinload(models.SinhVien.diem)
-    ).filter(
-        (models.SinhVien.ho_ten.ilike(search_pattern, escape='\\')) |
-        (models.SinhVien.msv.ilike(search_pattern, escape='\\'))
-    ).limit(50).all()
-
-    data = {"results": [format_student(sv, hide_details=True, role=role) for sv in students]}
-    result = security.obfuscate_payload(data)
-    _cache.set(cache_key, result, ttl=_TTL_SEARCH)
-    return result
+    students = (await db.scalars(
+        select(models.SinhVien).options(selectinload(models.SinhVien.diem)).where(
+            (models.SinhVien.ho_ten.ilike(search_pattern, escape='\\')) |
+            (models.SinhVien.msv.ilike(search_pattern, escape='\\'))
+        ).limit(50)
+    )).all()
+
+    entry = await run_in_threadpool(_render_search_entry, students, role)
+    await _cache.aset(cache_key, entry, ttl=_TTL_SEARCH)
+    return response_cache.respond(request, entry)
+
+
+# Cache warming: tính lại các entry phổ biến nhất sau khởi động / invalidation
+cache_warmer.register("classes", _classes_cache_key, _build_classes_payload)
+cache_warmer.register("class", _class_cache_key, _build_class_payload)
+cache_warmer.register("student", _student_cache_key, _build_student_payload)
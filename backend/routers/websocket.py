@@ -1,18 +1,21 @@
 import html
 import ipaddress
-import json
 import logging
 import asyncio
 from datetime import datetime
 from typing import List, Optional
 
+import database
+import db_stats
 import models
-import cache as _cache
+import ratelimit
 import security
-from database import SessionLocal
+import serialization
 from fastapi import APIRouter, WebSocket, WebSocketDisconnect
-from jose import JWTError, jwt
-from sqlalchemy import or_
+from jose import JWTError
+from sqlalchemy import or_, select
+
+from .chat import ainvalidate_history
 
 logger = logging.getLogger(__name__)
 
@@ -20,19 +23,8 @@ _CHAT_RATE_LIMIT_SECONDS = 2
 _CHAT_RATE_LIMIT_COUNT = 1
 
 
-def _allow_chat_message(identity: str) -> bool:
-    now = datetime.utcnow().timestamp()
-    key = f"rl:chat:{identity}"
-    attempts = _cache.get(key) or []
-    attempts = [t for t in attempts if now - t < _CHAT_RATE_LIMIT_SECONDS]
-
-    if len(attempts) >= _CHAT_RATE_LIMIT_COUNT:
-        _cache.set(key, attempts, ttl=_CHAT_RATE_LIMIT_SECONDS)
-        return False
-
-    attempts.append(now)
-    _cache.set(key, attempts, ttl=_CHAT_RATE_LIMIT_SECONDS)
-    return True
+async def _allow_chat_message(identity: str) -> bool:
+    return await ratelimit.aallow("chat", identity, _CHAT_RATE_LIMIT_COUNT, _CHAT_RATE_LIMIT_SECONDS)
 
 
 _MAX_CONNECTIONS_PER_USER = 2
@@ -48,7 +40,7 @@ class ConnectionManager:
         per_user = sum(1 for c in self.active_connections if c.get("user") == user_identifier)
         if per_user >= _MAX_CONNECTIONS_PER_USER or len(self.active_connections) >= _MAX_TOTAL_CONNECTIONS:
             await websocket.accept()
-            await websocket.send_text(json.dumps({"type": "error", "message": "Quá nhiều kết nối. Vui lòng thử lại sau."}))
+            await websocket.send_text(serialization.dumps_str({"type": "error", "message": "Quá nhiều kết nối. Vui lòng thử lại sau."}))
             await websocket.close()
             return
         await websocket.accept()
@@ -79,7 +71,7 @@ class ConnectionManager:
         
         for conn in to_kick:
             try:
-                await conn["ws"].send_text(json.dumps({"type": "error", "message": "Bạn đã bị cấm khỏi hệ thống."}))
+                await conn["ws"].send_text(serialization.dumps_str({"type": "error", "message": "Bạn đã bị cấm khỏi hệ thống."}))
                 await conn["ws"].close()
             except Exception as e:
                 logger.debug(f"Kick error (already closed?): {e}")
@@ -104,7 +96,7 @@ class ConnectionManager:
 
     async def broadcast_to_admins(self, message: dict):
         """Sends a message ONLY to authenticated administrators."""
-        msg_str = json.dumps(message)
+        msg_str = serialization.dumps_str(message)
         for connection in self.active_connections:
             if connection.get("is_admin"):
                 try:
@@ -113,7 +105,7 @@ class ConnectionManager:
                     logger.debug(f"Broadcast to admins failed: {e}")
 
     async def broadcast(self, message: dict):
-        msg_str = json.dumps(message)
+        msg_str = serialization.dumps_str(message)
         for connection in self.active_connections:
             try:
                 await connection["ws"].send_text(msg_str)
@@ -132,7 +124,7 @@ class ConnectionManager:
             for conn in self.active_connections
             if conn.get("user")
         ))
-        message = json.dumps({"type": "online_count", "count": unique_users})
+        message = serialization.dumps_str({"type": "online_count", "count": unique_users})
         for connection in self.active_connections:
             try:
                 await connection["ws"].send_text(message)
@@ -140,7 +132,7 @@ class ConnectionManager:
                 logger.debug(f"Broadcast online count failed: {e}")
 
     async def send_personal_message(self, user_identifier: str, message: dict):
-        msg_str = json.dumps(message)
+        msg_str = serialization.dumps_str(message)
         for connection in self.active_connections:
             if connection["user"] == user_identifier:
                 try:
@@ -232,6 +224,97 @@ def _extract_client_ip(websocket: WebSocket) -> Optional[str]:
 
     return valid_ips[0] if valid_ips else None
 
+def _user_ban_filter(username: str):
+    # Nick.id lấy bằng subquery ngay trong câu kiểm tra ban (một round-trip)
+    return models.BanRecord.user_id == (
+        select(models.Nick.id).where(models.Nick.username == username).scalar_subquery()
+    )
+
+
+async def _store_chat_message(websocket: WebSocket, sender: str, sender_ip: Optional[str],
+                              sender_fp: Optional[str], content: str, reply_to_id) -> bool:
+    """Lưu tin chat rồi broadcast. False nếu người gửi đã bị cấm (socket đã bị đóng)."""
+    async with database.AsyncSessionLocal() as db:
+        # Nick của người gửi load một lần: dùng cho kiểm tra ban, user_id của tin nhắn
+        # và full_name mới nhất khi broadcast
+        sender_nick = (await db.scalars(
+            select(models.Nick).where(models.Nick.username == sender).limit(1)
+        )).first()
+        sender_id = sender_nick.id if sender_nick else None
+        sender_full_name = sender_nick.full_name if sender_nick else None
+
+        # Verify ban before storing (in case they were banned while online)
+        # sender_id None → "user_id == None" sẽ thành IS NULL, khớp mọi ban chỉ theo IP/thiết bị
+        ban_filters = []
+        if sender_id is not None:
+            ban_filters.append(models.BanRecord.user_id == sender_id)
+        if sender_ip:
+            ban_filters.append(models.BanRecord.ip_address == sender_ip)
+        if sender_fp:
+            ban_filters.append(models.BanRecord.device_fingerprint == sender_fp)
+
+        if ban_filters and (await db.scalars(select(models.BanRecord).where(or_(*ban_filters)).limit(1))).first():
+            await websocket.send_text(serialization.dumps_str({"type": "error", "message": "Tài khoản hoặc thiết bị này đã bị cấm."}))
+            await websocket.close()
+            return False
+
+        # 🔄 Handle Replies (tin gốc + người gửi tin gốc trong một query)
+        reply_metadata = None
+        if reply_to_id:
+            try:
+                row = (await db.execute(
+                    select(models.ChatMessage, models.Nick)
+                    .outerjoin(models.Nick, models.Nick.id == models.ChatMessage.user_id)
+                    .where(models.ChatMessage.id == reply_to_id)
+                    .limit(1)
+                )).first()
+                if row:
+                    parent_msg, parent_user = row
+                    reply_metadata = {
+                        "username": parent_user.username if parent_user else "An danh",
+                        "full_name": parent_user.full_name if parent_user else None,
+                        "message": parent_msg.message
+                    }
+            except Exception as e:
+                logger.error(f"Reply metadata fetch error: {e}")
+
+        # Store in DB using SQLAlchemy ORM (cleaner & more secure)
+        try:
+            db_msg = models.ChatMessage(
+                user_id=sender_id,
+                message=content,
+                ip_address=sender_ip,
+                device_fingerprint=sender_fp,
+                parent_id=reply_to_id if reply_metadata else None
+            )
+            db.add(db_msg)
+            await db.commit()
+            await db.refresh(db_msg)
+
+            last_id = db_msg.id
+            last_time = db_msg.created_at.isoformat()
+            await ainvalidate_history()
+        except Exception as db_err:
+            await db.rollback()
+            logger.error(f"DB Insert Failure: {db_err}")
+            # Fallback: Still try to broadcast even if DB save fails
+            last_id = 0
+            last_time = datetime.now().isoformat()
+
+    # BROADCAST (Always happens for successfully received valid messages)
+    await manager.broadcast({
+        "type": "chat_message",
+        "id": last_id,
+        "username": sender,
+        "full_name": sender_full_name,
+        "message": content,
+        "timestamp": last_time,
+        "reply_to": reply_to_id if reply_metadata else None,
+        "reply_metadata": reply_metadata
+    })
+    return True
+
+
 @router.websocket("/ws/online-count")
 async def websocket_endpoint(websocket: WebSocket):
     """
@@ -253,7 +336,7 @@ async def websocket_endpoint(websocket: WebSocket):
     token = websocket.cookies.get("stoken")
     if token:
         try:
-            payload = jwt.decode(token, security.SECRET_KEY, algorithms=[security.ALGORITHM])
+            payload = security.decode_token(token)
             username = payload.get("sub")
             role = payload.get("role")
             if username:
@@ -265,28 +348,25 @@ async def websocket_endpoint(websocket: WebSocket):
 
     if not user_id:
         await websocket.accept()
-        await websocket.send_text(json.dumps({"type": "error", "message": "Bạn cần đăng nhập để tham gia hệ thống."}))
+        await websocket.send_text(serialization.dumps_str({"type": "error", "message": "Bạn cần đăng nhập để tham gia hệ thống."}))
         await websocket.close()
         return
 
     # Initial Ban Check (by IP)
-    db = SessionLocal()
-    try:
+    async with database.AsyncSessionLocal() as db:
         ban_filters = []
         if policy_ip:
             ban_filters.append(models.BanRecord.ip_address == policy_ip)
         if user_id:
-            ban_filters.append(models.BanRecord.user_id == (db.query(models.Nick.id).filter(models.Nick.username == user_id).scalar()))
+            ban_filters.append(_user_ban_filter(user_id))
 
         if ban_filters:
-            is_banned = db.query(models.BanRecord).filter(or_(*ban_filters)).first()
+            is_banned = (await db.scalars(select(models.BanRecord).where(or_(*ban_filters)).limit(1))).first()
             if is_banned:
                 await websocket.accept()
-                await websocket.send_text(json.dumps({"type": "error", "message": "Bạn đã bị cấm khỏi hệ thống chat."}))
+                await websocket.send_text(serialization.dumps_str({"type": "error", "message": "Bạn đã bị cấm khỏi hệ thống chat."}))
                 await websocket.close()
                 return
-    finally:
-        db.close()
 
     # Rate limiting state
     last_chat_time = datetime.min
@@ -299,7 +379,7 @@ async def websocket_endpoint(websocket: WebSocket):
                 # Require a ping or message at least every 30 seconds
                 data = await asyncio.wait_for(websocket.receive_text(), timeout=30.0)
                 if len(data) > _MAX_FRAME_SIZE:
-                    await websocket.send_text(json.dumps({"type": "error", "message": "Tin nhắn quá lớn."}))
+                    await websocket.send_text(serialization.dumps_str({"type": "error", "message": "Tin nhắn quá lớn."}))
                     continue
             except asyncio.TimeoutError:
                 logger.info(f"WebSocket: Connection timed out ({client_ip})")
@@ -312,12 +392,12 @@ async def websocket_endpoint(websocket: WebSocket):
                 break
             
             try:
-                msg = json.loads(data)
+                msg = serialization.loads(data)
 
                 # Handle ping
                 if msg.get("type") == "ping":
                     try:
-                        await websocket.send_text(json.dumps({"type": "pong"}))
+                        await websocket.send_text(serialization.dumps_str({"type": "pong"}))
                     except Exception:
                         pass
                     continue
@@ -326,17 +406,17 @@ async def websocket_endpoint(websocket: WebSocket):
                 if msg.get("type") in ["auth_ticket", "auth"]:
                     ticket_user = None
                     if msg.get("type") == "auth_ticket" and msg.get("ticket"):
-                        ticket_user = security.consume_websocket_ticket(msg.get("ticket"))
+                        ticket_user = await security.consume_websocket_ticket(msg.get("ticket"))
                         # Bind check: ticket's owner MUST match the session's authenticated user_id
                         if ticket_user and ticket_user != user_id:
                             logger.warning(f"WebSocket identity spoofing attempt blocked: session '{user_id}' presented ticket for '{ticket_user}'")
-                            await websocket.send_text(json.dumps({"type": "error", "message": "Vé đăng nhập không hợp lệ với tài khoản này."}))
+                            await websocket.send_text(serialization.dumps_str({"type": "error", "message": "Vé đăng nhập không hợp lệ với tài khoản này."}))
                             await websocket.close()
                             break
                         username = ticket_user
                     elif msg.get("type") == "auth" and msg.get("token"):
                         try:
-                            payload = jwt.decode(msg["token"], security.SECRET_KEY, algorithms=[security.ALGORITHM])
+                            payload = security.decode_token(msg["token"])
                             tok_user = payload.get("sub")
                             if tok_user and tok_user == user_id:
                                 username = tok_user
@@ -349,21 +429,18 @@ async def websocket_endpoint(websocket: WebSocket):
 
                     if username:
                         # Ban Check again with username/FP
-                        db = SessionLocal()
-                        try:
-                            ban_filters = [models.BanRecord.user_id == (db.query(models.Nick.id).filter(models.Nick.username == username).scalar())]
+                        async with database.AsyncSessionLocal() as db:
+                            ban_filters = [_user_ban_filter(username)]
                             if policy_ip:
                                 ban_filters.append(models.BanRecord.ip_address == policy_ip)
                             if device_fp:
                                 ban_filters.append(models.BanRecord.device_fingerprint == device_fp)
 
-                            check = db.query(models.BanRecord).filter(or_(*ban_filters)).first()
+                            check = (await db.scalars(select(models.BanRecord).where(or_(*ban_filters)).limit(1))).first()
                             if check:
-                                await websocket.send_text(json.dumps({"type": "error", "message": "Tài khoản hoặc thiết bị này đã bị cấm."}))
+                                await websocket.send_text(serialization.dumps_str({"type": "error", "message": "Tài khoản hoặc thiết bị này đã bị cấm."}))
                                 await websocket.close()
                                 return
-                        finally:
-                            db.close()
 
                         old_user = None
                         for conn in manager.active_connections:
@@ -407,8 +484,13 @@ async def websocket_endpoint(websocket: WebSocket):
                     if sender_ip:
                         rate_keys.append(f"ip:{sender_ip}")
 
-                    if not all(_allow_chat_message(key) for key in rate_keys):
-                        await websocket.send_text(json.dumps({
+                    allowed = True
+                    for key in rate_keys:
+                        if not await _allow_chat_message(key):
+                            allowed = False
+                            break
+                    if not allowed:
+                        await websocket.send_text(serialization.dumps_str({
                             "type": "error",
                             "message": "Bạn đang gửi tin nhắn quá nhanh. Vui lòng chờ 2 giây."
                         }))
@@ -421,89 +503,16 @@ async def websocket_endpoint(websocket: WebSocket):
 
                     content = html.escape(raw_content.strip(), quote=True)[:1000]
                     if content:
-                        # Store in DB
-                        db = SessionLocal()
-                        try:
-                            # Verify ban before storing (in case they were banned while online)
-                            ban_filters = []
-                            if sender:
-                                ban_filters.append(models.BanRecord.user_id == (db.query(models.Nick.id).filter(models.Nick.username == sender).scalar()))
-                            if sender_ip:
-                                ban_filters.append(models.BanRecord.ip_address == sender_ip)
-                            if sender_fp:
-                                ban_filters.append(models.BanRecord.device_fingerprint == sender_fp)
-
-                            check = None
-                            if ban_filters:
-                                check = db.query(models.BanRecord).filter(or_(*ban_filters)).first()
-                            
-                            if check:
-                                await websocket.send_text(json.dumps({"type": "error", "message": "Tài khoản hoặc thiết bị này đã bị cấm."}))
-                                await websocket.close()
-                                return
+                        with db_stats.track("WS chat_message") as queries:
+                            stored = await _store_chat_message(
+                                websocket, sender, sender_ip, sender_fp, content, msg.get("reply_to")
+                            )
+                        db_stats.check_budget(queries)
+                        if not stored:
+                            return
 
-                            # 🔄 Handle Replies
-                            reply_to_id = msg.get("reply_to")
-                            reply_metadata = None
-                            if reply_to_id:
-                                try:
-                                    parent_msg = db.query(models.ChatMessage).filter(models.ChatMessage.id == reply_to_id).first()
-                                    if parent_msg:
-                                        parent_user = db.query(models.Nick).filter(models.Nick.id == parent_msg.user_id).first()
-                                        reply_metadata = {
-                                            "username": parent_user.username if parent_user else "An danh",
-                                            "full_name": parent_user.full_name if parent_user else None,
-                                            "message": parent_msg.message
-                                        }
-                                except Exception as e:
-                                    logger.error(f"Reply metadata fetch error: {e}")
-
-                            # Store in DB using SQLAlchemy ORM (cleaner & more secure)
-                            try:
-                                db_msg = models.ChatMessage(
-                                    user_id=(db.query(models.Nick.id).filter(models.Nick.username == sender).scalar()), 
-                                    message=content,
-                                    ip_address=sender_ip,
-                                    device_fingerprint=sender_fp,
-                                    parent_id=reply_to_id if reply_metadata else None
-                                )
-                                db.add(db_msg)
-                                db.commit()
-                                db.refresh(db_msg)
-                                
-                                last_id = db_msg.id
-                                last_time = db_msg.created_at.isoformat()
-                            except Exception as db_err:
-                                db.rollback()
-                                logger.error(f"DB Insert Failure: {db_err}")
-                                # Fallback: Still try to broadcast even if DB save fails
-                                last_id = 0
-                                last_time = datetime.now().isoformat()
-
-                            # BROADCAST (Always happens for successfully received valid messages)
-                            # Lookup latest full_name to reflect profile changes immediately
-                            sender_full_name = None
-                            sender_nick = db.query(models.Nick).filter(
-                                models.Nick.username == sender
-                            ).first()
-                            if sender_nick:
-                                sender_full_name = sender_nick.full_name
-
-                            await manager.broadcast({
-                                "type": "chat_message",
-                                "id": last_id,
-                                "username": sender,
-                                "full_name": sender_full_name,
-                                "message": content,
-                                "timestamp": last_time,
-                                "reply_to": reply_to_id if reply_metadata else None,
-                                "reply_metadata": reply_metadata
-                            })
-                        finally:
-                            db.close()
-
-
-            except json.JSONDecodeError:
+
+            except serialization.JSONDecodeError:
                 logger.warning("WebSocket: Received invalid JSON")
                 continue
             except Exception as e:
@@ -1,13 +1,24 @@
+import asyncio
 import hashlib
+import hmac
 import logging
 import os
 import secrets
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+from contextvars import ContextVar, Token
+from dataclasses import dataclass
 from datetime import datetime, timedelta
 from typing import Any, Optional
 
 import cache as _cache
 import database
+import metrics
 import models
+import revocation
+import serialization
 from dotenv import load_dotenv
 from fastapi import Depends, HTTPException, Request, status
 from jose import JWTError, jwt
@@ -63,7 +74,23 @@ OBFUSCATION_ID_KEY = _obf_id_key.encode()
 PAYLOAD_OBFUSCATION_KEY = _payload_obf_key.encode()
 _WS_TICKET_TTL = 60
 
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+# bcrypt cost; đổi giá trị này thì hash cũ được rehash dần khi user đăng nhập
+BCRYPT_ROUNDS = int(os.getenv("BCRYPT_ROUNDS", "12"))
+pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto", bcrypt__rounds=BCRYPT_ROUNDS)
+
+# bcrypt chạy trên executor riêng (có giới hạn) thay vì threadpool chung của AnyIO:
+# một đợt credential stuffing chỉ xếp hàng tối đa WORKERS + QUEUE job, phần vượt
+# quá bị từ chối ngay bằng 429. Route login/register async chờ kết quả bằng
+# asyncio.wrap_future nên không giữ thread nào trong lúc chờ.
+_HASH_WORKERS = int(os.getenv("PASSWORD_HASH_WORKERS", "2"))
+_HASH_QUEUE_LIMIT = int(os.getenv("PASSWORD_HASH_QUEUE_LIMIT", "16"))
+_hash_executor = ThreadPoolExecutor(max_workers=_HASH_WORKERS, thread_name_prefix="password-hash")
+_hash_slots = threading.BoundedSemaphore(_HASH_WORKERS + _HASH_QUEUE_LIMIT)
+
+_m_hash_latency = metrics.histogram("password_hash_seconds", "bcrypt hash/verify duration", ("op",))
+_m_hash_wait = metrics.histogram("password_hash_queue_seconds", "Time spent waiting for a hashing worker", ("op",))
+_m_hash_rejected = metrics.counter("password_hash_rejections_total", "Hashing requests shed because the queue was full", ("op",))
+_m_hash_in_flight = metrics.gauge("password_hash_in_flight", "Hashing requests running or queued")
 
 
 
@@ -81,26 +108,84 @@ def get_token(request: Request) -> Optional[str]:
         return auth_header.split(" ")[1]
     return request.cookies.get("stoken")
 
-def verify_password(plain_password, hashed_password):
-    if not plain_password or not hashed_password:
-        return False
-    plain = _normalize_password(plain_password)
+def _submit_hashing(op: str, fn, *args) -> Future:
+    """Đưa fn lên executor băm mật khẩu; raise 429 nếu hàng đợi đã đầy."""
+    if not _hash_slots.acquire(blocking=False):
+        _m_hash_rejected.inc(op=op)
+        raise HTTPException(
+            status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+            detail="Server is busy, please try again shortly",
+            headers={"Retry-After": "1"},
+        )
+    _m_hash_in_flight.inc()
+    submitted = time.perf_counter()
+
+    def _release() -> None:
+        _m_hash_in_flight.dec()
+        _hash_slots.release()
+
+    def _timed():
+        started = time.perf_counter()
+        _m_hash_wait.observe(started - submitted, op=op)
+        try:
+            return fn(*args)
+        finally:
+            _m_hash_latency.observe(time.perf_counter() - started, op=op)
+            _release()  # trước khi future có kết quả: caller thấy slot đã trả
+
+    try:
+        return _hash_executor.submit(_timed)
+    except BaseException:
+        _release()
+        raise
+
+
+def _run_hashing(op: str, fn, *args):
+    """Bản sync (bootstrap admin lúc khởi động): chặn thread gọi đến khi băm xong."""
+    return _submit_hashing(op, fn, *args).result()
+
+
+async def _arun_hashing(op: str, fn, *args):
+    """Route async chờ executor băm mật khẩu mà không giữ thread nào của AnyIO."""
+    return await asyncio.wrap_future(_submit_hashing(op, fn, *args))
+
+
+def _verify_and_update(plain_password, hashed_password) -> tuple[bool, Optional[str]]:
     try:
-        if pwd_context.verify(plain, hashed_password):
-            return True
+        return pwd_context.verify_and_update(_normalize_password(plain_password), hashed_password)
     except Exception as e:
         logger.warning(f"Password verification error: {e}")
-    # Fallback check for unnormalized legacy hashes if any
-    raw = plain_password if isinstance(plain_password, str) else str(plain_password)
-    if len(raw.encode("utf-8")) <= 72:
-        try:
-            return pwd_context.verify(raw, hashed_password)
-        except Exception:
-            pass
-    return False
+        return False, None
+
+
+def verify_and_rehash(plain_password, hashed_password) -> tuple[bool, Optional[str]]:
+    """
+    Kiểm tra mật khẩu; trả về (ok, new_hash). new_hash khác None khi hash cũ
+    dùng cost/scheme khác cấu hình hiện tại — caller nên lưu lại.
+    """
+    if not plain_password or not hashed_password:
+        return False, None
+    return _run_hashing("verify", _verify_and_update, plain_password, hashed_password)
+
+
+async def averify_and_rehash(plain_password, hashed_password) -> tuple[bool, Optional[str]]:
+    """Phiên bản async của verify_and_rehash() (route login)."""
+    if not plain_password or not hashed_password:
+        return False, None
+    return await _arun_hashing("verify", _verify_and_update, plain_password, hashed_password)
+
+
+def verify_password(plain_password, hashed_password):
+    return verify_and_rehash(plain_password, hashed_password)[0]
+
 
 def get_password_hash(password):
-    return pwd_context.hash(_normalize_password(password))
+    return _run_hashing("hash", pwd_context.hash, _normalize_password(password))
+
+
+async def aget_password_hash(password):
+    return await _arun_hashing("hash", pwd_context.hash, _normalize_password(password))
+
 
 def create_access_token(data: dict):
     to_encode = data.copy()
@@ -109,21 +194,94 @@ def create_access_token(data: dict):
     encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
     return encoded_jwt
 
-def _get_user_from_cache_or_db(username: str, db: Session) -> Optional[models.Nick]:
+@dataclass(frozen=True)
+class Principal:
+    """
+    Người dùng đã xác thực, truyền từ get_current_user vào route.
+
+    Chỉ là dữ liệu thuần (không gắn Session): route cần ghi thì tự load Nick
+    bằng load_user(). Cache giữ dạng list (to_cache) nên Redis không cần pickle.
+    """
+    __slots__ = ("id", "username", "role", "full_name", "class_change_limit", "reset_limit_at", "created_at")
+
+    id: int
+    username: str
+    role: int
+    full_name: Optional[str]
+    class_change_limit: Optional[int]
+    reset_limit_at: Optional[datetime]
+    created_at: Optional[datetime]
+
+    @classmethod
+    def from_nick(cls, user: models.Nick) -> "Principal":
+        return cls(
+            id=user.id,
+            username=user.username,
+            role=user.role,
+            full_name=user.full_name,
+            class_change_limit=user.class_change_limit,
+            reset_limit_at=user.reset_limit_at,
+            created_at=user.created_at,
+        )
+
+    def to_cache(self) -> list:
+        return [
+            self.id, self.username, self.role, self.full_name, self.class_change_limit,
+            self.reset_limit_at.isoformat() if self.reset_limit_at else None,
+            self.created_at.isoformat() if self.created_at else None,
+        ]
+
+    @classmethod
+    def from_cache(cls, data: list) -> "Principal":
+        id_, username, role, full_name, limit, reset_at, created_at = data
+        return cls(
+            id=id_,
+            username=username,
+            role=role,
+            full_name=full_name,
+            class_change_limit=limit,
+            reset_limit_at=datetime.fromisoformat(reset_at) if reset_at else None,
+            created_at=datetime.fromisoformat(created_at) if created_at else None,
+        )
+
+
+def _user_cache_key(username: str) -> str:
+    return f"user:v2:{username}"
+
+
+def _get_user_from_cache_or_db(username: str, db: Session) -> Optional[Principal]:
     """Fetch user — try cache first, fall back to DB."""
-    cache_key = f"user:{username}"
+    cache_key = _user_cache_key(username)
     cached = _cache.get(cache_key)
     if cached is not None:
-        return cached
+        try:
+            return Principal.from_cache(cached)
+        except (TypeError, ValueError):
+            _cache.delete(cache_key)
     user = db.query(models.Nick).filter(models.Nick.username == username).first()
-    if user:
-        _cache.set(cache_key, user, ttl=_USER_CACHE_TTL)
-    return user
+    if user is None:
+        return None
+    principal = Principal.from_nick(user)
+    _cache.set(cache_key, principal.to_cache(), ttl=_USER_CACHE_TTL)
+    return principal
+
+
+def load_user(db: Session, principal: Principal, for_update: bool = False) -> Optional[models.Nick]:
+    """Load Nick (gắn với db) của principal khi route cần ghi."""
+    query = db.query(models.Nick).filter(models.Nick.id == principal.id)
+    if for_update:
+        query = query.with_for_update()
+    return query.first()
 
 
 def invalidate_user_cache(username: str):
     """Xóa cache user khi admin thay đổi thông tin (role, limit...)."""
-    _cache.delete(f"user:{username}")
+    _cache.delete(_user_cache_key(username))
+
+
+async def ainvalidate_user_cache(username: str):
+    """Phiên bản async của invalidate_user_cache() cho các route async."""
+    await _cache.adelete(_user_cache_key(username))
 
 
 def create_websocket_ticket(username: str) -> str:
@@ -132,69 +290,162 @@ def create_websocket_ticket(username: str) -> str:
     return ticket
 
 
-def consume_websocket_ticket(ticket: str) -> Optional[str]:
+async def consume_websocket_ticket(ticket: str) -> Optional[str]:
     if not ticket:
         return None
     cache_key = f"ws_ticket:{ticket}"
-    return _cache.pop(cache_key)
+    return await _cache.apop(cache_key)
+
+
+# -------------------------------------------------------------------------
+# Decode-once authentication: LRU { sha256(token): (claims, exp) } để token đã
+# verify không phải jwt.decode lại; AuthContext được tính một lần cho mỗi
+# request (request.state.auth) và dùng chung cho middleware + dependencies.
+# -------------------------------------------------------------------------
+_TOKEN_CACHE_SIZE = int(os.getenv("AUTH_TOKEN_CACHE_SIZE", "4096"))
+_verified_tokens: OrderedDict[str, tuple[dict, float]] = OrderedDict()
+_verified_lock = threading.Lock()
+
+
+def _token_hash(token: str) -> str:
+    return hashlib.sha256(token.encode('utf-8')).hexdigest()
+
+
+def decode_token(token: str, token_hash: Optional[str] = None) -> dict:
+    """jwt.decode có cache theo hash của token. Raise JWTError nếu token không hợp lệ."""
+    token_hash = token_hash or _token_hash(token)
+    now = time.time()
+    with _verified_lock:
+        entry = _verified_tokens.get(token_hash)
+        if entry is not None:
+            if entry[1] > now:
+                _verified_tokens.move_to_end(token_hash)
+                return entry[0]
+            del _verified_tokens[token_hash]
+    claims = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+    exp = claims.get("exp")
+    expires_at = float(exp) if isinstance(exp, (int, float)) else now + 60
+    with _verified_lock:
+        _verified_tokens[token_hash] = (claims, expires_at)
+        while len(_verified_tokens) > _TOKEN_CACHE_SIZE:
+            _verified_tokens.popitem(last=False)
+    return claims
+
+
+def _forget_token(token_hash: str) -> None:
+    with _verified_lock:
+        _verified_tokens.pop(token_hash, None)
+
+
+class AuthContext:
+    """Kết quả xác thực của một request (token → claims), tính một lần."""
+    __slots__ = ("token", "token_hash", "claims", "_revoked")
+
+    def __init__(self, token: Optional[str] = None, token_hash: Optional[str] = None, claims: Optional[dict] = None):
+        self.token = token
+        self.token_hash = token_hash
+        self.claims = claims
+        self._revoked: Optional[bool] = None
+
+    @property
+    def username(self) -> Optional[str]:
+        return self.claims.get("sub") if self.claims else None
+
+    @property
+    def revoked(self) -> bool:
+        if self._revoked is None:
+            self._revoked = bool(self.token_hash) and _is_hash_revoked(self.token_hash)
+        return self._revoked
+
+    @property
+    def authenticated(self) -> bool:
+        return self.username is not None and not self.revoked
+
+
+def get_auth_context(request: Request) -> AuthContext:
+    """AuthContext của request; decode token ở lần gọi đầu rồi giữ trên request.state."""
+    ctx = getattr(request.state, "auth", None)
+    if ctx is not None:
+        return ctx
+    token = get_token(request)
+    if not token:
+        ctx = AuthContext()
+    else:
+        token_hash = _token_hash(token)
+        try:
+            claims = decode_token(token, token_hash)
+        except JWTError as e:
+            logger.debug(f"JWT verification failed: {e}")
+            claims = None
+        ctx = AuthContext(token, token_hash, claims)
+    request.state.auth = ctx
+    return ctx
 
 
 def revoke_token(token: str):
     """Revoke a JWT token by adding its SHA-256 hash to cache denylist."""
     if not token:
         return
-    token_hash = hashlib.sha256(token.encode('utf-8')).hexdigest()
+    token_hash = _token_hash(token)
+    _forget_token(token_hash)
     _cache.set(f"revoked_token:{token_hash}", True, ttl=60 * 60 * 24 * 7)
+    revocation.add(token_hash)
+
+
+async def arevoke_token(token: str):
+    """Phiên bản async của revoke_token() (dùng trong route logout)."""
+    if not token:
+        return
+    token_hash = _token_hash(token)
+    _forget_token(token_hash)
+    await _cache.aset(f"revoked_token:{token_hash}", True, ttl=60 * 60 * 24 * 7)
+    await revocation.aadd(token_hash)
 
 
 def is_token_revoked(token: str) -> bool:
     """Check if a JWT token has been revoked via logout."""
     if not token:
         return False
-    token_hash = hashlib.sha256(token.encode('utf-8')).hexdigest()
+    return _is_hash_revoked(_token_hash(token))
+
+
+def _is_hash_revoked(token_hash: str) -> bool:
+    # Filter cục bộ trả lời phần lớn request; chỉ hit dương tính mới tra cache.
+    if not revocation.might_be_revoked(token_hash):
+        return False
     return _cache.get(f"revoked_token:{token_hash}") is True
 
 
-def get_current_user(request: Request, db: Session = Depends(database.get_db)):
-    token = get_token(request)
+def get_current_user(request: Request, db: Session = Depends(database.get_db)) -> Principal:
     credentials_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="Could not validate credentials",
         headers={"WWW-Authenticate": "Bearer"},
     )
-    if not token or is_token_revoked(token):
-        raise credentials_exception
-    
-    try:
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-        username: str = payload.get("sub")
-        if username is None:
-            raise credentials_exception
-    except JWTError:
+    ctx = get_auth_context(request)
+    if not ctx.authenticated:
         raise credentials_exception
 
-    user = _get_user_from_cache_or_db(username, db)
+    user = _get_user_from_cache_or_db(ctx.username, db)
     if user is None:
         raise credentials_exception
     return user
 
 
-def get_optional_user(request: Request, db: Session = Depends(database.get_db)):
-    token = get_token(request)
-    if not token or is_token_revoked(token):
+def get_optional_user(request: Request, db: Session = Depends(database.get_db)) -> Optional[Principal]:
+    ctx = get_auth_context(request)
+    if not ctx.authenticated:
         return None
     try:
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-        username: str = payload.get("sub")
-        if username is None:
-            return None
-        return _get_user_from_cache_or_db(username, db)
+        return _get_user_from_cache_or_db(ctx.username, db)
     except Exception:
         return None
 
 import base64
 from cryptography.fernet import Fernet
-import json
+from cryptography.hazmat.primitives.ciphers.aead import AESSIV
+import functools
+import zlib
 
 # Derive valid 32-byte Fernet keys by hashing the environment keys
 def _derive_fernet_key(base_key: bytes) -> bytes:
@@ -206,24 +457,123 @@ def _derive_fernet_key(base_key: bytes) -> bytes:
 _id_fernet = Fernet(_derive_fernet_key(OBFUSCATION_ID_KEY))
 _payload_fernet = Fernet(_derive_fernet_key(PAYLOAD_OBFUSCATION_KEY))
 
+# ID token v2: "T_2" + base64url(AES-SIV(msv)) — tất định (cùng MSV luôn ra cùng
+# token nên cache / so sánh được) và có xác thực. Token v1 "T_g..." (Fernet,
+# IV ngẫu nhiên) vẫn giải được. Encode/decode đều qua LRU có giới hạn.
+_ID_TOKEN_V2 = "2"
+_ID_TOKEN_CACHE_SIZE = int(os.getenv("ID_TOKEN_CACHE_SIZE", "20000"))
+_id_siv = AESSIV(hashlib.sha512(OBFUSCATION_ID_KEY + b":siv").digest())
+
+
+@functools.lru_cache(maxsize=_ID_TOKEN_CACHE_SIZE)
+def _encode_id(real_id: str) -> str:
+    sealed = _id_siv.encrypt(real_id.encode(), None)
+    return "T_" + _ID_TOKEN_V2 + base64.urlsafe_b64encode(sealed).decode().rstrip("=")
+
+
+@functools.lru_cache(maxsize=_ID_TOKEN_CACHE_SIZE)
+def _decode_id(token: str) -> str:
+    """token = phần sau "T_"; raise nếu không hợp lệ (lỗi không được cache)."""
+    if token.startswith(_ID_TOKEN_V2):
+        body = token[len(_ID_TOKEN_V2):]
+        sealed = base64.urlsafe_b64decode(body + "=" * (-len(body) % 4))
+        return _id_siv.decrypt(sealed, None).decode()
+    # v1: Fernet.decrypt expects the base64-encoded token; it verifies the HMAC itself.
+    return _id_fernet.decrypt(token + "=" * (-len(token) % 4)).decode()
+
+
 def obfuscate_id(real_id: str) -> str:
-    """Creates a securely encrypted token for a student ID using AES (Fernet)."""
-    data = real_id.encode()
-    encrypted = _id_fernet.encrypt(data)
-    # Fernet.encrypt already returns a base64-encoded bytes.
-    # Prefix with T_ and ensure it's a string.
-    return "T_" + encrypted.decode().replace('=', '')
+    """Creates a deterministic authenticated token for a student ID (AES-SIV)."""
+    return _encode_id(real_id)
+
 
-def obfuscate_payload(data: Any) -> str:
+# Envelope của payload (plaintext bên trong Fernet):
+# - JSON thô (bản cũ; JSON không bao giờ bắt đầu bằng byte điều khiển)
+# - 0x01 + zlib(JSON): nén TRƯỚC khi mã hoá — ciphertext không nén được nữa
+# Payload nhỏ hơn PAYLOAD_COMPRESS_MIN_BYTES giữ dạng JSON thô.
+_PAYLOAD_ZLIB = b"\x01"
+_PAYLOAD_COMPRESS_MIN_BYTES = int(os.getenv("PAYLOAD_COMPRESS_MIN_BYTES", "512"))
+_PAYLOAD_COMPRESS_LEVEL = int(os.getenv("PAYLOAD_COMPRESS_LEVEL", "6"))
+
+
+def obfuscate_payload(data: Any) -> Any:
     """Encrypts an entire dictionary/list into a single opaque string using AES (Fernet)."""
+    if _plain_payloads.get():
+        return data
     # Minimize JSON first
-    json_str = json.dumps(data, separators=(',', ':'))
-    data_bytes = json_str.encode()
-    
+    data_bytes = serialization.dumps(data)
+    if len(data_bytes) >= _PAYLOAD_COMPRESS_MIN_BYTES:
+        data_bytes = _PAYLOAD_ZLIB + zlib.compress(data_bytes, _PAYLOAD_COMPRESS_LEVEL)
+
     encrypted = _payload_fernet.encrypt(data_bytes)
     # Fernet.encrypt already returns a base64-encoded bytes.
     return encrypted.decode().replace('=', '')
 
+
+# Kênh nội bộ BFF → backend: request mang header X-Internal-Auth hợp lệ
+# ("<unix_ts>.<hex HMAC-SHA256(INTERNAL_API_SECRET, "<unix_ts>\n<METHOD>\n<path>\n<query>")>")
+# nhận JSON thường, obfuscate_payload() trả nguyên dữ liệu. Chữ ký gắn với method +
+# path + query string (raw, như trên dây) nên không dùng lại được cho endpoint /
+# tham số khác; hạn mặc định 30s.
+# Không đặt INTERNAL_API_SECRET = tắt.
+INTERNAL_AUTH_HEADER = "x-internal-auth"
+_INTERNAL_API_SECRET = os.getenv("INTERNAL_API_SECRET", "").encode()
+_INTERNAL_AUTH_MAX_SKEW = int(os.getenv("INTERNAL_AUTH_MAX_SKEW", "30"))
+_plain_payloads: ContextVar[bool] = ContextVar("plain_payloads", default=False)
+
+
+def _internal_auth_signature(ts: str, method: str, path: str, query: str) -> str:
+    message = f"{ts}\n{method.upper()}\n{path}\n{query}".encode()
+    return hmac.new(_INTERNAL_API_SECRET, message, hashlib.sha256).hexdigest()
+
+
+def verify_internal_auth(value: str, method: str, path: str, query: str = "") -> bool:
+    """True nếu header X-Internal-Auth ký đúng (ts + method + path + query) bằng INTERNAL_API_SECRET và còn hạn."""
+    if not _INTERNAL_API_SECRET or not value:
+        return False
+    ts, _, signature = value.partition(".")
+    try:
+        if abs(time.time() - int(ts)) > _INTERNAL_AUTH_MAX_SKEW:
+            return False
+    except ValueError:
+        return False
+    return hmac.compare_digest(_internal_auth_signature(ts, method, path, query), signature)
+
+
+def set_plain_payloads(enabled: bool) -> Token:
+    """Bật/tắt chế độ payload thường cho request hiện tại (trả token để reset)."""
+    return _plain_payloads.set(enabled)
+
+
+def reset_plain_payloads(token: Token) -> None:
+    _plain_payloads.reset(token)
+
+
+def plain_payloads() -> bool:
+    return _plain_payloads.get()
+
+
+def payload_cache_key(key: str) -> str:
+    """Key cache cho payload đã render: biến thể ":plain" khi đang ở kênh nội bộ.
+
+    Hậu tố (không phải tiền tố) để các delete_prefix() hiện có xoá luôn biến thể này.
+    """
+    return key + ":plain" if _plain_payloads.get() else key
+
+
+def payload_cache_variants(key: str) -> tuple[str, str]:
+    """Mọi biến thể của một key payload (để xoá chính xác, không cần delete_prefix)."""
+    return key, key + ":plain"
+
+
+def deobfuscate_payload(token: str) -> Any:
+    """Ngược lại của obfuscate_payload (nhận cả payload cũ chưa nén)."""
+    padding = -len(token) % 4
+    plain = _payload_fernet.decrypt(token + "=" * padding)
+    if plain[:1] == _PAYLOAD_ZLIB:
+        plain = zlib.decompress(plain[1:])
+    return serialization.loads(plain)
+
 def deobfuscate_id(opaque_id: str, force_obfuscated: bool = False) -> str:
     """Resolves an opaque token back to a real student ID if it has the T_ prefix."""
     if not opaque_id or not opaque_id.startswith("T_"):
@@ -232,17 +582,7 @@ def deobfuscate_id(opaque_id: str, force_obfuscated: bool = False) -> str:
         return opaque_id # It's a real MSV or empty
     
     try:
-        token = opaque_id[2:]
-        # Add back base64 padding
-        padding = 4 - (len(token) % 4)
-        if padding != 4:
-            token += "=" * padding
-            
-        token_bytes = token.encode()
-        # Fernet.decrypt expects the base64-encoded token (bytes or str)
-        # It handles the structure and HMAC verification internally.
-        decrypted = _id_fernet.decrypt(token_bytes)
-        return decrypted.decode()
+        return _decode_id(opaque_id[2:])
     except Exception:
         if force_obfuscated:
             raise ValueError("Invalid obfuscated ID")
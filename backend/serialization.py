@@ -0,0 +1,65 @@
+"""
+JSON serialization dùng chung cho response, payload obfuscation và frame WebSocket.
+
+- orjson nếu có (nhanh hơn stdlib nhiều lần), stdlib json nếu không.
+- datetime / date / time -> ISO 8601 (orjson xử lý native, stdlib qua _default),
+  Decimal -> float, set / frozenset -> list, key dict không phải str được chuyển
+  thành str như stdlib.
+- Output luôn compact (không khoảng trắng), UTF-8, không escape ký tự non-ASCII.
+"""
+
+import json
+from datetime import date, datetime, time
+from decimal import Decimal
+from typing import Any
+
+from fastapi.responses import JSONResponse
+
+try:
+    import orjson
+except Exception:  # pragma: no cover - optional dependency
+    orjson = None
+
+# orjson.JSONDecodeError là subclass của json.JSONDecodeError
+JSONDecodeError = json.JSONDecodeError
+
+
+def _default(obj: Any) -> Any:
+    if isinstance(obj, (datetime, date, time)):
+        return obj.isoformat()
+    if isinstance(obj, Decimal):
+        return float(obj)
+    if isinstance(obj, (set, frozenset)):
+        return list(obj)
+    raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+
+
+if orjson is not None:
+    _ORJSON_OPTIONS = orjson.OPT_NON_STR_KEYS
+
+    def dumps(value: Any) -> bytes:
+        return orjson.dumps(value, default=_default, option=_ORJSON_OPTIONS)
+
+    def loads(raw: Any) -> Any:
+        return orjson.loads(raw)
+else:  # pragma: no cover - exercised only without orjson
+    def dumps(value: Any) -> bytes:
+        return json.dumps(value, separators=(",", ":"), ensure_ascii=False, default=_default).encode("utf-8")
+
+    def loads(raw: Any) -> Any:
+        return json.loads(raw)
+
+
+def dumps_str(value: Any) -> str:
+    """Như dumps() nhưng trả str (WebSocket send_text)."""
+    return dumps(value).decode("utf-8")
+
+
+class FastJSONResponse(JSONResponse):
+    """JSONResponse render qua serialization.dumps (default_response_class của app).
+
+    Route trả trực tiếp FastJSONResponse(data) còn bỏ qua được jsonable_encoder.
+    """
+
+    def render(self, content: Any) -> bytes:
+        return dumps(content)
@@ -1,9 +1,9 @@
-import json
 from typing import Callable
 
 from fastapi import Request, Response
 from fastapi.routing import APIRoute
-from security import obfuscate_payload
+import serialization
+from security import obfuscate_payload, plain_payloads
 
 
 class PrivacyShieldRoute(APIRoute):
@@ -13,8 +13,9 @@ class PrivacyShieldRoute(APIRoute):
         async def custom_route_handler(request: Request) -> Response:
             response: Response = await original_route_handler(request)
             
-            # Check if response is successful and is JSON
+            # Check if response is successful and is JSON (kênh nội bộ BFF: giữ JSON thường)
             if (response.status_code >= 200 and response.status_code < 300 
+                and not plain_payloads()
                 and "application/json" in response.headers.get("content-type", "")):
                 
                 try:
@@ -23,7 +24,7 @@ class PrivacyShieldRoute(APIRoute):
                     if isinstance(content, memoryview):
                         content = content.tobytes()
                         
-                    body = json.loads(content.decode('utf-8'))
+                    body = serialization.loads(content)
                     
                     # Encrypt the body using obfuscate_payload
                     encrypted_string = obfuscate_payload(body)
@@ -38,7 +39,7 @@ class PrivacyShieldRoute(APIRoute):
                         
                         # Return new response
                         return Response(
-                            content=json.dumps(shielded_data),
+                            content=serialization.dumps(shielded_data),
                             media_type="application/json",
                             status_code=response.status_code,
                             headers=new_headers
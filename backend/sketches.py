@@ -0,0 +1,135 @@
+"""
+Cấu trúc dữ liệu xác suất gọn nhẹ (thread-safe) dùng cho cache layer.
+
+- CountMinSketch: đếm tần suất xấp xỉ với bộ nhớ cố định (width × depth).
+- HeavyHitters: giữ top-K item phổ biến nhất dựa trên ước lượng của CMS,
+  có decay (chia đôi bộ đếm định kỳ) để phản ánh traffic gần đây.
+- BloomFilter: tập hợp xấp xỉ, không bao giờ false negative.
+"""
+
+import hashlib
+import math
+import threading
+from typing import Hashable, Optional
+
+
+def _hash_pair(item: Hashable) -> tuple[int, int]:
+    """Hai hash 64-bit độc lập (double hashing cho d hàng của CMS)."""
+    digest = hashlib.blake2b(repr(item).encode("utf-8"), digest_size=16).digest()
+    return int.from_bytes(digest[:8], "little"), int.from_bytes(digest[8:], "little") | 1
+
+
+class CountMinSketch:
+    def __init__(self, width: int = 2048, depth: int = 4):
+        self.width = width
+        self.depth = depth
+        self._rows = [[0] * width for _ in range(depth)]
+
+    def _indexes(self, item: Hashable) -> list[int]:
+        h1, h2 = _hash_pair(item)
+        return [(h1 + i * h2) % self.width for i in range(self.depth)]
+
+    def add(self, item: Hashable, count: int = 1) -> int:
+        """Tăng bộ đếm và trả về ước lượng mới (không thread-safe, dùng qua HeavyHitters)."""
+        estimate = None
+        for row, idx in zip(self._rows, self._indexes(item)):
+            row[idx] += count
+            value = row[idx]
+            estimate = value if estimate is None else min(estimate, value)
+        return estimate or 0
+
+    def estimate(self, item: Hashable) -> int:
+        return min(row[idx] for row, idx in zip(self._rows, self._indexes(item)))
+
+    def halve(self) -> None:
+        for row in self._rows:
+            for i, v in enumerate(row):
+                if v:
+                    row[i] = v >> 1
+
+
+class HeavyHitters:
+    """Top-K item theo ước lượng Count-Min; decay sau mỗi `decay_every` lần add."""
+
+    def __init__(self, capacity: int = 256, width: int = 2048, depth: int = 4, decay_every: int = 20000):
+        self.capacity = capacity
+        self.decay_every = decay_every
+        self._cms = CountMinSketch(width, depth)
+        self._candidates: dict[Hashable, int] = {}
+        self._min_item: Optional[Hashable] = None
+        self._adds = 0
+        self._lock = threading.Lock()
+
+    def add(self, item: Hashable, count: int = 1) -> None:
+        with self._lock:
+            estimate = self._cms.add(item, count)
+            self._adds += 1
+            if item in self._candidates:
+                self._candidates[item] = estimate
+                if item == self._min_item:
+                    self._min_item = None
+            elif len(self._candidates) < self.capacity:
+                self._candidates[item] = estimate
+                self._min_item = None
+            else:
+                if self._min_item is None:
+                    self._min_item = min(self._candidates, key=self._candidates.__getitem__)
+                if estimate > self._candidates[self._min_item]:
+                    del self._candidates[self._min_item]
+                    self._candidates[item] = estimate
+                    self._min_item = None
+            if self._adds >= self.decay_every:
+                self._decay()
+
+    def _decay(self) -> None:
+        self._adds = 0
+        self._cms.halve()
+        self._candidates = {k: v >> 1 for k, v in self._candidates.items() if v >> 1}
+        self._min_item = None
+
+    def top(self, n: int) -> list[tuple[Hashable, int]]:
+        with self._lock:
+            items = sorted(self._candidates.items(), key=lambda kv: kv[1], reverse=True)
+        return items[:n]
+
+    def seed(self, items: list[tuple[Hashable, int]]) -> None:
+        """Nạp lại snapshot top-K (ví dụ sau khi restart)."""
+        for item, count in items:
+            if count > 0:
+                self.add(item, int(count))
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._candidates)
+
+
+class BloomFilter:
+    """Bloom filter kích thước cố định theo (capacity, error_rate)."""
+
+    def __init__(self, capacity: int = 100000, error_rate: float = 0.001):
+        capacity = max(1, capacity)
+        self.capacity = capacity
+        self.size = max(8, int(-capacity * math.log(error_rate) / (math.log(2) ** 2)))
+        self.hashes = max(1, round(self.size / capacity * math.log(2)))
+        self._bits = bytearray((self.size + 7) // 8)
+        self._count = 0
+        self._lock = threading.Lock()
+
+    def _positions(self, item: Hashable) -> list[int]:
+        h1, h2 = _hash_pair(item)
+        return [(h1 + i * h2) % self.size for i in range(self.hashes)]
+
+    def add(self, item: Hashable) -> None:
+        positions = self._positions(item)
+        with self._lock:
+            for pos in positions:
+                self._bits[pos >> 3] |= 1 << (pos & 7)
+            self._count += 1
+
+    def __contains__(self, item: Hashable) -> bool:
+        bits = self._bits
+        return all(bits[pos >> 3] & (1 << (pos & 7)) for pos in self._positions(item))
+
+    def __len__(self) -> int:
+        """Số lần add (có thể đếm trùng)."""
+        return self._count
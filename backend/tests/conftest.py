@@ -8,7 +8,9 @@ os.environ.setdefault("PAYLOAD_OBFUSCATION_KEY", "ci-test-payload-obfuscation-ke
 import pytest
 import asyncio
 import pytest_asyncio
+from contextlib import contextmanager
 from httpx import AsyncClient, ASGITransport
+import db_stats
 from main import app
 
 
@@ -23,3 +25,16 @@ def event_loop():
 async def client():
     async with AsyncClient(transport=ASGITransport(app=app), base_url="http://localhost") as ac:
         yield ac
+
+
+@pytest.fixture
+def query_budget():
+    """with query_budget(n): ... — fail nếu đoạn code bên trong chạy quá n câu SQL (kèm trace)."""
+    @contextmanager
+    def budget(max_queries: int, label: str = "test"):
+        with db_stats.track(label) as tracker:
+            yield tracker
+        assert tracker.count <= max_queries, (
+            f"Query budget exceeded ({tracker.count} > {max_queries})\n{tracker.report()}"
+        )
+    return budget
@@ -0,0 +1,98 @@
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+import access_recorder
+import database
+import models
+
+
+@pytest.fixture
+def db_session(tmp_path, monkeypatch):
+    engine = create_engine(f"sqlite:///{tmp_path / 'access.db'}")
+    database.Base.metadata.create_all(bind=engine)
+    Session = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+    monkeypatch.setattr(database, "SessionLocal", Session)
+    monkeypatch.setattr(access_recorder, "get_ip_location", lambda ip: {"location": f"geo:{ip}"})
+    access_recorder._queue.clear()
+    access_recorder._last_seen.clear()
+
+    db = Session()
+    db.add_all([models.Nick(username="alice", password="x"), models.Nick(username="bob", password="x")])
+    db.commit()
+    yield db
+    db.close()
+    engine.dispose()
+
+
+def test_dedupe_within_window(db_session):
+    for _ in range(5):
+        access_recorder.record("alice", "1.1.1.1", "ua")
+    assert len(access_recorder._queue) == 1
+
+
+def test_dedupe_map_is_bounded(monkeypatch):
+    monkeypatch.setattr(access_recorder, "_DEDUPE_MAX_USERS", 3)
+    access_recorder._last_seen.clear()
+    for i in range(10):
+        access_recorder.record(f"user{i}")
+    access_recorder._queue.clear()
+    assert len(access_recorder._last_seen) == 3
+
+
+def test_flush_upserts_in_batches(db_session, monkeypatch):
+    monkeypatch.setattr(access_recorder, "_DEDUPE_SECONDS", 0)
+    access_recorder.record("alice", "1.1.1.1", "ua-1")
+    access_recorder.record("alice", "1.1.1.1", "ua-2")
+    access_recorder.record("bob", "2.2.2.2", "ua-b")
+    access_recorder.record("ghost", "3.3.3.3", "")
+    assert access_recorder.flush() == 4
+
+    access_recorder.record("alice", "4.4.4.4", "ua-3")
+    assert access_recorder.flush() == 1
+
+    alice = db_session.query(models.Nick).filter_by(username="alice").one()
+    assert alice.last_ip == "4.4.4.4" and alice.last_location == "geo:4.4.4.4"
+    assert alice.last_active is not None
+
+    access = db_session.query(models.UserAccess).filter_by(user_id=alice.id).all()
+    assert len(access) == 1 and access[0].count == 3
+
+    logs = {log.ip_address: log for log in db_session.query(models.UserIpLog).filter_by(user_id=alice.id)}
+    assert logs["1.1.1.1"].hit_count == 2 and logs["1.1.1.1"].user_agent == "ua-2"
+    assert logs["4.4.4.4"].hit_count == 1
+    assert db_session.query(models.UserIpLog).count() == 3
+
+
+def test_failed_flush_requeues_batch(db_session, monkeypatch):
+    monkeypatch.setattr(access_recorder, "_DEDUPE_SECONDS", 0)
+    monkeypatch.setattr(access_recorder, "_failed_flushes", 0)
+    real_write = access_recorder._write
+
+    def failing_write(db, events):
+        raise RuntimeError("db blip")
+
+    access_recorder.record("alice", "1.1.1.1", "ua")
+    monkeypatch.setattr(access_recorder, "_write", failing_write)
+    dropped_before = access_recorder._m_events.value(result="dropped")
+    assert access_recorder.flush() == 0
+    assert len(access_recorder._queue) == 1
+
+    # Lỗi liên tiếp quá số lần retry → bỏ lô, có đếm
+    monkeypatch.setattr(access_recorder, "_FLUSH_MAX_RETRIES", 1)
+    assert access_recorder.flush() == 0
+    assert len(access_recorder._queue) == 0
+    assert access_recorder._m_events.value(result="dropped") - dropped_before == 1
+
+    access_recorder.record("alice", "2.2.2.2", "ua")
+    monkeypatch.setattr(access_recorder, "_write", real_write)
+    assert access_recorder.flush() == 1
+
+
+def test_requeue_is_bounded(monkeypatch):
+    monkeypatch.setattr(access_recorder, "_QUEUE_MAX", 3)
+    access_recorder._queue.clear()
+    access_recorder._queue.extend([("new", "", "", None, None)] * 2)
+    assert access_recorder._requeue([("old", "", "", None, i) for i in range(3)]) == 2
+    assert [e[0] for e in access_recorder._queue] == ["old", "new", "new"]
+    access_recorder._queue.clear()
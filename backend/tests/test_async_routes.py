@@ -0,0 +1,112 @@
+import pytest
+import pytest_asyncio
+from httpx import ASGITransport, AsyncClient
+from sqlalchemy import create_engine
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+from sqlalchemy.orm import sessionmaker
+
+import cache
+import database
+import models
+import replicas
+import security
+from main import app
+from routers import websocket
+
+
+@pytest_asyncio.fixture
+async def async_db(tmp_path):
+    path = tmp_path / "async.db"
+    sync_engine = create_engine(f"sqlite:///{path}")
+    database.Base.metadata.create_all(bind=sync_engine)
+    db = sessionmaker(bind=sync_engine)()
+    db.add_all([
+        models.Nick(id=1, username="alice", password="x", full_name="Alice"),
+        models.SinhVien(msv="2251120001", ho_ten="Nguyen Van A", ma_lop="K17CNTT1"),
+        models.BangDiem(id=1, msv="2251120001", ma_mon="INT1", ten_mon="Lap trinh", so_tin_chi="3",
+                        tong_ket_10=8.0, tong_ket_4=3.5, hoc_ky="HK1"),
+        models.ChatMessage(user_id=1, message="xin chao"),
+    ])
+    db.commit()
+    db.close()
+    sync_engine.dispose()
+
+    engine = create_async_engine(f"sqlite+aiosqlite:///{path}")
+    Session = async_sessionmaker(engine, expire_on_commit=False)
+
+    async def get_async_db():
+        async with Session() as session:
+            yield session
+
+    admin = security.Principal(id=1, username="alice", role=1, full_name="Alice",
+                               class_change_limit=5, reset_limit_at=None, created_at=None)
+    app.dependency_overrides[replicas.get_async_read_db] = get_async_db
+    app.dependency_overrides[database.get_async_db] = get_async_db
+    app.dependency_overrides[security.get_current_user] = lambda: admin
+    app.dependency_overrides[security.get_optional_user] = lambda: admin
+    cache.clear_all()
+    yield Session
+    app.dependency_overrides.clear()
+    cache.clear_all()
+    await engine.dispose()
+
+
+@pytest.mark.asyncio
+async def test_async_read_routes(async_db, client, query_budget):
+    # Sinh viên + điểm (selectinload): 2 câu; lần sau trúng cache: 0
+    with query_budget(2, "student detail"):
+        detail = await client.get("/api/student/2251120001")
+    with query_budget(0, "student detail (cached)"):
+        assert (await client.get("/api/student/2251120001")).status_code == 200
+    assert detail.status_code == 200
+    student = security.deobfuscate_payload(detail.json())
+    assert student["i"] == "2251120001"
+    assert [d["t"] for d in student["d"]] == ["Lap trinh"]
+
+    with query_budget(2, "search"):
+        search = await client.get("/api/search", params={"query": "Nguyen"})
+    assert search.status_code == 200
+    assert len(security.deobfuscate_payload(search.json())["results"]) == 1
+
+    with query_budget(1, "chat history"):
+        history = await client.get("/api/chat/history")
+    messages = security.deobfuscate_payload(history.json())["messages"]
+    assert [(m["username"], m["message"]) for m in messages] == [("alice", "xin chao")]
+
+    missing = await client.get("/api/student/9999999999")
+    assert missing.status_code == 404
+
+
+@pytest.mark.asyncio
+async def test_chat_message_store_query_budget(async_db, monkeypatch, query_budget):
+    monkeypatch.setattr(database, "AsyncSessionLocal", async_db)
+    sent = []
+
+    async def broadcast(message):
+        sent.append(message)
+
+    monkeypatch.setattr(websocket.manager, "broadcast", broadcast)
+    # Nick người gửi (một lần) + kiểm tra ban + tin gốc kèm người gửi + insert + refresh
+    with query_budget(5, "WS chat_message"):
+        assert await websocket._store_chat_message(None, "alice", None, None, "tra loi", 1)
+
+    assert sent[0]["full_name"] == "Alice"
+    assert sent[0]["reply_metadata"] == {"username": "alice", "full_name": "Alice", "message": "xin chao"}
+    assert sent[0]["id"] > 1
+
+
+@pytest.mark.asyncio
+async def test_unknown_sender_not_matched_by_other_ip_bans(async_db, monkeypatch):
+    monkeypatch.setattr(database, "AsyncSessionLocal", async_db)
+    sent = []
+
+    async def broadcast(message):
+        sent.append(message)
+
+    monkeypatch.setattr(websocket.manager, "broadcast", broadcast)
+    async with async_db() as db:
+        db.add(models.BanRecord(ip_address="10.0.0.9", reason="spam"))
+        await db.commit()
+
+    assert await websocket._store_chat_message(None, "ghost", "10.0.0.1", None, "xin chao", None)
+    assert sent[0]["username"] == "ghost"
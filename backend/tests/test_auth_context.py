@@ -0,0 +1,69 @@
+import pytest
+from jose import JWTError
+from starlette.requests import Request
+
+import cache
+import security
+
+
+@pytest.fixture(autouse=True)
+def clean_state():
+    cache.clear_all()
+    security._verified_tokens.clear()
+    yield
+    cache.clear_all()
+    security._verified_tokens.clear()
+
+
+def _request(token=None):
+    headers = [(b"authorization", f"Bearer {token}".encode())] if token else []
+    return Request({"type": "http", "method": "GET", "path": "/", "headers": headers, "query_string": b""})
+
+
+def _count_decodes(monkeypatch):
+    calls = []
+    real_decode = security.jwt.decode
+
+    def counting_decode(*args, **kwargs):
+        calls.append(1)
+        return real_decode(*args, **kwargs)
+
+    monkeypatch.setattr(security.jwt, "decode", counting_decode)
+    return calls
+
+
+def test_token_is_decoded_once_across_requests(monkeypatch):
+    calls = _count_decodes(monkeypatch)
+    token = security.create_access_token({"sub": "alice", "role": 0})
+
+    for _ in range(3):
+        assert security.get_auth_context(_request(token)).username == "alice"
+    assert len(calls) == 1
+
+
+def test_context_is_memoized_on_request_state():
+    token = security.create_access_token({"sub": "alice"})
+    request = _request(token)
+    assert security.get_auth_context(request) is security.get_auth_context(request)
+    assert request.state.auth.authenticated
+
+
+def test_invalid_and_missing_tokens():
+    assert security.get_auth_context(_request()).username is None
+    ctx = security.get_auth_context(_request("not-a-jwt"))
+    assert ctx.token == "not-a-jwt" and ctx.claims is None and not ctx.authenticated
+    with pytest.raises(JWTError):
+        security.decode_token("not-a-jwt")
+
+
+def test_revoked_token_is_not_authenticated(monkeypatch):
+    calls = _count_decodes(monkeypatch)
+    token = security.create_access_token({"sub": "alice"})
+    assert security.get_auth_context(_request(token)).authenticated
+
+    security.revoke_token(token)
+    ctx = security.get_auth_context(_request(token))
+    assert ctx.username == "alice"
+    assert ctx.revoked and not ctx.authenticated
+    # Revoke bỏ token khỏi LRU nên lần sau phải verify lại
+    assert len(calls) == 2
@@ -0,0 +1,85 @@
+import threading
+
+import background
+
+
+def _blocking_queue(name, **kwargs):
+    q = background.JobQueue(name, **kwargs)
+    gate = threading.Event()
+    started = threading.Event()
+
+    def blocker():
+        started.set()
+        gate.wait(5)
+
+    q.submit(blocker)
+    started.wait(5)
+    return q, gate
+
+
+def test_bounded_queue_drops_new_jobs():
+    q, gate = _blocking_queue("test-drop", max_size=2)
+    ran = []
+    assert q.submit(ran.append, 1)
+    assert q.submit(ran.append, 2)
+    assert q.submit(ran.append, 3) is False
+    gate.set()
+    assert q.drain(5)
+    assert ran == [1, 2]
+    q.close(5)
+
+
+def test_drop_oldest_policy_keeps_latest_jobs():
+    q, gate = _blocking_queue("test-oldest", max_size=2, policy="drop_oldest")
+    ran = []
+    for i in range(4):
+        assert q.submit(ran.append, i)
+    gate.set()
+    q.drain(5)
+    assert ran == [2, 3]
+    q.close(5)
+
+
+def test_jobs_with_same_key_are_coalesced():
+    q, gate = _blocking_queue("test-coalesce")
+    ran = []
+    assert q.submit(ran.append, "a", key="warm")
+    assert q.submit(ran.append, "b", key="warm") is False
+    gate.set()
+    q.drain(5)
+    assert ran == ["a"]
+    # Sau khi chạy xong, key được nhận lại
+    assert q.submit(ran.append, "c", key="warm")
+    q.drain(5)
+    assert ran == ["a", "c"]
+    q.close(5)
+
+
+def test_close_drains_pending_jobs_and_rejects_new_ones():
+    q, gate = _blocking_queue("test-close")
+    ran = []
+    q.submit(ran.append, 1)
+    gate.set()
+    assert q.close(5)
+    assert ran == [1]
+    assert q.submit(ran.append, 2) is False
+
+
+def test_failing_job_does_not_kill_worker():
+    q = background.JobQueue("test-errors")
+    ran = []
+    q.submit(lambda: 1 / 0)
+    q.submit(ran.append, "after")
+    q.drain(5)
+    assert ran == ["after"]
+    assert background._m_jobs.value(queue="test-errors", result="error") == 1
+    q.close(5)
+
+
+def test_periodic_job_runs_on_its_queue():
+    ticked = threading.Event()
+    background.every("test-tick", 60, ticked.set, queue_name="test-periodic", initial_delay=0)
+    try:
+        assert ticked.wait(5)
+    finally:
+        background._periodic.pop("test-tick", None)
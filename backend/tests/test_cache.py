@@ -0,0 +1,98 @@
+import pytest
+
+import cache
+import response_cache
+
+
+@pytest.fixture(autouse=True)
+def clean_cache():
+    cache.clear_all()
+    yield
+    cache.clear_all()
+
+
+@pytest.mark.asyncio
+async def test_async_api_shares_memory_store_with_sync_api():
+    await cache.aset("student:1:role0", "payload", ttl=60)
+    assert cache.get("student:1:role0") == "payload"
+
+    cache.set("class:v7:A:role0", ["x"], ttl=60)
+    assert await cache.aget("class:v7:A:role0") == ["x"]
+
+
+@pytest.mark.asyncio
+async def test_async_pop_is_one_shot():
+    await cache.aset("ws_ticket:abc", "alice", ttl=60)
+    assert await cache.apop("ws_ticket:abc") == "alice"
+    assert await cache.apop("ws_ticket:abc") is None
+
+
+@pytest.mark.asyncio
+async def test_async_delete_prefix():
+    await cache.aset("search:v4:a:role0", 1, ttl=60)
+    await cache.aset("search:v4:b:role0", 2, ttl=60)
+    await cache.aset("student:1:role0", 3, ttl=60)
+    await cache.adelete_prefix("search:")
+    assert await cache.aget("search:v4:a:role0") is None
+    assert await cache.aget("student:1:role0") == 3
+
+
+def test_namespace_stats_track_hits_misses_and_sets():
+    before = cache.namespace_stats().get("search", {})
+    cache.set("search:v4:abc:role0", "payload", ttl=60)
+    assert cache.get("search:v4:abc:role0") == "payload"
+    assert cache.get("search:v4:missing:role0") is None
+
+    after = cache.namespace_stats()["search"]
+    assert after["hits"] - before.get("hits", 0) == 1
+    assert after["misses"] - before.get("misses", 0) == 1
+    assert after["sets"] - before.get("sets", 0) == 1
+    assert after["memory_keys"] == 1
+    assert "get_latency_ms" in after
+
+
+def test_stats_include_namespaces():
+    cache.set("rl:search:1.2.3.4", [1.0], ttl=60)
+    assert "rl" in cache.stats()["namespaces"]
+
+
+@pytest.mark.asyncio
+async def test_metrics_endpoint_renders_cache_counters(client):
+    cache.set("student:1:role0", "x", ttl=60)
+    response = await client.get("/metrics")
+    assert response.status_code == 200
+    assert 'cache_sets_total{namespace="student"}' in response.text
+
+
+def test_rate_limit_burst_does_not_evict_rendered_entries():
+    cache.set("class:v7:A:role0", ["rows"], ttl=60)
+    cache.set("student:1:role0", "payload", ttl=60)
+    quota = cache._NAMESPACE_POLICIES["rl"][0]
+    for i in range(quota + 500):
+        cache.set(f"rl:search:10.0.{i // 256}.{i % 256}", [1.0], ttl=60)
+
+    assert cache.get("class:v7:A:role0") == ["rows"]
+    assert cache.get("student:1:role0") == "payload"
+    partitions = cache.stats()["partitions"]
+    assert partitions["rl"]["keys"] == quota
+
+
+def test_lru_partition_keeps_recently_read_entries(monkeypatch):
+    monkeypatch.setitem(cache._NAMESPACE_POLICIES, "search", (2, "lru", 300))
+    cache.set("search:v4:a:role0", 1)
+    cache.set("search:v4:b:role0", 2)
+    assert cache.get("search:v4:a:role0") == 1
+    cache.set("search:v4:c:role0", 3)
+    assert cache.get("search:v4:a:role0") == 1
+    assert cache.get("search:v4:b:role0") is None
+
+
+def test_response_cache_entry_size_counts_encoded_variants():
+    entry = response_cache.encode({"rows": ["x" * 40] * 1000})
+    expected = sum(len(v) for v in entry if v is not None)
+    before = cache.namespace_stats().get("student", {}).get("set_bytes", 0)
+    cache.set("student:size:role0", entry, ttl=60)
+
+    stats = cache.namespace_stats()["student"]
+    assert stats["set_bytes"] - before == expected > 40_000
+    assert stats["memory_bytes"] == expected
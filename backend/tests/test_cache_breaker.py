@@ -0,0 +1,103 @@
+import pytest
+import redis
+
+import cache
+
+
+class FakeRedis:
+    def __init__(self, healthy=True):
+        self.healthy = healthy
+        self.data = {}
+
+    def _check(self):
+        if not self.healthy:
+            raise redis.exceptions.ConnectionError("connection refused")
+
+    def ping(self):
+        self._check()
+        return True
+
+    def get(self, key):
+        self._check()
+        return self.data.get(key)
+
+    def setex(self, key, ttl, value):
+        self._check()
+        self.data[key] = value
+
+
+@pytest.fixture
+def breaker(monkeypatch):
+    monkeypatch.setattr(cache, "_redis_configured", True)
+    monkeypatch.setattr(cache, "_redis_client", None)
+    monkeypatch.setattr(cache, "_breaker_state", cache._BREAKER_OPEN)
+    monkeypatch.setattr(cache, "_breaker_failures", 0)
+    monkeypatch.setattr(cache, "_breaker_probe_failures", 0)
+    monkeypatch.setattr(cache, "_breaker_opened_at", 0.0)
+    monkeypatch.setattr(cache, "_next_probe_at", 0.0)
+    server = FakeRedis(healthy=False)
+    monkeypatch.setattr(cache.redis.Redis, "from_url", staticmethod(lambda *a, **kw: server))
+    yield server
+    cache._redis_client = None
+    cache._redis_configured = None
+    cache._breaker_state = cache._BREAKER_DISABLED
+    cache._next_probe_at = 0.0
+
+
+def test_failed_probe_opens_breaker_with_backoff(breaker):
+    cache.set("student:1:role0", "x", ttl=60)
+    info = cache.breaker_stats()
+    assert info["state"] == "open"
+    assert info["next_probe_in_seconds"] > 0
+    # Still served from memory while Redis is down
+    assert cache.get("student:1:role0") == "x"
+
+
+def test_breaker_promotes_back_when_redis_recovers(breaker):
+    cache._ensure_redis_client()
+    assert cache.breaker_stats()["state"] == "open"
+
+    breaker.healthy = True
+    cache._next_probe_at = 0.0
+    cache.set("student:2:role0", "y", ttl=60)
+    assert cache.breaker_stats()["state"] == "closed"
+    assert cache.get("student:2:role0") == "y"
+    assert "student:2:role0" in breaker.data
+
+
+def test_repeated_connection_errors_trip_breaker(breaker):
+    breaker.healthy = True
+    cache._ensure_redis_client()
+    assert cache.breaker_stats()["state"] == "closed"
+
+    breaker.healthy = False
+    for _ in range(cache._REDIS_FAILURE_THRESHOLD):
+        cache.get("student:3:role0")
+    assert cache.breaker_stats()["state"] == "open"
+    assert cache._redis_client is None
+
+
+def test_outage_revocations_are_replayed_into_redis(breaker):
+    cache.set("revoked_token:abc", True, ttl=600)
+    cache.set("student:4:role0", "z", ttl=60)
+    assert cache.breaker_stats()["state"] == "open"
+
+    breaker.healthy = True
+    cache._next_probe_at = 0.0
+    assert cache.get("revoked_token:abc") is True
+    assert cache.breaker_stats()["state"] == "closed"
+    assert "revoked_token:abc" in breaker.data
+    assert "student:4:role0" not in breaker.data
+
+
+def test_failed_first_probe_counts_as_trip(breaker):
+    cache._breaker_state = cache._BREAKER_DISABLED
+    trips = cache.breaker_stats()["trips"]
+    cache._ensure_redis_client()
+    assert cache.breaker_stats()["state"] == "open"
+    assert cache.breaker_stats()["trips"] == trips + 1
+
+    # Probe lại khi vẫn OPEN không phải trip mới
+    cache._next_probe_at = 0.0
+    cache._ensure_redis_client()
+    assert cache.breaker_stats()["trips"] == trips + 1
@@ -0,0 +1,34 @@
+import pickle
+from datetime import datetime
+
+import cache_codec
+
+
+def test_plain_values_round_trip():
+    for value in ["payload", 42, 1.5, True, None, [1.0, 2.0], {"a": [1, "b"]}, b"\x00raw"]:
+        assert cache_codec.decode(cache_codec.encode(value)) == value
+
+
+def test_large_values_are_compressed():
+    value = "x" * 50_000
+    raw = cache_codec.encode(value)
+    assert raw[0] >> 4 != cache_codec.COMPRESS_NONE
+    assert len(raw) < 5_000
+    assert cache_codec.decode(raw) == value
+
+
+def test_small_values_are_not_compressed():
+    raw = cache_codec.encode("short")
+    assert raw[0] >> 4 == cache_codec.COMPRESS_NONE
+
+
+def test_non_plain_values_fall_back_to_pickle():
+    value = datetime(2026, 1, 2, 3, 4, 5)
+    raw = cache_codec.encode(value)
+    assert raw[0] & 0x0F == cache_codec.CODEC_PICKLE
+    assert cache_codec.decode(raw) == value
+
+
+def test_legacy_raw_pickle_entries_still_decode():
+    raw = pickle.dumps(["legacy"], protocol=pickle.HIGHEST_PROTOCOL)
+    assert cache_codec.decode(raw) == ["legacy"]
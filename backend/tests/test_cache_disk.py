@@ -0,0 +1,71 @@
+import threading
+import time
+
+import pytest
+
+import cache
+import cache_disk
+
+
+@pytest.fixture
+def disk_tier(tmp_path, monkeypatch):
+    monkeypatch.setattr(cache_disk, "_PATH", str(tmp_path / "cache.sqlite3"))
+    cache.clear_all()
+    yield
+    cache.clear_all()
+
+
+def test_rendered_payload_survives_memory_loss(disk_tier):
+    cache.set("class:v7:A:role0", {"rows": [1, 2]}, ttl=60)
+    cache._mem_clear_all()  # giả lập restart: memory tier trống
+
+    assert cache.get("class:v7:A:role0") == {"rows": [1, 2]}
+    # Hit từ disk được nạp lại vào memory
+    assert cache._mem_get("class:v7:A:role0") == {"rows": [1, 2]}
+
+
+def test_bookkeeping_namespaces_stay_in_memory(disk_tier):
+    cache.set("rl:search:1.2.3.4", [1.0], ttl=60)
+    assert cache_disk.get("rl:search:1.2.3.4") is None
+    assert cache.get("rl:search:1.2.3.4") == [1.0]
+
+
+def test_disk_entries_keep_their_ttl(disk_tier):
+    cache_disk.set("student:1:role0", "payload", ttl=60)
+    cache_disk._connect().execute(
+        "UPDATE cache_entries SET expire_at = ? WHERE key = ?", (time.time() - 1, "student:1:role0")
+    )
+    assert cache.get("student:1:role0") is None
+    assert cache_disk.purge() == 1
+
+
+def test_invalidation_reaches_disk(disk_tier):
+    cache.set("class:v7:A:role0", "a", ttl=60)
+    cache.set("class:v7:B:role0", "b", ttl=60)
+    cache.set("student:1:role0", "s", ttl=60)
+    cache.delete_prefix("class:")
+    cache._mem_clear_all()
+
+    assert cache.get("class:v7:A:role0") is None
+    assert cache.get("class:v7:B:role0") is None
+    assert cache.get("student:1:role0") == "s"
+
+
+def test_pop_removes_disk_entry(disk_tier):
+    cache.set("revoked_token:abc", True, ttl=60)
+    cache._mem_clear_all()
+    assert cache.pop("revoked_token:abc") is True
+    assert cache.get("revoked_token:abc") is None
+
+
+async def test_async_api_reads_disk_off_the_event_loop(disk_tier, monkeypatch):
+    await cache.aset("student:2:role0", "payload", ttl=60)
+    cache._mem_clear_all()
+
+    loop_thread = threading.get_ident()
+    seen = []
+    real_get = cache_disk.get
+    monkeypatch.setattr(cache_disk, "get", lambda key: seen.append(threading.get_ident()) or real_get(key))
+
+    assert await cache.aget("student:2:role0") == "payload"
+    assert seen and loop_thread not in seen
@@ -0,0 +1,89 @@
+import cache
+import cache_warmer
+import security
+from sketches import CountMinSketch, HeavyHitters
+
+
+def test_count_min_sketch_never_underestimates():
+    cms = CountMinSketch(width=64, depth=4)
+    for i in range(200):
+        cms.add(("student", str(i % 20), 0))
+    for i in range(20):
+        assert cms.estimate(("student", str(i), 0)) >= 10
+
+
+def test_heavy_hitters_keeps_most_popular_items():
+    hh = HeavyHitters(capacity=4, width=256)
+    for _ in range(50):
+        hh.add(("class", "A", 0))
+    for _ in range(30):
+        hh.add(("class", "B", 0))
+    for i in range(40):
+        hh.add(("student", str(i), 0))
+    top = [item for item, _ in hh.top(2)]
+    assert top == [("class", "A", 0), ("class", "B", 0)]
+
+
+def test_warm_recomputes_popular_entries_missing_from_cache(monkeypatch):
+    loaded = []
+
+    def loader(db, name, role):
+        loaded.append((name, role))
+        cache.set(f"test_warm:{name}:role{role}", "payload", ttl=60)
+
+    class FakeSession:
+        def close(self):
+            pass
+
+        def rollback(self):
+            pass
+
+    monkeypatch.setattr(cache_warmer.database, "SessionLocal", FakeSession)
+    monkeypatch.setattr(cache_warmer, "_loaders", {})
+    monkeypatch.setattr(cache_warmer, "_popularity", HeavyHitters(capacity=16))
+    monkeypatch.setattr(cache_warmer, "_PAUSE_SECONDS", 0)
+    cache_warmer.register("test_warm", lambda name, role: f"test_warm:{name}:role{role}", loader)
+
+    for _ in range(5):
+        cache_warmer.record("test_warm", "hot", 0)
+    cache_warmer.record("test_warm", "cold", 0)
+    cache.set("test_warm:cold:role0", "already cached", ttl=60)
+
+    assert cache_warmer.warm("test", limit=10) == 1
+    assert loaded == [("hot", 0)]
+    assert cache.get("test_warm:hot:role0") == "payload"
+
+
+def test_warm_fills_plain_variant_recorded_by_internal_channel(monkeypatch):
+    loaded = []
+
+    def key(name):
+        return security.payload_cache_key(f"test_warm_plain:{name}")
+
+    def loader(db, name):
+        loaded.append((name, security.plain_payloads()))
+        cache.set(key(name), security.obfuscate_payload({"name": name}), ttl=60)
+
+    class FakeSession:
+        def close(self):
+            pass
+
+        def rollback(self):
+            pass
+
+    monkeypatch.setattr(cache_warmer.database, "SessionLocal", FakeSession)
+    monkeypatch.setattr(cache_warmer, "_loaders", {})
+    monkeypatch.setattr(cache_warmer, "_popularity", HeavyHitters(capacity=16))
+    monkeypatch.setattr(cache_warmer, "_PAUSE_SECONDS", 0)
+    cache_warmer.register("test_warm_plain", key, loader)
+
+    token = security.set_plain_payloads(True)
+    try:
+        cache_warmer.record("test_warm_plain", "bff")
+    finally:
+        security.reset_plain_payloads(token)
+
+    assert cache_warmer.warm("test", limit=10) == 1
+    assert loaded == [("bff", True)]
+    assert cache.get("test_warm_plain:bff:plain") == {"name": "bff"}
+    assert cache.get("test_warm_plain:bff") is None
@@ -0,0 +1,56 @@
+import pytest
+from sqlalchemy import text
+
+import database
+import db_stats
+import metrics
+
+
+def test_normalize_sql_strips_literals_and_collapses_in_lists():
+    sql = """
+        SELECT nick.id FROM nick
+        WHERE nick.username = 'alice' AND nick.id IN (%(id_1)s, %(id_2)s, %(id_3)s)
+          AND he_so_1_l1 > 7.5 LIMIT 50
+    """
+    assert db_stats.normalize_sql(sql) == (
+        "SELECT nick.id FROM nick WHERE nick.username = ? AND nick.id IN (...) AND he_so_1_l1 > ? LIMIT ?"
+    )
+
+
+def test_engine_records_pool_and_slow_queries(tmp_path, monkeypatch, caplog):
+    monkeypatch.setattr(db_stats, "SLOW_QUERY_MS", 0)
+    engine = database.make_engine(f"sqlite:///{tmp_path / 'stats.db'}", "test-stats")
+
+    with engine.connect() as conn:
+        conn.execute(text("SELECT :secret"), {"secret": "hunter2"})
+        assert db_stats.stats()["pools"]["test-stats"]["in_use"] == 1
+
+    stats = db_stats.stats()
+    pool = stats["pools"]["test-stats"]
+    assert pool["in_use"] == 0 and pool["checkouts"] >= 1 and pool["checkout_wait"]["count"] >= 1
+    assert stats["queries"]["test-stats:select"]["count"] >= 1
+    slow = [q for q in stats["slow_queries"] if q["engine"] == "test-stats"]
+    assert slow[0]["sql"] == "SELECT ?" and slow[0]["params"] == "1"
+    assert "hunter2" not in caplog.text
+    assert 'db_pool_connections{engine="test-stats",state="idle"}' in metrics.render()
+
+
+def test_query_errors_are_classified(tmp_path):
+    engine = database.make_engine(f"sqlite:///{tmp_path / 'errors.db'}", "test-errors")
+    with engine.connect() as conn, pytest.raises(Exception):
+        conn.execute(text("SELECT * FROM missing_table"))
+    assert db_stats.stats()["errors"]["test-errors:error"] == 1
+
+
+def test_check_budget_reports_repeated_statements(tmp_path, caplog):
+    engine = database.make_engine(f"sqlite:///{tmp_path / 'budget.db'}", "test-budget")
+    with db_stats.track("GET /n-plus-one") as tracker, engine.connect() as conn:
+        for i in range(4):
+            conn.execute(text("SELECT :i"), {"i": i})
+
+    assert tracker.count == 4
+    assert tracker.repeated() == [("SELECT ?", 4)]
+    assert db_stats.check_budget(tracker, budget=4)
+    assert not db_stats.check_budget(tracker, budget=3)
+    assert "[QUERY BUDGET] GET /n-plus-one: 4 statements" in caplog.text
+    assert "4x SELECT ?" in caplog.text
@@ -0,0 +1,36 @@
+import re
+
+import pytest
+
+import security
+
+_MSV_TOKEN = re.compile(r"^T_[A-Za-z0-9_-]{20,512}$")
+
+
+def test_tokens_are_deterministic_and_versioned():
+    token = security.obfuscate_id("2251120001")
+    assert token == security.obfuscate_id("2251120001")
+    assert token.startswith("T_2")
+    assert _MSV_TOKEN.match(token)
+    assert security.obfuscate_id("2251120002") != token
+    assert security.deobfuscate_id(token, force_obfuscated=True) == "2251120001"
+
+
+def test_legacy_fernet_tokens_still_resolve():
+    legacy = "T_" + security._id_fernet.encrypt(b"2251120001").decode().replace("=", "")
+    assert legacy.startswith("T_g")
+    assert security.deobfuscate_id(legacy, force_obfuscated=True) == "2251120001"
+
+
+def test_tampered_token_is_rejected():
+    token = security.obfuscate_id("2251120001")
+    tampered = token[:-2] + ("AA" if token[-2:] != "AA" else "BB")
+    with pytest.raises(ValueError):
+        security.deobfuscate_id(tampered, force_obfuscated=True)
+    assert security.deobfuscate_id(tampered) == tampered
+
+
+def test_plain_msv_requires_token_when_forced():
+    assert security.deobfuscate_id("2251120001") == "2251120001"
+    with pytest.raises(ValueError):
+        security.deobfuscate_id("2251120001", force_obfuscated=True)
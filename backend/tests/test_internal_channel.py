@@ -0,0 +1,88 @@
+import hashlib
+import hmac
+import time
+
+import pytest
+from fastapi import FastAPI
+from httpx import ASGITransport, AsyncClient
+
+import security
+from middleware import RequestGuardMiddleware
+
+_SECRET = b"internal-test-secret"
+
+
+@pytest.fixture(autouse=True)
+def internal_secret(monkeypatch):
+    monkeypatch.setattr(security, "_INTERNAL_API_SECRET", _SECRET)
+
+
+def _sign(ts=None, secret=_SECRET, method="GET", path="/payload", query="") -> str:
+    ts = str(int(time.time()) if ts is None else ts)
+    message = f"{ts}\n{method}\n{path}\n{query}".encode()
+    return f"{ts}.{hmac.new(secret, message, hashlib.sha256).hexdigest()}"
+
+
+def _app() -> FastAPI:
+    app = FastAPI()
+
+    @app.get("/payload")
+    def payload():
+        return {"key": security.payload_cache_key("student:1:role0"),
+                "body": security.obfuscate_payload({"count": 3})}
+
+    app.add_middleware(RequestGuardMiddleware)
+    return app
+
+
+async def _get(headers=None, url="/payload"):
+    async with AsyncClient(transport=ASGITransport(app=_app()), base_url="http://localhost") as ac:
+        return (await ac.get(url, headers=headers)).json()
+
+
+def test_verify_internal_auth():
+    assert security.verify_internal_auth(_sign(), "GET", "/payload")
+    assert not security.verify_internal_auth(_sign(secret=b"wrong"), "GET", "/payload")
+    assert not security.verify_internal_auth(_sign(ts=int(time.time()) - 60), "GET", "/payload")
+    assert not security.verify_internal_auth("garbage", "GET", "/payload")
+
+
+def test_signature_is_bound_to_method_and_path():
+    assert not security.verify_internal_auth(_sign(), "POST", "/payload")
+    assert not security.verify_internal_auth(_sign(), "GET", "/api/admin/users")
+
+
+def test_signature_is_bound_to_query_string():
+    signed = _sign(path="/api/search", query="query=nguyen")
+    assert security.verify_internal_auth(signed, "GET", "/api/search", "query=nguyen")
+    assert not security.verify_internal_auth(signed, "GET", "/api/search", "query=tran")
+    assert not security.verify_internal_auth(signed, "GET", "/api/search")
+
+
+def test_disabled_without_secret(monkeypatch):
+    monkeypatch.setattr(security, "_INTERNAL_API_SECRET", b"")
+    assert not security.verify_internal_auth(_sign(), "GET", "/payload")
+
+
+@pytest.mark.asyncio
+async def test_signed_request_gets_plain_payload():
+    data = await _get({"X-Internal-Auth": _sign()})
+    assert data == {"key": "student:1:role0:plain", "body": {"count": 3}}
+    assert not security.plain_payloads()
+
+
+@pytest.mark.asyncio
+async def test_unsigned_request_keeps_encrypted_payload():
+    for headers in (None, {"X-Internal-Auth": _sign(secret=b"wrong")},
+                    {"X-Internal-Auth": _sign(path="/other")}):
+        data = await _get(headers)
+        assert data["key"] == "student:1:role0"
+        assert security.deobfuscate_payload(data["body"]) == {"count": 3}
+
+
+@pytest.mark.asyncio
+async def test_replayed_header_with_other_query_stays_encrypted():
+    signed = {"X-Internal-Auth": _sign(query="id=1")}
+    assert (await _get(signed, "/payload?id=1"))["body"] == {"count": 3}
+    data = await _get(signed, "/payload?id=2")
+    assert security.deobfuscate_payload(data["body"]) == {"count": 3}
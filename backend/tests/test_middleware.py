@@ -0,0 +1,67 @@
+import pytest
+from fastapi import FastAPI, Request
+from fastapi.responses import StreamingResponse
+from httpx import ASGITransport, AsyncClient
+
+from middleware import RequestGuardMiddleware
+
+
+def _app(max_body_bytes: int = 16) -> FastAPI:
+    app = FastAPI()
+
+    @app.post("/echo")
+    async def echo(request: Request):
+        return {"size": len(await request.body())}
+
+    @app.get("/stream")
+    async def stream():
+        async def chunks():
+            for i in range(3):
+                yield f"chunk-{i};".encode()
+        return StreamingResponse(chunks(), media_type="text/plain")
+
+    app.add_middleware(RequestGuardMiddleware, max_body_bytes=max_body_bytes)
+    return app
+
+
+def _client(app) -> AsyncClient:
+    return AsyncClient(transport=ASGITransport(app=app), base_url="http://localhost")
+
+
+@pytest.mark.asyncio
+async def test_security_headers_on_app_responses(client):
+    response = await client.get("/health")
+    assert response.status_code == 200
+    assert response.headers["x-frame-options"] == "DENY"
+    assert "frame-ancestors 'none'" in response.headers["content-security-policy"]
+    assert response.headers.get_list("x-content-type-options") == ["nosniff"]
+
+
+@pytest.mark.asyncio
+async def test_streaming_response_passes_through():
+    async with _client(_app()) as ac:
+        response = await ac.get("/stream")
+    assert response.text == "chunk-0;chunk-1;chunk-2;"
+    assert response.headers["referrer-policy"] == "strict-origin-when-cross-origin"
+
+
+@pytest.mark.asyncio
+async def test_body_limit_enforced_without_content_length():
+    async def body():
+        for _ in range(4):
+            yield b"x" * 8
+
+    async with _client(_app()) as ac:
+        small = await ac.post("/echo", content=b"x" * 16)
+        chunked = await ac.post("/echo", content=body())
+    assert small.json() == {"size": 16}
+    assert chunked.status_code == 413
+    assert chunked.json() == {"detail": "Payload too large"}
+
+
+@pytest.mark.asyncio
+async def test_declared_content_length_rejected_early():
+    async with _client(_app()) as ac:
+        response = await ac.post("/echo", content=b"x" * 64)
+    assert response.status_code == 413
+    assert response.headers["x-frame-options"] == "DENY"
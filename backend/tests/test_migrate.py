@@ -0,0 +1,92 @@
+from sqlalchemy import create_engine, event, inspect, text
+
+import background
+import database
+import migrate
+
+
+def _engine(tmp_path):
+    return create_engine(f"sqlite:///{tmp_path / 'schema.db'}")
+
+
+def test_fresh_database_reaches_head_then_boots_with_one_query(tmp_path):
+    engine = _engine(tmp_path)
+    assert migrate.run(engine)
+    status = migrate.status()
+    assert status["version"] == migrate.HEAD and status["pending"] == []
+    assert {"nick", "user_ip_log", "hidden_subject_rules", "schema_migrations"} <= set(inspect(engine).get_table_names())
+
+    statements = []
+    event.listen(engine, "before_cursor_execute", lambda *args: statements.append(args[2]))
+    assert migrate.run(engine)
+    assert len(statements) == 1 and "schema_migrations" in statements[0]
+
+
+def test_legacy_schema_is_upgraded(tmp_path):
+    engine = _engine(tmp_path)
+    with engine.begin() as conn:
+        conn.execute(text("CREATE TABLE nick (id INTEGER PRIMARY KEY, created_at TIMESTAMP, "
+                          "username TEXT NOT NULL, password TEXT NOT NULL, role INTEGER NOT NULL)"))
+        conn.execute(text("CREATE TABLE user_access (id INTEGER PRIMARY KEY, user_id BIGINT NOT NULL, "
+                          "access_date DATE NOT NULL, last_update TIMESTAMP, count INTEGER)"))
+        conn.execute(text("INSERT INTO user_access (user_id, access_date, count) VALUES "
+                          "(1, '2026-01-01', 2), (1, '2026-01-01', 3), (2, '2026-01-01', 1)"))
+
+    assert migrate.run(engine)
+    inspector = inspect(engine)
+    assert {"full_name", "last_ip", "class_change_limit"} <= {c["name"] for c in inspector.get_columns("nick")}
+    with engine.connect() as conn:
+        rows = conn.execute(text("SELECT user_id, count FROM user_access ORDER BY user_id")).all()
+    assert [tuple(r) for r in rows] == [(1, 5), (2, 1)]
+
+
+def test_checksum_mismatch_is_not_ready(tmp_path):
+    engine = _engine(tmp_path)
+    assert migrate.run(engine)
+    with engine.begin() as conn:
+        conn.execute(text("UPDATE schema_migrations SET checksum = 'edited' WHERE version = 3"))
+
+    assert not migrate.run(engine)
+    assert migrate.status()["checksum_mismatch"] == [3]
+
+
+def test_readiness_recovers_when_database_comes_up_later(tmp_path, monkeypatch):
+    engine = _engine(tmp_path)
+    real_connect = engine.connect
+    attempts = []
+
+    def flaky_connect():
+        attempts.append(1)
+        if len(attempts) == 1:
+            raise ConnectionRefusedError("connection refused")
+        return real_connect()
+
+    waits = []
+    monkeypatch.setattr(engine, "connect", flaky_connect)
+    monkeypatch.setattr(background, "sleep", lambda seconds: waits.append(seconds) or False)
+
+    assert migrate.run_until_ready(engine)
+    assert migrate.ready() and migrate.status()["error"] is None
+    assert len(attempts) == 2 and waits == [migrate._RETRY_BASE_SECONDS]
+
+
+def test_checksum_covers_spec_not_source():
+    def reformatted(conn, spec):  # source khác hẳn, cùng spec
+        pass
+
+    original = migrate.MIGRATIONS[1]
+    assert migrate.Migration(2, "legacy_columns", fn=reformatted, spec=migrate._LEGACY_COLUMNS).checksum == original.checksum
+    changed = {**migrate._LEGACY_COLUMNS, "nick": migrate._LEGACY_COLUMNS["nick"] + (("nickname", "TEXT"),)}
+    assert migrate.Migration(2, "legacy_columns", fn=reformatted, spec=changed).checksum != original.checksum
+    # Migration 1 tạo đúng tập bảng cố định, không theo Base.metadata lúc chạy
+    assert set(migrate._BASELINE_TABLES) <= set(database.Base.metadata.tables)
+
+
+def test_legacy_source_checksums_are_accepted(tmp_path):
+    engine = _engine(tmp_path)
+    assert migrate.run(engine)
+    with engine.begin() as conn:
+        for m in migrate.MIGRATIONS:
+            conn.execute(text("UPDATE schema_migrations SET checksum = :c WHERE version = :v"),
+                         {"c": m.accepted[-1], "v": m.version})
+    assert migrate.run(engine)
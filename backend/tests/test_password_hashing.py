@@ -0,0 +1,59 @@
+import threading
+
+import pytest
+from fastapi import HTTPException
+from passlib.context import CryptContext
+
+import security
+
+
+@pytest.fixture
+def fast_bcrypt(monkeypatch):
+    monkeypatch.setattr(security, "pwd_context", CryptContext(schemes=["bcrypt"], deprecated="auto", bcrypt__rounds=4))
+
+
+def test_hash_and_verify_run_on_executor(fast_bcrypt):
+    before = security._m_hash_latency.snapshot(op="verify")["count"]
+    hashed = security.get_password_hash("correct horse")
+    assert security.verify_password("correct horse", hashed) is True
+    assert security.verify_password("wrong", hashed) is False
+    assert security._m_hash_latency.snapshot(op="verify")["count"] - before == 2
+
+
+async def test_async_hashing_releases_slots(fast_bcrypt):
+    hashed = await security.aget_password_hash("correct horse")
+    assert await security.averify_and_rehash("correct horse", hashed) == (True, None)
+    assert (await security.averify_and_rehash("wrong", hashed))[0] is False
+    assert security._m_hash_in_flight.samples().get((), 0) == 0
+
+
+def test_rehash_when_cost_changes(fast_bcrypt, monkeypatch):
+    old_hash = CryptContext(schemes=["bcrypt"], bcrypt__rounds=5).hash("secret-pass")
+    ok, new_hash = security.verify_and_rehash("secret-pass", old_hash)
+    assert ok and new_hash and new_hash.startswith("$2b$04$")
+
+    ok, again = security.verify_and_rehash("secret-pass", new_hash)
+    assert ok and again is None
+
+
+def test_full_queue_sheds_with_429(fast_bcrypt, monkeypatch):
+    monkeypatch.setattr(security, "_hash_slots", threading.BoundedSemaphore(1))
+    release = threading.Event()
+    started = threading.Event()
+
+    def slow(_):
+        started.set()
+        release.wait(5)
+        return "done"
+
+    worker = threading.Thread(target=lambda: security._run_hashing("hash", slow, "x"))
+    worker.start()
+    started.wait(5)
+    try:
+        with pytest.raises(HTTPException) as exc:
+            security.get_password_hash("another password")
+        assert exc.value.status_code == 429
+    finally:
+        release.set()
+        worker.join(5)
+    assert security.get_password_hash("another password")
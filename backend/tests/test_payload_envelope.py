@@ -0,0 +1,30 @@
+import json
+import zlib
+
+import security
+
+
+def _plaintext(token: str) -> bytes:
+    return security._payload_fernet.decrypt(token + "=" * (-len(token) % 4))
+
+
+def test_large_payload_is_compressed_before_encryption():
+    data = {"students": [{"name": "Nguyen Van A", "score": i} for i in range(200)]}
+    token = security.obfuscate_payload(data)
+
+    plain = _plaintext(token)
+    assert plain[:1] == b"\x01"
+    assert json.loads(zlib.decompress(plain[1:])) == data
+    assert len(token) < len(json.dumps(data)) / 2
+    assert security.deobfuscate_payload(token) == data
+
+
+def test_small_payload_stays_raw_json():
+    token = security.obfuscate_payload({"ok": True})
+    assert _plaintext(token) == b'{"ok":true}'
+    assert security.deobfuscate_payload(token) == {"ok": True}
+
+
+def test_legacy_payload_still_decodes():
+    legacy = security._payload_fernet.encrypt(b'{"messages":[]}').decode().replace("=", "")
+    assert security.deobfuscate_payload(legacy) == {"messages": []}
@@ -0,0 +1,38 @@
+from datetime import datetime
+
+import pytest
+
+import cache
+import cache_codec
+import security
+
+
+@pytest.fixture(autouse=True)
+def clean_cache():
+    cache.clear_all()
+    yield
+    cache.clear_all()
+
+
+def _principal():
+    return security.Principal(
+        id=7, username="alice", role=0, full_name="Alice", class_change_limit=5,
+        reset_limit_at=datetime(2024, 5, 1, 8, 30), created_at=None,
+    )
+
+
+def test_principal_cache_form_is_plain_data():
+    principal = _principal()
+    raw = cache_codec.encode(principal.to_cache())
+    assert raw[0] & 0x0F != cache_codec.CODEC_PICKLE
+    assert security.Principal.from_cache(cache_codec.decode(raw)) == principal
+
+
+def test_principal_is_immutable():
+    with pytest.raises(AttributeError):
+        _principal().role = 1
+
+
+def test_cached_principal_is_served_without_db():
+    cache.set("user:v2:alice", _principal().to_cache(), ttl=60)
+    assert security._get_user_from_cache_or_db("alice", db=None) == _principal()
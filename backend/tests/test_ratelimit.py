@@ -0,0 +1,81 @@
+import pytest
+
+import ratelimit
+
+
+@pytest.fixture(autouse=True)
+def memory_limiter(monkeypatch):
+    monkeypatch.setattr(ratelimit._cache, "redis_client", lambda: None)
+    ratelimit.reset()
+    yield
+    ratelimit.reset()
+
+
+def _freeze(monkeypatch, now):
+    monkeypatch.setattr(ratelimit.time, "time", lambda: now)
+
+
+def test_limit_within_window(monkeypatch):
+    _freeze(monkeypatch, 1000.0)
+    assert all(ratelimit.allow("search", "1.2.3.4", 3, 60) for _ in range(3))
+    assert ratelimit.allow("search", "1.2.3.4", 3, 60) is False
+    # Identity khác có bộ đếm riêng
+    assert ratelimit.allow("search", "5.6.7.8", 3, 60) is True
+
+
+def test_rejected_requests_are_not_counted(monkeypatch):
+    _freeze(monkeypatch, 1000.0)
+    for _ in range(2):
+        ratelimit.allow("login-ip", "ip", 2, 60)
+    for _ in range(10):
+        assert ratelimit.allow("login-ip", "ip", 2, 60) is False
+    # 2 request ở cửa sổ trước, trọng số còn 0.5 → ước lượng 1 < 2
+    _freeze(monkeypatch, 1050.0)
+    assert ratelimit.allow("login-ip", "ip", 2, 60) is True
+
+
+def test_previous_window_is_weighted(monkeypatch):
+    _freeze(monkeypatch, 960.0)  # đầu cửa sổ [960, 1020)
+    for _ in range(4):
+        assert ratelimit.allow("search", "x", 4, 60)
+    # 15s vào cửa sổ sau: 4 * 0.75 = 3 → còn đúng 1 request
+    _freeze(monkeypatch, 1035.0)
+    assert ratelimit.allow("search", "x", 4, 60) is True
+    assert ratelimit.allow("search", "x", 4, 60) is False
+    # Hai cửa sổ sau: bộ đếm cũ không còn tác dụng
+    _freeze(monkeypatch, 1140.0)
+    assert all(ratelimit.allow("search", "x", 4, 60) for _ in range(4))
+
+
+def test_memory_structure_is_bounded(monkeypatch):
+    monkeypatch.setattr(ratelimit, "_MAX_KEYS", 10)
+    for i in range(50):
+        ratelimit.allow("search", f"ip-{i}", 5, 60)
+    assert len(ratelimit._windows) == 10
+
+
+@pytest.mark.asyncio
+async def test_async_chat_limit(monkeypatch):
+    monkeypatch.setattr(ratelimit._cache, "async_redis_client", lambda: None)
+    _freeze(monkeypatch, 1000.0)
+    assert await ratelimit.aallow("chat", "user:alice", 1, 2) is True
+    assert await ratelimit.aallow("chat", "user:alice", 1, 2) is False
+
+
+def test_lua_script_registered_once_per_client(monkeypatch):
+    class FakeRedis:
+        registered = 0
+
+        def register_script(self, source):
+            FakeRedis.registered += 1
+            return lambda keys, args: 1
+
+    client = FakeRedis()
+    monkeypatch.setattr(ratelimit._cache, "redis_client", lambda: client)
+    monkeypatch.setattr(ratelimit, "_scripts", type(ratelimit._scripts)())
+    assert all(ratelimit.allow("search", "ip", 100, 60) for _ in range(5))
+    assert FakeRedis.registered == 1
+
+    client = FakeRedis()  # client mới (breaker promote lại) → register lại
+    assert ratelimit.allow("search", "ip", 100, 60)
+    assert FakeRedis.registered == 2
@@ -0,0 +1,74 @@
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+import database
+import models
+import replicas
+import security
+
+
+def _urls(tmp_path, n=2):
+    return [f"sqlite:///{tmp_path / f'replica{i}.db'}" for i in range(n)]
+
+
+def test_round_robin_skips_unhealthy(tmp_path):
+    rs = replicas.ReplicaSet(_urls(tmp_path, 3), pin_seconds=0)
+    assert [rs.pick().name for _ in range(3)] == ["replica-0", "replica-1", "replica-2"]
+
+    rs.replicas[1].mark_down("test")
+    assert [rs.pick().name for _ in range(4)] == ["replica-0", "replica-2", "replica-2", "replica-0"]
+
+    for replica in rs.replicas:
+        replica.mark_down("test")
+    assert rs.pick() is None
+
+
+def test_health_check_restores_and_drops(tmp_path):
+    rs = replicas.ReplicaSet(_urls(tmp_path, 1) + [f"sqlite:///{tmp_path / 'missing' / 'x.db'}"], pin_seconds=0)
+    rs.replicas[0].mark_down("test")
+    rs.check_all()
+    assert [r["healthy"] for r in rs.stats()] == [True, False]
+
+
+def _request_scope(username):
+    return {"type": "http", "headers": [], "state": {"auth": security.AuthContext(claims={"sub": username})}}
+
+
+def _read_bind():
+    gen = replicas.get_read_db()
+    bind = next(gen).get_bind()
+    gen.close()
+    return bind
+
+
+def _write(engine, msv):
+    with sessionmaker(bind=engine)() as db:
+        db.add(models.SinhVien(msv=msv, ho_ten="Nguyen Van A", ma_lop="CNTT1"))
+        db.commit()
+
+
+def test_reads_pinned_to_primary_after_write(tmp_path, monkeypatch):
+    rs = replicas.ReplicaSet(_urls(tmp_path, 1), pin_seconds=60)
+    monkeypatch.setattr(replicas, "_replicas", rs)
+    engine = create_engine(f"sqlite:///{tmp_path / 'primary.db'}")
+    database.Base.metadata.create_all(bind=engine)
+
+    # Ghi ngoài request (access_recorder, WebSocket...) không pin ai
+    _write(engine, "2251120001")
+    assert _read_bind() is rs.replicas[0].engine
+
+    token = replicas.bind_request(_request_scope("alice"))
+    try:
+        assert _read_bind() is rs.replicas[0].engine
+        _write(engine, "2251120002")
+        assert _read_bind() is database.engine
+    finally:
+        replicas.unbind_request(token)
+
+    # Request sau của cùng user vẫn về primary; user khác vẫn đọc replica
+    for username, expected in (("alice", database.engine), ("bob", rs.replicas[0].engine)):
+        token = replicas.bind_request(_request_scope(username))
+        try:
+            assert _read_bind() is expected
+        finally:
+            replicas.unbind_request(token)
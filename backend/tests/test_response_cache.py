@@ -0,0 +1,57 @@
+import gzip
+import json
+
+import pytest
+from fastapi import FastAPI, Request
+from fastapi.middleware.gzip import GZipMiddleware
+from httpx import ASGITransport, AsyncClient
+
+import response_cache
+
+_BIG = {"students": [{"name": f"Student {i}", "score": i % 10} for i in range(200)]}
+
+
+def test_encode_precomputes_gzip_only_for_large_bodies():
+    body, gz, _ = response_cache.encode(_BIG)
+    assert json.loads(body) == _BIG
+    assert gzip.decompress(gz) == body
+
+    small_body, small_gz, small_br = response_cache.encode({"count": 3})
+    assert small_body == b'{"count":3}'
+    assert small_gz is None and small_br is None
+
+
+def _app(entry) -> FastAPI:
+    app = FastAPI()
+
+    @app.get("/cached")
+    def cached(request: Request):
+        return response_cache.respond(request, entry)
+
+    app.add_middleware(GZipMiddleware, minimum_size=1024)
+    return app
+
+
+async def _get(entry, accept_encoding: str):
+    async with AsyncClient(transport=ASGITransport(app=_app(entry)), base_url="http://localhost") as ac:
+        return await ac.get("/cached", headers={"Accept-Encoding": accept_encoding})
+
+
+@pytest.mark.asyncio
+async def test_hit_serves_precompressed_variant():
+    entry = response_cache.encode(_BIG)
+    response = await _get(entry, "gzip, deflate")
+    assert response.headers["content-encoding"] == "gzip"
+    assert response.headers["vary"] == "Accept-Encoding"
+    assert int(response.headers["content-length"]) == len(entry[1])
+    assert response.json() == _BIG
+
+    identity = await _get(entry, "identity")
+    assert "content-encoding" not in identity.headers
+    assert identity.content == entry[0]
+
+
+@pytest.mark.asyncio
+async def test_legacy_string_entries_still_served():
+    response = await _get("gAAAAABlegacy", "gzip")
+    assert response.json() == "gAAAAABlegacy"
@@ -0,0 +1,55 @@
+import pytest
+
+import cache
+import revocation
+import security
+from sketches import BloomFilter
+
+
+@pytest.fixture(autouse=True)
+def synced_filter():
+    cache.clear_all()
+    revocation.resync()
+    yield
+    cache.clear_all()
+    revocation.resync()
+
+
+def test_bloom_filter_has_no_false_negatives():
+    bloom = BloomFilter(capacity=1000, error_rate=0.01)
+    items = [f"hash-{i}" for i in range(1000)]
+    for item in items:
+        bloom.add(item)
+    assert all(item in bloom for item in items)
+    false_positives = sum(f"other-{i}" in bloom for i in range(10000))
+    assert false_positives < 300
+
+
+def test_unrevoked_token_skips_cache_lookup(monkeypatch):
+    lookups = []
+    real_get = cache.get
+    monkeypatch.setattr(cache, "get", lambda key: lookups.append(key) or real_get(key))
+
+    token = security.create_access_token({"sub": "alice"})
+    assert security.is_token_revoked(token) is False
+    assert lookups == []
+
+    security.revoke_token(token)
+    assert security.is_token_revoked(token) is True
+    assert lookups == [f"revoked_token:{security._token_hash(token)}"]
+
+
+def test_resync_picks_up_revocations_from_other_workers():
+    token = security.create_access_token({"sub": "bob"})
+    token_hash = security._token_hash(token)
+    # Worker khác ghi trực tiếp vào cache dùng chung
+    cache.set(f"revoked_token:{token_hash}", True, ttl=60)
+    assert revocation.might_be_revoked(token_hash) is False
+
+    assert revocation.resync() == 1
+    assert security.is_token_revoked(token) is True
+
+
+def test_filter_untrusted_before_first_sync(monkeypatch):
+    monkeypatch.setattr(revocation, "_ready", False)
+    assert revocation.might_be_revoked("anything") is True
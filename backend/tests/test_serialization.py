@@ -0,0 +1,35 @@
+import json
+from datetime import date, datetime
+from decimal import Decimal
+
+import serialization
+import security
+
+
+def test_dumps_is_compact_utf8_and_handles_dates():
+    value = {
+        "name": "Nguyễn Văn A",
+        "at": datetime(2024, 5, 1, 8, 30),
+        "day": date(2024, 5, 1),
+        "score": Decimal("8.5"),
+        1: [1, 2],
+    }
+    raw = serialization.dumps(value)
+    assert isinstance(raw, bytes)
+    assert b" " not in raw.replace("Nguyễn Văn A".encode(), b"")
+    assert "Nguyễn".encode() in raw
+    assert json.loads(raw) == {
+        "name": "Nguyễn Văn A", "at": "2024-05-01T08:30:00", "day": "2024-05-01", "score": 8.5, "1": [1, 2],
+    }
+    assert serialization.loads(serialization.dumps_str({"a": 1})) == {"a": 1}
+
+
+def test_fast_json_response_renders_with_dates():
+    response = serialization.FastJSONResponse({"at": datetime(2024, 5, 1)})
+    assert response.body == b'{"at":"2024-05-01T00:00:00"}'
+    assert response.media_type == "application/json"
+
+
+def test_obfuscated_payload_round_trips_datetimes():
+    token = security.obfuscate_payload({"at": datetime(2024, 5, 1, 8, 30)})
+    assert security.deobfuscate_payload(token) == {"at": "2024-05-01T08:30:00"}
@@ -1,6 +1,7 @@
 import { cookies, headers } from 'next/headers';
 import { createDecipheriv, createHash, createHmac } from 'node:crypto';
 import dns from 'node:dns';
+import { inflateSync } from 'node:zlib';
 import { z } from 'zod';
 
 try { dns.setDefaultResultOrder('ipv4first'); } catch (_) {}
@@ -14,11 +15,26 @@ export function getApiBaseUrl(): string {
 export const API_BASE_URL = process.env.API_URL || process.env.NEXT_PUBLIC_API_URL || 'http://127.0.0.1:8000';
 const BFF_CACHE_MAX_KEYS = Number(process.env.BFF_CACHE_MAX_KEYS || 1000);
 
+// Trusted internal channel: with INTERNAL_API_SECRET set (same value as the backend),
+// the backend skips payload encryption and returns plain JSON to the BFF.
+// The signature binds timestamp + method + path + query, so it is only valid for this request.
+function internalAuthHeader(url: string, method: string): string | null {
+    const secret = process.env.INTERNAL_API_SECRET;
+    if (!secret) return null;
+    const ts = Math.floor(Date.now() / 1000).toString();
+    const target = new URL(url, getApiBaseUrl());
+    const message = `${ts}\n${method.toUpperCase()}\n${target.pathname}\n${target.search.slice(1)}`;
+    return `${ts}.${createHmac('sha256', secret).update(message).digest('hex')}`;
+}
+
 export async function fetchUpstream(url: string, init?: RequestInit): Promise<{ status: number, body: string }> {
     const controller = new AbortController();
     const timer = setTimeout(() => controller.abort(), 10000);
     try {
-        const res = await fetch(url, { ...init, signal: init?.signal || controller.signal });
+        const headers = new Headers(init?.headers);
+        const internalAuth = internalAuthHeader(url, init?.method || 'GET');
+        if (internalAuth) headers.set('X-Internal-Auth', internalAuth);
+        const res = await fetch(url, { ...init, headers, signal: init?.signal || controller.signal });
         const text = await res.text();
         return { status: res.status, body: maybeDecryptUpstreamBody(text) ?? text };
     } finally {
@@ -46,6 +62,8 @@ function getPayloadKey(): string | undefined {
     return undefined;
 }
 
+const PAYLOAD_ZLIB = 0x01;
+
 function maybeDecryptUpstreamBody(text: string): string | null {
     const payloadKey = getPayloadKey();
     if (!payloadKey) return null;
@@ -69,6 +87,10 @@ function maybeDecryptUpstreamBody(text: string): string | null {
         const aesKey = digest.subarray(16, 32);
         const decipher = createDecipheriv('aes-128-cbc', aesKey, iv);
         const decrypted = Buffer.concat([decipher.update(ciphertext), decipher.final()]);
+        // Envelope: 0x01 + zlib(JSON) (compressed before encryption); otherwise legacy raw JSON
+        if (decrypted[0] === PAYLOAD_ZLIB) {
+            return inflateSync(decrypted.subarray(1)).toString('utf8');
+        }
         return decrypted.toString('utf8');
     } catch {
         return null;